@@ -0,0 +1,50 @@
+"""
+Benchmark: single row POST /recommendations against POST /recommendations/bulk
+
+Usage:
+    python -m benchmarks.bench_bulk_create --single 2000 --bulk 100000
+"""
+import argparse
+import json
+import time
+from benchmarks.common import database_uri, generate_rows, load_app
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--single", type=int, default=2000, help="rows created one request each")
+    parser.add_argument("--bulk", type=int, default=100000, help="rows created in one bulk request")
+    args = parser.parse_args()
+
+    app = load_app(database_uri(args.database_uri))
+    from service.models import db  # pylint: disable=import-outside-toplevel
+
+    client = app.test_client()
+    db.drop_all()
+    db.create_all()
+
+    start = time.perf_counter()
+    for row in generate_rows(args.single, 10000):
+        resp = client.post("/recommendations", json=row, content_type="application/json")
+        assert resp.status_code == 201, resp.data
+    single = args.single / (time.perf_counter() - start)
+
+    # start over, the bulk rows may repeat a pair of the single ones
+    db.drop_all()
+    db.create_all()
+    body = json.dumps(list(generate_rows(args.bulk, 10000, seed=7)))
+    start = time.perf_counter()
+    resp = client.post("/recommendations/bulk", data=body, content_type="application/json")
+    assert resp.status_code == 201, resp.data[:200]
+    bulk = args.bulk / (time.perf_counter() - start)
+
+    print("{:<8} {:>12}".format("path", "rows/s"))
+    print("{:<8} {:>12.0f}".format("single", single))
+    print("{:<8} {:>12.0f}".format("bulk", bulk))
+    print("speedup  {:>11.1f}x".format(bulk / single))
+
+
+if __name__ == "__main__":
+    main()
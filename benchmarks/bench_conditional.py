@@ -0,0 +1,45 @@
+"""
+Benchmark: polling with If-None-Match against full responses
+
+Usage:
+    python -m benchmarks.bench_conditional --rows 100000 --repeat 50
+
+Times GET /recommendations?recom_type=A and GET /recommendations/<id>
+through the Flask test client, once without and once with the ETag of
+the previous response.
+"""
+import argparse
+from benchmarks.common import database_uri, load_app, populate, timed
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    app = load_app(database_uri(args.database_uri))
+    from service.models import db  # pylint: disable=import-outside-toplevel
+
+    db.drop_all()
+    db.create_all()
+    print("Loading {} rows ...".format(args.rows))
+    populate(db, args.rows, args.products)
+    client = app.test_client()
+
+    for url in ["/recommendations?recom_type=A", "/recommendations/7"]:
+        first = client.get(url)
+        etag = first.headers["ETag"]
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+        full = timed(lambda: client.get(url), args.repeat)
+        conditional = timed(lambda: client.get(url, headers={"If-None-Match": etag}), args.repeat)
+        print("{:<32} 200 {:>9.3f} ms  304 {:>7.3f} ms  ({} bytes saved)".format(
+            url, full * 1000, conditional * 1000, len(first.data)
+        ))
+
+
+if __name__ == "__main__":
+    main()
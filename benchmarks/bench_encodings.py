@@ -0,0 +1,73 @@
+"""
+Benchmark: size and parse time of the list encodings and compressions
+
+Usage:
+    python -m benchmarks.bench_encodings --rows 100000
+
+Times GET /recommendations through the Flask test client in every media
+type and content coding, and how long a Python client takes to decompress
+and parse each body.
+"""
+import argparse
+import gzip
+import json
+import time
+from benchmarks.common import database_uri, load_app, populate, timed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MEDIA_TYPES = ["application/json", "application/vnd.recommendations.columnar+json", "application/msgpack"]
+
+
+def decode(data, media_type, coding):
+    """ Decompresses and parses a body """
+    if coding == "gzip":
+        data = gzip.decompress(data)
+    elif coding == "br":
+        data = brotli.decompress(data)
+    if media_type == "application/msgpack":
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = load_app(database_uri(args.database_uri))
+    from service.models import db  # pylint: disable=import-outside-toplevel
+
+    db.drop_all()
+    db.create_all()
+    print("Loading {} rows ...".format(args.rows))
+    populate(db, args.rows, args.products)
+    client = app.test_client()
+
+    codings = ["identity", "gzip"] + (["br"] if brotli else [])
+    for media_type in MEDIA_TYPES if msgpack else MEDIA_TYPES[:2]:
+        for coding in codings:
+            headers = {"Accept": media_type, "Accept-Encoding": coding}
+            start = time.perf_counter()
+            data = client.get("/recommendations", headers=headers).data
+            server = time.perf_counter() - start
+            server = min(server, timed(lambda: client.get("/recommendations", headers=headers), args.repeat))
+            parse = timed(lambda: decode(data, media_type, coding), args.repeat)
+            print("{:<46} {:<8} {:>12,} bytes  server {:>7.1f} ms  client {:>7.1f} ms".format(
+                media_type, coding, len(data), server * 1000, parse * 1000
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark: k-hop recommendation graph in one call against walking it from the client
+
+Usage:
+    python -m benchmarks.bench_graph --rows 1000000 --depth 2 --fanout 10
+
+Walks the graph of a few products through the Flask test client, the way
+a client does without the graph endpoint: one GET /products/<p>/recommendations
+for every product reached, merged and scored on the client. Then asks
+GET /products/<p>/graph for the same walk. The list cache is off, so every
+call goes to the database.
+"""
+import argparse
+from benchmarks.common import database_uri, load_app, populate, product_name, timed
+
+
+def walk(client, product, depth, fanout):
+    """ Returns the {product: [depth, score]} a client walk reaches and the requests it made """
+    reached = {product: [0, 0]}
+    frontier = [product]
+    requests = 0
+    for hop in range(1, depth + 1):
+        next_frontier = []
+        for product_a in frontier:
+            requests += 1
+            for row in client.get("/products/{}/recommendations?limit={}".format(product_a, fanout)).get_json():
+                node = reached.get(row["product_b"])
+                if node is None:
+                    node = reached[row["product_b"]] = [hop, 0]
+                    next_frontier.append(row["product_b"])
+                node[1] += row["likes"]
+        frontier = next_frontier
+    del reached[product]
+    return reached, requests
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app = load_app(database_uri(args.database_uri))
+    from service.models import db  # pylint: disable=import-outside-toplevel
+
+    app.config["GRAPH_MAX_DEPTH"] = max(app.config["GRAPH_MAX_DEPTH"], args.depth)
+    app.config["GRAPH_MAX_PRODUCTS"] = args.products  # the client walk has no cap
+    db.drop_all()
+    db.create_all()
+    print("Loading {:,} rows ...".format(args.rows))
+    populate(db, args.rows, args.products)
+    client = app.test_client()
+    products = [product_name(number) for number in range(0, args.products, args.products // 10)]
+    url = "/products/{}/graph?depth={}&fanout={}"
+
+    requests = 0
+    for product in products:
+        reached, count = walk(client, product, args.depth, args.fanout)
+        requests += count
+        graph = client.get(url.format(product, args.depth, args.fanout)).get_json()
+        assert reached == {p["product"]: [p["depth"], p["score"]] for p in graph["products"]}
+
+    def client_walk():
+        for product in products:
+            walk(client, product, args.depth, args.fanout)
+
+    def graph_call():
+        for product in products:
+            client.get(url.format(product, args.depth, args.fanout))
+
+    print("{:<22} {:>12} {:>10}".format("", "requests", "ms"))
+    print("{:<22} {:>12.1f} {:>10.2f}".format(
+        "client walk", requests / len(products), timed(client_walk, args.repeat) / len(products) * 1000))
+    print("{:<22} {:>12.1f} {:>10.2f}".format(
+        "graph endpoint", 1, timed(graph_call, args.repeat) / len(products) * 1000))
+
+
+if __name__ == "__main__":
+    main()
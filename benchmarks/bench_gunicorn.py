@@ -0,0 +1,81 @@
+"""
+Benchmark: throughput of the old one sync worker setup against gunicorn_config.py
+
+Starts gunicorn with each setup on a seeded database and sends reads by id
+and filtered lists from keep-alive client threads for a fixed time.
+
+Usage:
+    python -m benchmarks.bench_gunicorn --seconds 10 --clients 16
+"""
+import time
+import random
+import argparse
+import threading
+import http.client
+from benchmarks.common import database_uri, load_app, populate, product_name, start_gunicorn
+
+SETUPS = [
+    ("1 sync worker", ["--workers=1"]),
+    ("gunicorn_config.py", ["--config=gunicorn_config.py"]),
+]
+
+
+def hammer(port, seconds, clients, rows, products):
+    """ Returns the requests per second answered by the server """
+    done = []
+    deadline = time.monotonic() + seconds
+
+    def client():
+        rand = random.Random()
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        count = 0
+        while time.monotonic() < deadline:
+            if rand.random() < 0.8:
+                conn.request("GET", "/recommendations/{}".format(rand.randint(1, rows)))
+            else:
+                conn.request("GET", "/recommendations?product_a=" + product_name(rand.randrange(products)))
+            conn.getresponse().read()
+            count += 1
+        done.append(count)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done) / seconds
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--port", type=int, default=5099)
+    args = parser.parse_args()
+
+    uri = database_uri(args.database_uri)
+    load_app(uri)
+    from service.models import db  # pylint: disable=import-outside-toplevel
+
+    db.drop_all()
+    db.create_all()
+    populate(db, args.rows, args.products)
+    db.session.remove()
+
+    print("{:<20} {:>10}".format("setup", "req/s"))
+    for name, options in SETUPS:
+        server = start_gunicorn(options, args.port, uri)
+        try:
+            print("{:<20} {:>10.0f}".format(name, hammer(args.port, args.seconds, args.clients,
+                                                         args.rows, args.products)))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
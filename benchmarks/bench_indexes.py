@@ -0,0 +1,63 @@
+"""
+Benchmark: find_by_* query times with and without the lookup indexes
+
+Fills the recommendation table, times every lookup on the bare table, then
+adds the indexes through the migrations (as on a live table) and times the
+lookups again.
+
+Usage:
+    python -m benchmarks.bench_indexes --rows 1000000
+"""
+import argparse
+from benchmarks.common import database_uri, load_app, populate, product_name, timed
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    load_app(database_uri(args.database_uri))
+    from sqlalchemy import inspect  # pylint: disable=import-outside-toplevel
+    from service.models import Recommendation, db  # pylint: disable=import-outside-toplevel
+    from service.migrations import schema_version, upgrade  # pylint: disable=import-outside-toplevel
+
+    db.drop_all()
+    db.create_all()
+    print("Loading {} rows ...".format(args.rows))
+    populate(db, args.rows, args.products)
+
+    product = product_name(7)
+    queries = [
+        ("find_by_product_a", lambda: Recommendation.find_by_product_a(product).all()),
+        ("find_by_product_b", lambda: Recommendation.find_by_product_b(product).all()),
+        ("find_by_recommendation_type", lambda: Recommendation.find_by_recommendation_type("A").all()),
+        ("find_by_recommendation_type_and_product_a",
+         lambda: Recommendation.find_by_recommendation_type_and_product_a("A", product).all()),
+        ("find_by_recommendation_type_and_product_b",
+         lambda: Recommendation.find_by_recommendation_type_and_product_b("A", product).all()),
+    ]
+
+    # start from a table without the secondary indexes
+    for index in inspect(db.engine).get_indexes("recommendation"):
+        db.engine.execute("DROP INDEX {}".format(index["name"]))
+    db.engine.execute(schema_version.delete())
+    before = {name: timed(query, args.repeat) for name, query in queries}
+    db.session.remove()
+
+    upgrade(db.engine)
+    after = {name: timed(query, args.repeat) for name, query in queries}
+
+    print("{:<45} {:>12} {:>12} {:>9}".format("query", "no index ms", "indexed ms", "speedup"))
+    for name, _ in queries:
+        print("{:<45} {:>12.2f} {:>12.2f} {:>8.1f}x".format(
+            name, before[name] * 1000, after[name] * 1000, before[name] / after[name]
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: cost of logging on the request path
+
+Usage:
+    python -m benchmarks.bench_logging --requests 2000 --write-delay-ms 0.2
+
+Times GET /recommendations?product_a=... and GET /recommendations/<id>
+through the Flask test client, each setup in a fresh interpreter that
+logs at INFO to a file the way gunicorn's error log does:
+
+    inline           LOG_QUEUE_SIZE=0, no access log (how the service logged before)
+    queue            records written by the listener thread, plus the access log
+    queue + limits   the same, with the lookup logs limited to 20 a second
+
+--write-delay-ms makes every write to the log file that much slower, like
+a busy disk or a slow log collector reading the pipe.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.common import database_uri, load_app, populate, product_name
+
+SETUPS = [
+    ("inline", {"LOG_QUEUE_SIZE": "0", "LOG_ACCESS": "false"}),
+    ("queue", {"LOG_QUEUE_SIZE": "10000", "LOG_ACCESS": "true"}),
+    ("queue + limits", {"LOG_QUEUE_SIZE": "10000", "LOG_ACCESS": "true", "LOG_RATE_LIMIT": "INFO=20"}),
+]
+
+
+class SlowFileHandler(logging.FileHandler):
+    """ A FileHandler that takes a while to write each record """
+
+    delay_seconds = 0.0
+
+    def emit(self, record):
+        if self.delay_seconds:
+            time.sleep(self.delay_seconds)
+        super().emit(record)
+
+
+def worker(args):
+    """ Times the requests in this interpreter and prints the results as JSON """
+    log_file = os.path.join(tempfile.gettempdir(), "recommendations-bench.log")
+    SlowFileHandler.delay_seconds = args.write_delay_ms / 1000
+    gunicorn_logger = logging.getLogger("gunicorn.error")
+    gunicorn_logger.addHandler(SlowFileHandler(log_file, mode="w"))
+    gunicorn_logger.setLevel(logging.INFO)
+
+    app = load_app(database_uri(args.database_uri))
+    from service.models import db  # pylint: disable=import-outside-toplevel
+
+    db.drop_all()
+    db.create_all()
+    populate(db, args.rows, args.products)
+    client = app.test_client()
+    results = {}
+    for name, url in [("list by product_a", lambda n: "/recommendations?product_a=" + product_name(n % args.products)),
+                      ("read by id", lambda n: "/recommendations/{}".format(n % args.rows + 1))]:
+        for number in range(100):
+            client.get(url(number))
+        start = time.perf_counter()
+        for number in range(args.requests):
+            client.get(url(number))
+        results[name] = (time.perf_counter() - start) / args.requests
+    start = time.perf_counter()
+    for handler in app.logger.handlers:
+        if hasattr(handler, "stop"):
+            handler.stop()
+    results["drain"] = time.perf_counter() - start
+    with open(log_file) as lines:
+        results["lines"] = sum(1 for _ in lines)
+    json.dump(results, sys.stdout)
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--write-delay-ms", type=float, default=0.0)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    print("{:<16} {:>22} {:>22} {:>12} {:>10}".format(
+        "setup", "list by product_a us", "read by id us", "drain ms", "lines"))
+    for name, env in SETUPS:
+        command = [sys.executable, "-m", "benchmarks.bench_logging", "--worker"] + sys.argv[1:]
+        output = subprocess.run(command, stdout=subprocess.PIPE, check=True,
+                                env=dict(os.environ, **env)).stdout
+        results = json.loads(output)
+        print("{:<16} {:>22.1f} {:>22.1f} {:>12.1f} {:>10}".format(
+            name, results["list by product_a"] * 1e6, results["read by id"] * 1e6,
+            results["drain"] * 1000, results["lines"]))
+
+
+if __name__ == "__main__":
+    main()
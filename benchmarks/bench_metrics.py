@@ -0,0 +1,94 @@
+"""
+Benchmark: cost of the Prometheus instrumentation
+
+Usage:
+    python -m benchmarks.bench_metrics --requests 2000
+
+Times GET /recommendations/<id> through the Flask test client in two fresh
+interpreters, one with METRICS_ENABLED=false and one with it on, and
+times the request and SQL hooks of service/metrics.py on their own.
+Set PROMETHEUS_MULTIPROC_DIR to measure the file backed values gunicorn
+workers use.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from benchmarks.common import database_uri, load_app, populate
+
+
+def per_request(client, requests):
+    """ Returns the mean seconds of a GET /recommendations/<id> """
+    for _ in range(100):
+        client.get("/recommendations/7")
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get("/recommendations/7")
+    return (time.perf_counter() - start) / requests
+
+
+def hooks(app, count):
+    """ Returns the mean seconds of the request hooks and of the SQL hooks """
+    from service import metrics  # pylint: disable=import-outside-toplevel
+
+    response = app.response_class()
+    info = {}
+    conn = type("Connection", (), {"info": info})()
+    with app.test_request_context("/recommendations/7"):
+        app.url_map.bind("localhost").match("/recommendations/7")
+        start = time.perf_counter()
+        for _ in range(count):
+            metrics.start_request()
+            metrics.record_status(response)
+            metrics.finish_request()
+        request_hooks = (time.perf_counter() - start) / count
+        metrics.start_request()
+        start = time.perf_counter()
+        for _ in range(count):
+            metrics.start_query(conn, None, "", None, None, False)
+            metrics.finish_query(conn, None, "", None, None, False)
+        query_hooks = (time.perf_counter() - start) / count
+        metrics.finish_request()
+    return request_hooks, query_hooks
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    uri = database_uri(args.database_uri)
+    if args.worker:
+        app = load_app(uri)
+        print(per_request(app.test_client(), args.requests))
+        if app.config["METRICS_ENABLED"]:
+            print(*hooks(app, args.requests * 10))
+        return
+
+    app = load_app(uri)
+    from service.models import db  # pylint: disable=import-outside-toplevel
+
+    db.drop_all()
+    db.create_all()
+    populate(db, 1000, 100)
+    results = {}
+    for enabled in ("false", "true"):
+        env = dict(os.environ, METRICS_ENABLED=enabled)
+        command = [sys.executable, "-m", "benchmarks.bench_metrics", "--worker", "--database-uri", uri,
+                   "--requests", str(args.requests)]
+        output = subprocess.run(command, env=env, check=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True).stdout.split()
+        results[enabled] = [float(value) for value in output]
+    off, on = results["false"][0], results["true"][0]
+    print("GET /recommendations/7 without metrics {:>8.1f} us".format(off * 1e6))
+    print("GET /recommendations/7 with metrics    {:>8.1f} us  (+{:.1f} us)".format(on * 1e6, (on - off) * 1e6))
+    print("request hooks                          {:>8.1f} us".format(results["true"][1] * 1e6))
+    print("SQL hooks per statement                {:>8.1f} us".format(results["true"][2] * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Benchmark: size and lookup times of product names against product ids
+
+Usage:
+    python -m benchmarks.bench_products --rows 1000000 --products 10000
+
+Fills the recommendation table the way it was before migration 7, with
+the product names on every row, and measures the table, its indexes and
+the lookups. Then runs migration 7, which moves the names into the
+product table, and measures the same again. The lookups are Core selects
+in both layouts. With product ids they include turning the product name
+into an id and the ids of the rows back into names through the interned
+names, first with a warm cache and then with the cache cleared before
+every lookup. Both layouts are vacuumed before they are measured,
+PostgreSQL only gives back the space of dropped columns on a rewrite.
+"""
+import argparse
+import itertools
+import time
+from benchmarks.common import database_uri, generate_rows, load_app, product_name, timed
+
+NAMED_COLUMNS = ("id", "product_a", "product_b", "recom_type", "likes", "version")
+
+
+def create_named_table(db, rows, products, chunk_size=10000):
+    """ Replaces the recommendation table with one of product names and fills it """
+    from service.models import Product, Recommendation, RecommendationLikeShard  # pylint: disable=import-outside-toplevel
+
+    db.session.remove()
+    RecommendationLikeShard.__table__.drop(db.engine)
+    Recommendation.__table__.drop(db.engine)
+    Product.__table__.drop(db.engine)
+    key = "SERIAL PRIMARY KEY" if db.engine.dialect.name == "postgresql" else "INTEGER PRIMARY KEY AUTOINCREMENT"
+    db.engine.execute(
+        "CREATE TABLE recommendation (id {}, product_a VARCHAR(128) NOT NULL, product_b VARCHAR(128) NOT NULL, "
+        "recom_type VARCHAR(1) NOT NULL, likes INTEGER, version INTEGER NOT NULL DEFAULT 1)".format(key)
+    )
+    RecommendationLikeShard.__table__.create(db.engine)
+    table = db.table("recommendation", *(db.column(name) for name in NAMED_COLUMNS))
+    chunk = []
+    with db.engine.begin() as conn:
+        for row in generate_rows(rows, products):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                conn.execute(table.insert(), chunk)
+                chunk = []
+        if chunk:
+            conn.execute(table.insert(), chunk)
+    return table
+
+
+def vacuum(db):
+    """ Compacts the tables so that their sizes only count live rows """
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if conn.dialect.name == "postgresql":
+            conn.execute("VACUUM FULL ANALYZE recommendation")
+            conn.execute("VACUUM FULL ANALYZE product")
+        else:
+            conn.execute("VACUUM")
+            conn.execute("ANALYZE")
+
+
+def sizes(db):
+    """ Returns the bytes of the recommendation and product tables and of their indexes """
+    with db.engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            result = {}
+            for table in ("recommendation", "product"):
+                if conn.execute("SELECT to_regclass(%s)", table).scalar():
+                    result[table] = conn.execute("SELECT pg_relation_size(%s)", table).scalar()
+                    result[table + " indexes"] = conn.execute("SELECT pg_indexes_size(%s)", table).scalar()
+            return result
+        result = {}
+        for table, kind, size in conn.execute(
+            "SELECT m.tbl_name, m.type, SUM(d.pgsize) FROM dbstat AS d JOIN sqlite_master AS m ON m.name = d.name "
+            "WHERE m.tbl_name IN ('recommendation', 'product') GROUP BY m.tbl_name, m.type"
+        ):
+            result[table if kind == "table" else table + " indexes"] = size
+        return result
+
+
+def lookups(db, table, products, rows, resolve=None):
+    """ Returns the functions that time each lookup, 100 of them a call
+
+    Args:
+        table (TableClause): the recommendation table to read
+        resolve (function): turns a product name into the value of its
+            column, and the rows read into rows of names, None for names
+    """
+    names = itertools.cycle([product_name(number) for number in range(0, products, max(products // 100, 1))])
+    ids = itertools.cycle(range(1, rows + 1, max(rows // 100, 1)))
+    columns = [table.c.id, table.c.product_a_id if resolve else table.c.product_a,
+               table.c.product_b_id if resolve else table.c.product_b, table.c.recom_type, table.c.likes]
+    product_a, product_b = columns[1:3]
+
+    def read(statement):
+        result = db.session.execute(statement).fetchall()
+        return resolve.rows(result) if resolve else [tuple(row) for row in result]
+
+    def value(name):
+        return resolve.product(name) if resolve else name
+
+    def run(lookup):
+        def hundred():
+            for _ in range(100):
+                lookup()
+        return hundred
+
+    return [
+        ("list by product_a", run(lambda: read(db.select(columns).where(product_a == value(next(names)))))),
+        ("list by product_b", run(lambda: read(db.select(columns).where(product_b == value(next(names)))))),
+        ("top 10 of product_a", run(lambda: read(
+            db.select(columns).where(product_a == value(next(names)))
+            .order_by(table.c.likes.desc(), table.c.id.desc()).limit(10)))),
+        ("read by id", run(lambda: read(db.select(columns).where(table.c.id == next(ids))))),
+    ]
+
+
+class Resolver:
+    """ Turns names into ids and ids into names the way the model does """
+
+    def __init__(self, cold=False):
+        self.cold = cold
+
+    def product(self, name):
+        """ Returns the id of a product, or 0 for an unknown one """
+        from service.models import Product  # pylint: disable=import-outside-toplevel
+
+        if self.cold:
+            Product.interned.clear()
+        return Product.ids_for([name]).get(name, 0)
+
+    @staticmethod
+    def rows(result):
+        """ Returns the rows with product names """
+        from service.models import Recommendation  # pylint: disable=import-outside-toplevel
+
+        return Recommendation.named_rows(result)
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    load_app(database_uri(args.database_uri))
+    from service.models import Recommendation, db  # pylint: disable=import-outside-toplevel
+    from service.migrations import schema_version, upgrade  # pylint: disable=import-outside-toplevel
+
+    print("Loading {:,} rows with product names ...".format(args.rows))
+    table = create_named_table(db, args.rows, args.products)
+    db.engine.execute(schema_version.delete())
+    upgrade(db.engine, 6)
+    vacuum(db)
+    before_sizes = sizes(db)
+    before = {name: timed(function, args.repeat) / 100
+              for name, function in lookups(db, table, args.products, args.rows)}
+    db.session.remove()
+
+    start = time.perf_counter()
+    upgrade(db.engine)
+    migration_seconds = time.perf_counter() - start
+    vacuum(db)
+    after_sizes = sizes(db)
+    table = Recommendation.__table__
+    after = {name: timed(function, args.repeat) / 100
+             for name, function in lookups(db, table, args.products, args.rows, Resolver())}
+    cold = {name: timed(function, args.repeat) / 100
+            for name, function in lookups(db, table, args.products, args.rows, Resolver(cold=True))}
+
+    print("Migration 7 took {:.1f} s".format(migration_seconds))
+    print("{:<24} {:>14} {:>14}".format("size", "names MB", "ids MB"))
+    for name in ("recommendation", "recommendation indexes", "product", "product indexes"):
+        print("{:<24} {:>14.2f} {:>14.2f}".format(
+            name, before_sizes.get(name, 0) / 2 ** 20, after_sizes.get(name, 0) / 2 ** 20))
+    print("{:<24} {:>14.2f} {:>14.2f}".format(
+        "total", sum(before_sizes.values()) / 2 ** 20, sum(after_sizes.values()) / 2 ** 20))
+    print("{:<24} {:>14} {:>14} {:>14}".format("lookup", "names us", "ids us", "ids cold us"))
+    for name in before:
+        print("{:<24} {:>14.1f} {:>14.1f} {:>14.1f}".format(
+            name, before[name] * 1e6, after[name] * 1e6, cold[name] * 1e6))
+
+
+if __name__ == "__main__":
+    main()
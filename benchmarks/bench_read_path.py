@@ -0,0 +1,60 @@
+"""
+Benchmark: rows per second of the ORM and Core read paths
+
+Usage:
+    python -m benchmarks.bench_read_path --rows 100000
+
+Reads every Recommendation and encodes the list as JSON in four ways:
+ORM objects through serialize() and jsonify() as the list endpoint used
+to, Core rows through the json module and through orjson, and the
+GET /recommendations endpoint itself through the Flask test client.
+"""
+import argparse
+from unittest.mock import patch
+from benchmarks.common import database_uri, load_app, populate, timed
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = load_app(database_uri(args.database_uri))
+    from flask import jsonify  # pylint: disable=import-outside-toplevel
+    from service import encodings  # pylint: disable=import-outside-toplevel
+    from service.models import Recommendation, db  # pylint: disable=import-outside-toplevel
+
+    db.drop_all()
+    db.create_all()
+    print("Loading {} rows ...".format(args.rows))
+    populate(db, args.rows, args.products)
+    client = app.test_client()
+
+    def orm_path():
+        with app.test_request_context():
+            jsonify([recommendation.serialize() for recommendation in Recommendation.query]).get_data()
+        db.session.remove()
+
+    def core_path():
+        rows = Recommendation.read_rows(Recommendation.rows_statement(Recommendation.query))
+        encodings.encode_rows(rows, Recommendation.FIELDS, encodings.JSON)
+
+    def core_path_stdlib():
+        with patch.object(encodings, "orjson", None):
+            core_path()
+
+    def endpoint():
+        client.get("/recommendations")
+
+    for name, function in [("ORM + serialize() + jsonify", orm_path), ("Core rows + json module", core_path_stdlib),
+                           ("Core rows + orjson", core_path), ("GET /recommendations", endpoint)]:
+        seconds = timed(function, args.repeat)
+        print("{:<30} {:>9.1f} ms {:>12,.0f} rows/s".format(name, seconds * 1000, args.rows / seconds))
+
+
+if __name__ == "__main__":
+    main()
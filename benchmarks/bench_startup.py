@@ -0,0 +1,50 @@
+"""
+Benchmark: time to import the service in a fresh interpreter
+
+Usage:
+    python -m benchmarks.bench_startup --repeat 20
+
+Each run starts a new Python process, imports the service and reports the
+wall time of the import, first against a SQLite file and then against a
+database that does not answer, which must not slow the import down.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from benchmarks.common import database_uri
+
+SCRIPT = "import time; start = time.perf_counter(); import service; print(time.perf_counter() - start)"
+
+
+def import_time(uri):
+    """ Returns the seconds a fresh interpreter takes to import the service """
+    env = dict(os.environ, DATABASE_URI=uri)
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT], env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True
+    ).stdout
+    return float(output.split()[-1])
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    setups = [
+        ("sqlite file", database_uri(args.database_uri)),
+        ("unreachable postgres", "postgres://nobody@127.0.0.1:1/none"),
+    ]
+    import_time(setups[0][1])  # warm the file system cache
+    for name, uri in setups:
+        samples = sorted(import_time(uri) for _ in range(args.repeat))
+        print("{:<22} median {:7.1f} ms   max {:7.1f} ms".format(
+            name, statistics.median(samples) * 1000, samples[-1] * 1000
+        ))
+
+
+if __name__ == "__main__":
+    main()
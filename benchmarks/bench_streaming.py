@@ -0,0 +1,58 @@
+"""
+Benchmark: time to first byte and peak memory of list responses
+
+Reads GET /recommendations through the Flask test client as one JSON
+array and as a stream of NDJSON lines, at growing table sizes.
+
+Usage:
+    python -m benchmarks.bench_streaming --rows 10000 100000 1000000
+"""
+import argparse
+import time
+import tracemalloc
+from benchmarks.common import database_uri, load_app, populate
+
+
+def measure(client, headers):
+    """ Returns the time to first byte, total time and peak memory of one list request """
+    tracemalloc.start()
+    start = time.perf_counter()
+    resp = client.get("/recommendations", headers=headers, buffered=False)
+    chunks = iter(resp.response)
+    next(chunks)
+    first_byte = time.perf_counter() - start
+    for _ in chunks:
+        pass
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    resp.close()
+    return first_byte, total, peak
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    app = load_app(database_uri(args.database_uri))
+    from service.models import db  # pylint: disable=import-outside-toplevel
+
+    client = app.test_client()
+    modes = [("json", {"Accept": "application/json"}), ("ndjson", {"Accept": "application/x-ndjson"})]
+    print("{:>9} {:<7} {:>10} {:>10} {:>10}".format("rows", "mode", "ttfb ms", "total ms", "peak MB"))
+    for rows in args.rows:
+        db.drop_all()
+        db.create_all()
+        populate(db, rows)
+        for mode, headers in modes:
+            first_byte, total, peak = measure(client, headers)
+            print("{:>9} {:<7} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                rows, mode, first_byte * 1000, total * 1000, peak / 2 ** 20
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Benchmark: top K recommendations of a product against sorting the full match in Python
+
+Usage:
+    python -m benchmarks.bench_top --rows 1000000 --limit 10
+"""
+import argparse
+from benchmarks.common import database_uri, load_app, populate, product_name, timed
+
+
+def main():
+    """ Runs the benchmark """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    load_app(database_uri(args.database_uri))
+    from service.models import Recommendation, db  # pylint: disable=import-outside-toplevel
+
+    db.drop_all()
+    db.create_all()
+    print("Loading {} rows ...".format(args.rows))
+    populate(db, args.rows, args.products)
+    product = product_name(7)
+
+    def sort_in_python():
+        matches = [r.serialize() for r in Recommendation.find_by_product_a(product)]
+        return sorted(matches, key=lambda r: (-r["likes"], -r["id"]))[:args.limit]
+
+    def top_query():
+        return [r.serialize() for r in Recommendation.find_top_for_product(product, args.limit)]
+
+    def top_query_with_type():
+        return [r.serialize() for r in Recommendation.find_top_for_product(product, args.limit, "A")]
+
+    assert sort_in_python() == top_query()
+    for name, function in [("sort in python", sort_in_python), ("find_top_for_product", top_query),
+                           ("find_top_for_product type=A", top_query_with_type)]:
+        print("{:<30} {:>8.3f} ms".format(name, timed(function, args.repeat) * 1000))
+
+
+if __name__ == "__main__":
+    main()
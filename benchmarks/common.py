@@ -0,0 +1,127 @@
+"""
+Shared helpers for the benchmark scripts
+
+The benchmarks drop and re-create the recommendation table, so point them
+at a scratch database. By default they use a SQLite file in the temp folder.
+"""
+import os
+import sys
+import random
+import statistics
+import tempfile
+import time
+import subprocess
+import http.client
+
+RECOM_TYPES = ["A", "U", "C"]
+
+
+def database_uri(uri=None):
+    """ Returns the database the benchmarks run against """
+    return uri or os.getenv("DATABASE_URI") or "sqlite:///" + os.path.join(
+        tempfile.gettempdir(), "recommendations-bench.db"
+    )
+
+
+def load_app(uri):
+    """ Imports the service, creates the schema in the given database and returns the app """
+    os.environ["DATABASE_URI"] = uri
+    from service import app  # pylint: disable=import-outside-toplevel
+    from service.models import Recommendation  # pylint: disable=import-outside-toplevel
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    Recommendation.init_db(app)
+    return app
+
+
+def product_name(number):
+    """ Returns the name of the product with the given number """
+    return "product-{:06d}".format(number)
+
+
+def generate_rows(count, products, seed=42):
+    """ Yields count recommendation rows spread over the given number of products
+
+    A (product_a, product_b, recom_type) is never repeated, the table keeps
+    them unique.
+    """
+    rand = random.Random(seed)
+    seen = set()
+    while len(seen) < count:
+        row = {
+            "product_a": product_name(rand.randrange(products)),
+            "product_b": product_name(rand.randrange(products)),
+            "recom_type": rand.choice(RECOM_TYPES),
+            "likes": rand.randrange(100),
+        }
+        key = (row["product_a"], row["product_b"], row["recom_type"])
+        if key not in seen:
+            seen.add(key)
+            yield row
+
+
+def populate(db, count, products=10000, chunk_size=10000):
+    """ Inserts count random recommendations with executemany in chunks """
+    from service.models import Product, Recommendation  # pylint: disable=import-outside-toplevel
+
+    ids = Product.ids_for([product_name(number) for number in range(products)], create=True)
+    table = Recommendation.__table__
+    chunk = []
+    with db.engine.begin() as conn:
+        for row in generate_rows(count, products):
+            chunk.append(with_product_ids(row, ids))
+            if len(chunk) == chunk_size:
+                conn.execute(table.insert(), chunk)
+                chunk = []
+        if chunk:
+            conn.execute(table.insert(), chunk)
+        if conn.dialect.name == "postgresql":
+            conn.execute("ANALYZE recommendation")
+            conn.execute("ANALYZE product")
+
+
+def with_product_ids(row, ids):
+    """ Returns a recommendation row with the ids of its products instead of their names """
+    row = dict(row)
+    row["product_a_id"] = ids[row.pop("product_a")]
+    row["product_b_id"] = ids[row.pop("product_b")]
+    return row
+
+
+def timed(function, repeat=5):
+    """ Returns the median wall time of function in seconds """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def start_gunicorn(options, port, uri):
+    """ Starts gunicorn serving service:app on the given database and waits until it answers """
+    return start_server(["gunicorn", "--bind=127.0.0.1:{}".format(port)] + options + ["service:app"], port, uri)
+
+
+def start_uvicorn(options, port, uri):
+    """ Starts uvicorn serving service.asgi:application on the given database and waits until it answers """
+    return start_server(["uvicorn", "--host=127.0.0.1", "--port={}".format(port), "--no-access-log"]
+                        + options + ["service.asgi:application"], port, uri)
+
+
+def start_server(command, port, uri):
+    """ Runs python -m command and waits until it answers on the given port """
+    env = dict(os.environ, DATABASE_URI=uri, PORT=str(port))
+    server = subprocess.Popen(
+        [sys.executable, "-m"] + command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/recommendations/1")
+            conn.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("{} did not start".format(command[0]))
@@ -0,0 +1,235 @@
+"""
+Load test: throughput and latency percentiles of gunicorn service:app
+
+Usage:
+    python -m benchmarks.loadtest --concurrency 64 --duration 30 \
+        --mix read=70,list=20,like=5,create=5
+    python -m benchmarks.loadtest --url http://127.0.0.1:5000 --mix read=100
+
+Seeds the database (a SQLite file in the temp folder unless --database-uri
+or DATABASE_URI points at a local Postgres), starts gunicorn with
+gunicorn_config.py and keeps --concurrency keep-alive connections busy
+for --duration seconds after --warmup seconds that are not counted.
+--asgi serves service.asgi:application with uvicorn instead, and --idle
+holds extra connections open without sending a request on them. Each
+connection picks its next request from the mix: a read by id, a filtered
+list, a like, or a create. The clients are asyncio tasks that speak plain
+HTTP/1.1 over asyncio streams, so one process drives a lot of connections
+without threads or extra packages. --url skips the seeding and the server
+start and loads a service that is already running.
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+from benchmarks.common import database_uri, load_app, populate, product_name, start_gunicorn, start_uvicorn
+
+KINDS = ("read", "list", "like", "create")
+PERCENTILES = (50, 95, 99, 99.9)
+
+
+def parse_mix(mix):
+    """ Returns the request kinds and their weights from "read=70,list=30" """
+    weights = {}
+    for item in mix.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError("unknown request kind {!r}, use one of {}".format(kind, ", ".join(KINDS)))
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def percentile(samples, pct):
+    """ Returns the nearest rank percentile of sorted samples """
+    if not samples:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(samples) + 0.5)) - 1, 0)
+    return samples[min(rank, len(samples) - 1)]
+
+
+def build_request(kind, rand, rows, products, host):
+    """ Returns the bytes of one HTTP/1.1 request of the given kind """
+    body = b""
+    if kind == "read":
+        method, path = "GET", "/recommendations/{}".format(rand.randint(1, rows))
+    elif kind == "list":
+        method, path = "GET", "/recommendations?product_a=" + product_name(rand.randrange(products))
+    elif kind == "like":
+        method, path = "PUT", "/recommendations/{}/likes".format(rand.randint(1, rows))
+    else:
+        method, path = "POST", "/recommendations"
+        body = json.dumps({
+            "product_a": product_name(rand.randrange(products)),
+            "product_b": product_name(rand.randrange(products)),
+            "recom_type": rand.choice(["A", "U", "C"]),
+            "likes": 0,
+        }).encode("utf-8")
+    head = "{} {} HTTP/1.1\r\nHost: {}\r\nContent-Length: {}\r\n".format(method, path, host, len(body))
+    if body:
+        head += "Content-Type: application/json\r\n"
+    return (head + "\r\n").encode("ascii") + body
+
+
+async def read_response(reader):
+    """ Reads one response and returns its status and whether the server keeps the connection """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    elif "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get("connection", "").lower() != "close"
+
+
+async def client(target, weights, rows, products, start, deadline, results, seed):
+    """ Sends requests over one keep-alive connection until the deadline """
+    rand = random.Random(seed)
+    kinds, cum_weights = list(weights), []
+    for weight in weights.values():
+        cum_weights.append((cum_weights[-1] if cum_weights else 0) + weight)
+    host, port = target
+    reader = writer = None
+    loop = asyncio.get_running_loop()
+    while loop.time() < deadline:
+        kind = rand.choices(kinds, cum_weights=cum_weights)[0]
+        request = build_request(kind, rand, rows, products, "{}:{}".format(host, port))
+        sent = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            status, keep_alive = await read_response(reader)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            status, keep_alive = None, False
+        latency = time.perf_counter() - sent
+        if loop.time() >= start:
+            results[kind].append((latency, status))
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run(target, weights, concurrency, warmup, duration, rows, products, idle=0):
+    """ Runs the clients and returns the latencies and statuses of each request kind
+
+    The idle connections are opened first and send nothing until the end,
+    like slow or parked clients.
+    """
+    results = {kind: [] for kind in weights}
+    idle_writers = []
+    for _ in range(idle):
+        idle_writers.append((await asyncio.open_connection(*target))[1])
+    loop = asyncio.get_running_loop()
+    start = loop.time() + warmup
+    deadline = start + duration
+    await asyncio.gather(*(
+        client(target, weights, rows, products, start, deadline, results, seed)
+        for seed in range(concurrency)
+    ))
+    for writer in idle_writers:
+        writer.close()
+    return results
+
+
+def summarize(results, duration):
+    """ Returns the throughput, error count and latency percentiles of each kind and of all requests """
+    summary = {}
+    everything = []
+    for kind, samples in list(results.items()) + [("all", None)]:
+        if samples is None:
+            samples = everything
+        else:
+            everything.extend(samples)
+        latencies = sorted(latency * 1000 for latency, _ in samples)
+        line = {
+            "requests": len(samples),
+            "errors": sum(1 for _, status in samples if status is None or status >= 500),
+            "per_second": round(len(samples) / duration, 1),
+        }
+        for pct in PERCENTILES:
+            line["p{:g}_ms".format(pct)] = round(percentile(latencies, pct), 3)
+        line["max_ms"] = round(latencies[-1], 3) if latencies else 0.0
+        summary[kind] = line
+    return summary
+
+
+def main():
+    """ Runs the load test """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", default=None)
+    parser.add_argument("--url", help="load a service that is already running instead of starting gunicorn")
+    parser.add_argument("--mix", type=parse_mix, default="read=70,list=20,like=5,create=5")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--idle", type=int, default=0, help="connections to hold open without sending anything")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--asgi", action="store_true", help="serve service.asgi:application with uvicorn")
+    parser.add_argument("--server-option", action="append", default=None,
+                        help="gunicorn or uvicorn command line option, repeat for more than one")
+    parser.add_argument("--output", help="file to write the summary to as JSON")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        target = (url.hostname, url.port or 80)
+    else:
+        uri = database_uri(args.database_uri)
+        load_app(uri)
+        from service.models import db  # pylint: disable=import-outside-toplevel
+
+        db.drop_all()
+        db.create_all()
+        populate(db, args.rows, args.products)
+        db.session.remove()
+        db.engine.dispose()
+        if args.asgi:
+            server = start_uvicorn(args.server_option or [], args.port, uri)
+        else:
+            server = start_gunicorn(args.server_option or ["--config=gunicorn_config.py"], args.port, uri)
+        target = ("127.0.0.1", args.port)
+
+    try:
+        results = asyncio.run(run(target, args.mix, args.concurrency, args.warmup, args.duration,
+                                  args.rows, args.products, args.idle))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    summary = summarize(results, args.duration)
+    columns = ["requests", "errors", "per_second"] + ["p{:g}_ms".format(pct) for pct in PERCENTILES] + ["max_ms"]
+    print("{:<8}".format("kind") + "".join("{:>12}".format(column) for column in columns))
+    for kind, line in summary.items():
+        print("{:<8}".format(kind) + "".join("{:>12}".format(line[column]) for column in columns))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"mix": args.mix, "concurrency": args.concurrency, "duration": args.duration,
+                       "summary": summary}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
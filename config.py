@@ -3,6 +3,7 @@ Global Configuration for Application
 """
 import os
 import json
+import tempfile
 # Get configuration from environment
 DATABASE_URI = os.getenv(
     "DATABASE_URI",
@@ -14,4 +15,66 @@ if 'VCAP_SERVICES' in os.environ:
     DATABASE_URI = vcap['user-provided'][0]['credentials']['url']
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
-SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+# Paging of GET /recommendations. A DEFAULT_PAGE_SIZE of 0 returns the
+# whole list to clients that do not ask for a page.
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "0"))
+# Rows fetched per round trip when streaming application/x-ndjson lists
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+# Recommendations inserted per transaction by POST /recommendations/bulk
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+# Spread likes over this many counter rows per Recommendation (0 = off)
+LIKE_SHARDS = int(os.getenv("LIKE_SHARDS", "0"))
+# Fold the like shards into the Recommendation rows, and count the likes as a
+# change to the lists, this often (0 = fold only by flask fold-likes, count every like)
+LIKES_FOLD_INTERVAL_MS = int(os.getenv("LIKES_FOLD_INTERVAL_MS", "1000"))
+# Write-behind likes: add likes up in memory and write them in batches
+LIKES_WRITE_BEHIND = os.getenv("LIKES_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+LIKES_FLUSH_INTERVAL_MS = int(os.getenv("LIKES_FLUSH_INTERVAL_MS", "500"))
+LIKES_FLUSH_MAX_EVENTS = int(os.getenv("LIKES_FLUSH_MAX_EVENTS", "1000"))
+LIKES_MAX_STALENESS_MS = int(os.getenv("LIKES_MAX_STALENESS_MS", "2000"))
+# Read-through cache of lookups: "none", "memory" or "package.module:Class"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "none")
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "5"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# Longer lists are read from the database every time instead of being cached
+CACHE_MAX_LIST_ROWS = int(os.getenv("CACHE_MAX_LIST_ROWS", "1000"))
+# Product name and id pairs each worker remembers, see service/cache.py
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "100000"))
+# Recommendations returned by GET /products/<product_a>/recommendations
+TOP_RECOMMENDATIONS = int(os.getenv("TOP_RECOMMENDATIONS", "10"))
+# Limits of GET /products/<product_a>/graph, which follows fanout
+# Recommendations of each product for up to depth hops
+GRAPH_DEPTH = int(os.getenv("GRAPH_DEPTH", "2"))
+GRAPH_MAX_DEPTH = int(os.getenv("GRAPH_MAX_DEPTH", "4"))
+GRAPH_MAX_PRODUCTS = int(os.getenv("GRAPH_MAX_PRODUCTS", "1000"))
+# Recommendations removed per transaction by DELETE /recommendations
+DELETE_CHUNK_SIZE = int(os.getenv("DELETE_CHUNK_SIZE", "1000"))
+# Connection pool of each worker (SQLite uses its own pool instead)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Threads that run requests under service/asgi.py, one per pooled connection
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+# Compress responses of at least this many bytes with gzip or brotli
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+# Count and time requests and SQL statements for GET /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Log records wait on a queue of this size for a writer thread (0 = write inline)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Thin out the records below WARNING, e.g. "INFO=0.1" and "INFO=20" per second
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+LOG_RATE_LIMIT = os.getenv("LOG_RATE_LIMIT", "")
+# Log one line per request on the flask.app.access logger
+LOG_ACCESS = os.getenv("LOG_ACCESS", "true").lower() in ("1", "true", "yes")
+# Log requests and SQL statements that take at least this long
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+# Requests with this X-Profile header are profiled into PROFILE_DIR (empty = off)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "recommendations-profiles"))
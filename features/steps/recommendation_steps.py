@@ -23,25 +23,24 @@ ID_PREFIX = 'recommendation_'
 def step_impl(context):
     """ Delete all Recommendations and load new ones """
     headers = {'Content-Type': 'application/json'}
-    # list all of the recommendations and delete them one by one
-    context.resp = requests.get(context.base_url + '/recommendations', headers=headers)
+    # delete all of the recommendations in one request
+    context.resp = requests.delete(context.base_url + '/recommendations?all=true', headers=headers)
     expect(context.resp.status_code).to_equal(200)
-    for recommendation in context.resp.json():
-        context.resp = requests.delete(context.base_url + '/recommendations/' + str(recommendation["id"]), headers=headers)
-        expect(context.resp.status_code).to_equal(204)
     
-    # load the database with new recommendation
-    create_url = context.base_url + '/recommendations'
-    for row in context.table:
-        data = {
+    # load the database with new recommendation in one bulk request
+    create_url = context.base_url + '/recommendations/bulk'
+    data = [
+        {
             "product_a": row['product_a'],
             "product_b": row['product_b'],
             "recom_type": row['recom_type'],
             "likes": int(row['likes'])
-            }
-        payload = json.dumps(data)
-        context.resp = requests.post(create_url, data=payload, headers=headers)
-        expect(context.resp.status_code).to_equal(201)
+        }
+        for row in context.table
+    ]
+    payload = json.dumps(data)
+    context.resp = requests.post(create_url, data=payload, headers=headers)
+    expect(context.resp.status_code).to_equal(201)
 
 @when('I visit the "home page"')
 def step_impl(context):
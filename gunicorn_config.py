@@ -0,0 +1,103 @@
+"""
+Gunicorn Configuration for the Recommendation Service
+
+Usage:
+    gunicorn --config=gunicorn_config.py service:app
+
+Workers default to 2 x the CPUs this process may run on + 1, each with
+GUNICORN_THREADS threads. Set WEB_CONCURRENCY to pin the worker count and
+GUNICORN_WORKER_CLASS=gevent to serve from greenlets instead of threads.
+
+The app is preloaded by default so the workers share the imported code.
+Importing the service does not touch the database; the master creates and
+migrates the schema once in on_starting, before it forks the workers, unless
+GUNICORN_INIT_DB is off because a release step runs `flask db-upgrade`.
+The workers open their own database connections (see service/pool.py).
+
+The workers write their metrics to PROMETHEUS_MULTIPROC_DIR, a folder in
+the temp directory unless it is set, so that GET /metrics adds up all of
+them. The folder is emptied when gunicorn starts.
+"""
+import os
+import sys
+import glob
+import tempfile
+import multiprocessing
+
+
+def cpu_count():
+    """ Returns the number of CPUs this process is allowed to run on """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def env_flag(name, default):
+    """ Returns an on/off environment setting """
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+bind = "0.0.0.0:" + os.getenv("PORT", "5000")
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", str(2 * cpu_count() + 1)))
+threads = int(os.getenv("GUNICORN_THREADS", "4" if worker_class == "gthread" else "1"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+# recycle workers now and then, at staggered times so they never restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "1000"))
+preload_app = env_flag("GUNICORN_PRELOAD", "true")
+init_db = env_flag("GUNICORN_INIT_DB", "true")
+errorlog = "-"
+
+# must be set before the service imports prometheus_client
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "recommendations-metrics")
+)
+os.makedirs(metrics_dir, exist_ok=True)
+
+
+def on_starting(server):
+    """ Clears the metrics of the last run and creates and migrates the schema once """
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.remove(path)
+    if not init_db:
+        return
+    from service.models import Recommendation, db  # pylint: disable=import-outside-toplevel
+
+    try:
+        Recommendation.create_schema()
+    except Exception as error:  # pylint: disable=broad-except
+        server.log.critical("%s: Cannot continue", error)
+        # exit code 4 tells the supervisor not to restart gunicorn in a loop
+        sys.exit(4)
+    # the workers must not share the master's connections
+    db.get_engine(Recommendation.app).dispose()
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """ Runs in each worker right after it was forked """
+    if worker_class == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            server.log.warning("psycogreen is not installed, database calls will block the worker")
+        else:
+            patch_psycopg()
+
+
+def worker_exit(server, worker):  # pylint: disable=unused-argument
+    """ Writes the likes a worker still holds before it goes away """
+    from service.routes import likes_buffer  # pylint: disable=import-outside-toplevel
+
+    likes_buffer.flush()
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """ Drops the in-flight gauge of a worker that went away """
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -3,11 +3,14 @@ Package: service
 Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
+
+Importing the package never talks to the database: the engine connects on
+first use and the schema is created by a separate one-time step, either
+the gunicorn master (see gunicorn_config.py) or `flask db-upgrade`.
 """
-import os
-import sys
 import logging
 from flask import Flask
+from service import logs
 
 # Create Flask application
 app = Flask(__name__)
@@ -28,15 +31,13 @@ if __name__ != '__main__':
         handler.setFormatter(formatter)
     app.logger.info('Logging handler established')
 
+# Write the log records from a background thread (see service/logs.py)
+logs.init_app(app)
+
 app.logger.info(70 * "*")
 app.logger.info("  R E C O M M E N D A T I O N  S E R V I C E   R U N N I N G  ".center(70, "*"))
 app.logger.info(70 * "*")
 
-try:
-    routes.init_db()  # make our sqlalchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+models.Recommendation.init_app(app)
 
 app.logger.info("Service inititalized!")
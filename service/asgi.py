@@ -0,0 +1,45 @@
+"""
+ASGI entry point for the Recommendation Service
+
+Usage:
+    flask db-upgrade
+    uvicorn service.asgi:application --host 0.0.0.0 --port 5000
+
+The ASGI server's event loop owns the client connections. Only requests
+that are being handled take a thread, out of a pool of ASGI_THREADS
+(DB_POOL_SIZE + DB_MAX_OVERFLOW by default, one per database connection
+a request can hold). That way thousands of open keep-alive connections
+cost one process and no threads. The routes and error handlers are the
+same Flask views that gunicorn serves, so the JSON contract is the same
+in both modes.
+
+The SQLAlchemy and Flask-SQLAlchemy releases this service is pinned to
+have no asyncio support, so the views and their database calls stay
+synchronous and a2wsgi runs them in the pool. The loop never waits on
+the database.
+
+Every uvicorn worker imports this module, so it does not create the
+schema: the workers would race on the tables and the migrations. Run
+`flask db-upgrade` once as the release step, before starting them. The
+likes a worker still buffers are written when it exits (see
+service/likes_buffer.py).
+"""
+from a2wsgi import WSGIMiddleware
+from service import app
+
+
+def terminated_input(wsgi_app):
+    """ Returns wsgi_app reading request bodies up to the end of the ASGI stream
+
+    a2wsgi passes no CONTENT_LENGTH for a chunked request, and Werkzeug
+    then reads its body as empty unless wsgi.input_terminated is set, as
+    gunicorn sets it. The ASGI server has already decoded the chunks, so
+    wsgi.input ends where the body does.
+    """
+    def wrapped(environ, start_response):
+        environ["wsgi.input_terminated"] = True
+        return wsgi_app(environ, start_response)
+    return wrapped
+
+
+application = WSGIMiddleware(terminated_input(app), workers=app.config["ASGI_THREADS"])
@@ -0,0 +1,289 @@
+"""
+Read-through cache for Recommendation lookups
+
+The cache holds serialized Recommendations, never ORM objects, so entries
+can be shared between requests and threads. Writes delete the entry of the
+Recommendation they touched and bump a generation number that is part of
+every list key, so cached lists are dropped in one step without a scan
+of the store, which frees them when they expire. Entries expire after
+CACHE_TTL_SECONDS, which bounds how stale a worker can be about writes
+made through other workers. Lists of more than CACHE_MAX_LIST_ROWS rows
+are never cached, so a full table is not held in every worker.
+
+CACHE_BACKEND picks the store: "none" (the default), "memory" for the
+in-process LRU, or "package.module:Class" for a shared store such as Redis
+that implements CacheBackend.
+
+ProductNames interns the product names of every worker: a name and its
+id never change once the product table holds them, so the pairs are kept
+without a TTL and no write has to invalidate them.
+"""
+import time
+import logging
+import importlib
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("flask.app")
+
+
+class CacheBackend:
+    """ Interface of the stores a RecommendationCache can keep its entries in """
+
+    def get(self, key):
+        """ Returns the value stored under key, or None """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        """ Stores value under key for ttl seconds """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """ Removes the value stored under key """
+        raise NotImplementedError
+
+    def incr(self, key):
+        """ Atomically adds one to the counter stored under key and returns it """
+        raise NotImplementedError
+
+    def counter(self, key):
+        """ Returns the counter stored under key, 0 when it was never incremented """
+        raise NotImplementedError
+
+    def clear(self):
+        """ Removes every value """
+        raise NotImplementedError
+
+    def stats(self):
+        """ Returns the counters of the store """
+        return {}
+
+
+class NullCache(CacheBackend):
+    """ A store that keeps nothing, used when caching is off """
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def incr(self, key):
+        return 0
+
+    def counter(self, key):
+        return 0
+
+    def clear(self):
+        pass
+
+
+class LRUCache(CacheBackend):
+    """ A bounded in-process store that evicts the least recently used entry """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._generations = {}  # counters are never evicted
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        self._next_sweep = 0.0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                self._counters["expirations"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                # entries nobody reads again would otherwise stay until they are evicted
+                self._sweep(now)
+                self._next_sweep = now + ttl
+            self._entries[key] = (now + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _sweep(self, now):
+        """ Drops the expired entries, the lock must be held """
+        expired = [key for key, (expires, _) in self._entries.items() if expires < now]
+        for key in expired:
+            del self._entries[key]
+        self._counters["expirations"] += len(expired)
+
+    def incr(self, key):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            return self._generations[key]
+
+    def counter(self, key):
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+        return stats
+
+
+class RecommendationCache:
+    """ Reads Recommendations through a CacheBackend and invalidates them on writes """
+
+    def __init__(self, backend=None, ttl=5, max_list_rows=1000):
+        self.backend = backend or NullCache()
+        self.ttl = ttl
+        self.max_list_rows = max_list_rows
+
+    @classmethod
+    def from_config(cls, config):
+        """ Creates the cache described by the CACHE_* settings """
+        name = config.get("CACHE_BACKEND", "none")
+        if name == "none":
+            backend = NullCache()
+        elif name == "memory":
+            backend = LRUCache(config.get("CACHE_MAX_ENTRIES", 10000))
+        else:
+            module, _, attribute = name.partition(":")
+            backend = getattr(importlib.import_module(module), attribute)()
+        logger.info("Caching recommendations with %s", type(backend).__name__)
+        return cls(backend, config.get("CACHE_TTL_SECONDS", 5), config.get("CACHE_MAX_LIST_ROWS", 1000))
+
+    def fetch(self, key, loader):
+        """ Returns the value cached under key, calling loader to fill it on a miss
+
+        The loader must not return None, which the backends use for a miss.
+        """
+        value = self.backend.get(key)
+        if value is None:
+            value = loader()
+            self.backend.set(key, value, self.ttl)
+        return value
+
+    def fetch_one(self, by_id, loader, version=None):
+        """ Returns the cached entry of the Recommendation with the given id, {} when there is none
+
+        The entry holds the version of the Recommendation, and one of another
+        version than the given one, read from the database, is loaded again.
+        Without a version the entry is answered as long as it is cached, which
+        is CACHE_TTL_SECONDS at most after a write made through another worker.
+        """
+        key = "recommendation:{}".format(by_id)
+        entry = self.backend.get(key)
+        if entry is None or (version is not None and entry.get("version") != version):
+            entry = loader()
+            self.backend.set(key, entry, self.ttl)
+        return entry
+
+    def fetch_list(self, key, loader, version=None, rows=len):
+        """ Returns a cached list of serialized Recommendations
+
+        A list of more than max_list_rows rows, as counted by rows, is
+        loaded every time instead of being cached.
+        """
+        key = "list:{}:{}:{}".format(self.backend.counter("generation"), version, key)
+        value = self.backend.get(key)
+        if value is None:
+            value = loader()
+            if rows(value) <= self.max_list_rows:
+                self.backend.set(key, value, self.ttl)
+        return value
+
+    def invalidate(self, *ids):
+        """ Drops the given Recommendations and every cached list
+
+        The lists are not looked for: bumping the generation makes their
+        keys unreachable, and the store frees them once they expire.
+        """
+        for by_id in ids:
+            self.backend.delete("recommendation:{}".format(by_id))
+        self.backend.incr("generation")
+
+    def invalidate_all(self):
+        """ Drops every cached Recommendation and list """
+        self.backend.clear()
+        self.backend.incr("generation")
+
+    def stats(self):
+        """ Returns the hit, miss and eviction counters """
+        return self.backend.stats()
+
+
+class ProductNames:
+    """ In-process two-way map of product names and ids
+
+    At most max_entries pairs are kept, the oldest ones are forgotten first.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._ids = {}  # name -> id, in the order the pairs were added
+        self._names = {}  # id -> name
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def ids(self, names):
+        """ Returns {name: id} of the given names that are known """
+        with self._lock:
+            found = {name: self._ids[name] for name in names if name in self._ids}
+            self._count(len(found), len(names))
+        return found
+
+    def names(self, ids):
+        """ Returns {id: name} of the given ids that are known """
+        with self._lock:
+            found = {by_id: self._names[by_id] for by_id in ids if by_id in self._names}
+            self._count(len(found), len(ids))
+        return found
+
+    def add(self, pairs):
+        """ Remembers (name, id) pairs read from the product table """
+        with self._lock:
+            for name, by_id in pairs:
+                self._ids[name] = by_id
+                self._names[by_id] = name
+            while len(self._ids) > self.max_entries:
+                name = next(iter(self._ids))
+                del self._names[self._ids.pop(name)]
+                self._counters["evictions"] += 1
+
+    def clear(self):
+        """ Forgets every pair, for a product table that was dropped """
+        with self._lock:
+            self._ids.clear()
+            self._names.clear()
+
+    def stats(self):
+        """ Returns the hit, miss and eviction counters """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._ids)
+        return stats
+
+    def _count(self, hits, lookups):
+        self._counters["hits"] += hits
+        self._counters["misses"] += lookups - hits
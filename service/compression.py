@@ -0,0 +1,74 @@
+"""
+Response compression
+
+Responses in one of the encodings of service/encodings.py are compressed
+with brotli (when the Brotli package is installed) or gzip, whichever the
+client prefers in Accept-Encoding. Bodies under COMPRESS_MIN_SIZE bytes
+are sent as they are, and streamed bodies are compressed as they stream.
+A compressed response gets its own strong ETag, the plain one with the
+coding appended.
+"""
+import zlib
+from flask import request
+from service.encodings import ETAG_SUFFIXES
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+COMPRESSIBLE = frozenset(ETAG_SUFFIXES)
+
+
+def codings():
+    """ Returns the content codings this service can produce, the preferred first """
+    return ["br", "gzip"] if brotli else ["gzip"]
+
+
+def encoded_etags(etag):
+    """ Returns the ETags a response with the given plain ETag can carry """
+    return [etag] + ["{}-{}".format(etag, coding) for coding in codings()]
+
+
+def compressor(coding, config):
+    """ Returns the (compress, flush) functions of a streaming compressor """
+    if coding == "br":
+        stream = brotli.Compressor(quality=config["COMPRESS_BROTLI_QUALITY"])
+        return stream.process, stream.finish
+    stream = zlib.compressobj(config["COMPRESS_GZIP_LEVEL"], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return stream.compress, stream.flush
+
+
+def compress_stream(chunks, coding, config):
+    """ Yields the compressed chunks of a streamed body """
+    compress, flush = compressor(coding, config)
+    for chunk in chunks:
+        data = compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield flush()
+
+
+def compress_response(response, config):
+    """ Compresses a response in the coding the client accepts best """
+    if response.status_code != 200 or response.mimetype not in COMPRESSIBLE:
+        return response
+    if "Content-Encoding" in response.headers:
+        return response
+    response.vary.add("Accept-Encoding")
+    coding = request.accept_encodings.best_match(codings())
+    if not coding:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, coding, config)
+    else:
+        data = response.get_data()
+        if len(data) < config["COMPRESS_MIN_SIZE"]:
+            return response
+        compress, flush = compressor(coding, config)
+        response.set_data(compress(data) + flush())
+    response.headers["Content-Encoding"] = coding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag("{}-{}".format(etag, coding), weak)
+    return response
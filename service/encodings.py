@@ -0,0 +1,79 @@
+"""
+Encodings of Recommendation lists
+
+Lists are read as rows of Recommendation.FIELDS and encoded straight from
+those rows in the media type the client picks with Accept:
+
+- application/json: an array of objects, the default
+- application/vnd.recommendations.columnar+json: one array per field, so
+  each field name is sent once rather than once per Recommendation
+- application/msgpack: the array of objects as MessagePack, offered when
+  the msgpack package is installed
+- application/x-ndjson: one object per line, streamed by the routes
+
+JSON is written by orjson when it is installed and by the json module
+otherwise. Both sort the keys and leave out the spaces, like jsonify().
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.recommendations.columnar+json"
+MSGPACK = "application/msgpack"
+NDJSON = "application/x-ndjson"
+
+# media type -> what it adds to the ETag of a list
+ETAG_SUFFIXES = {
+    JSON: "",
+    COLUMNAR_JSON: "-columnar",
+    MSGPACK: "-msgpack",
+    NDJSON: "-ndjson",
+}
+
+
+def dumps(value):
+    """ Returns value as compact JSON bytes with sorted keys """
+    if orjson:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def media_types():
+    """ Returns the media types encode_rows() can produce, the default first """
+    types = [JSON, COLUMNAR_JSON]
+    if msgpack:
+        types.append(MSGPACK)
+    return types
+
+
+def encode_rows(rows, fields, media_type):
+    """
+    Encodes rows of Recommendations
+
+    Args:
+        rows (list): tuples holding the values of fields
+        fields (tuple): the names of the values in each row
+        media_type (string): one of media_types()
+    Returns:
+        bytes: the encoded body
+    """
+    if media_type == COLUMNAR_JSON:
+        columns = zip(*rows) if rows else [()] * len(fields)
+        return dumps({name: list(values) for name, values in zip(fields, columns)})
+    objects = [dict(zip(fields, row)) for row in rows]
+    if media_type == MSGPACK:
+        return msgpack.packb(objects, use_bin_type=True)
+    return dumps(objects)
+
+
+def encode_lines(rows, fields):
+    """ Encodes rows of Recommendations as NDJSON, one object per line """
+    return b"".join(dumps(dict(zip(fields, row))) + b"\n" for row in rows)
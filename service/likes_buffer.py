@@ -0,0 +1,204 @@
+"""
+Write-behind buffer for likes
+
+Likes are added up per Recommendation in memory and written with one
+batched UPDATE every LIKES_FLUSH_INTERVAL_MS, as soon as
+LIKES_FLUSH_MAX_EVENTS likes are waiting, or when the worker exits. A like
+is never left unwritten for longer than LIKES_MAX_STALENESS_MS: the request
+that notices it flushes on the spot.
+
+Every worker process has its own buffer, so the likes it has not written
+yet are only visible through that worker.
+
+With LIKE_SHARDS on, likes go to the shard rows instead, and LikeFolder
+folds the shards into the Recommendation rows every LIKES_FOLD_INTERVAL_MS
+from a thread of each worker that takes likes. The lists and rankings,
+which read the rows, are then never further behind than that.
+
+Likes written straight to the Recommendation rows are counted as a change
+to the lists by the same thread, once per LIKES_FOLD_INTERVAL_MS however
+many there were, so concurrent likes do not queue up on the change counter.
+The list ETags may stay the same for that long after a like.
+"""
+import os
+import time
+import atexit
+import logging
+import threading
+from contextlib import nullcontext
+from flask import has_app_context
+from service.models import Recommendation
+
+logger = logging.getLogger("flask.app")
+
+
+class LikeBuffer:
+    """ Adds up likes in memory and writes them to the database in batches """
+
+    def __init__(self, app):
+        self.app = app
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}
+        self._events = 0
+        self._oldest = None  # when the oldest pending like came in
+        self._stats = {"flushes": 0, "likes_written": 0, "last_batch_size": 0,
+                       "last_flush_lag_ms": 0.0, "max_flush_lag_ms": 0.0}
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def add(self, recommendation_id, count=1):
+        """ Adds likes to a Recommendation without touching the database """
+        self._start()
+        with self._lock:
+            self._pending[recommendation_id] = self._pending.get(recommendation_id, 0) + count
+            self._events += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            stale = (time.monotonic() - self._oldest) * 1000 > self.app.config["LIKES_MAX_STALENESS_MS"]
+            full = self._events >= self.app.config["LIKES_FLUSH_MAX_EVENTS"]
+        if stale:
+            self.flush()
+        elif full:
+            self._wake.set()
+
+    def pending(self, recommendation_id):
+        """ Returns the likes of a Recommendation that are not written yet """
+        with self._lock:
+            return self._pending.get(recommendation_id, 0)
+
+    def flush(self):
+        """ Writes all pending likes with one batched update """
+        with self._lock:
+            likes, oldest = self._pending, self._oldest
+            self._pending, self._events, self._oldest = {}, 0, None
+        if not likes:
+            return 0
+        lag = (time.monotonic() - oldest) * 1000
+        try:
+            with nullcontext() if has_app_context() else self.app.app_context():
+                Recommendation.add_likes_many(likes)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Could not write %s buffered likes, keeping them", len(likes))
+            with self._lock:
+                for recommendation_id, count in likes.items():
+                    self._pending[recommendation_id] = self._pending.get(recommendation_id, 0) + count
+                self._events += len(likes)
+                self._oldest = min(oldest, self._oldest or oldest)
+            return 0
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["likes_written"] += sum(likes.values())
+            self._stats["last_batch_size"] = len(likes)
+            self._stats["last_flush_lag_ms"] = round(lag, 3)
+            self._stats["max_flush_lag_ms"] = max(self._stats["max_flush_lag_ms"], round(lag, 3))
+        logger.info("Flushed likes of %s recommendations, %.1f ms after the oldest", len(likes), lag)
+        return len(likes)
+
+    def stats(self):
+        """ Returns the flush batch size and lag counters """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = sum(self._pending.values())
+        return stats
+
+    def _start(self):
+        """ Starts the flush thread once in every worker process """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="like-buffer", daemon=True).start()
+            atexit.register(self.flush)
+
+    def _after_fork(self):
+        # the parent's pending likes are its own to write, and its
+        # lock may have been held by a thread that did not fork along
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending, self._events, self._oldest = {}, 0, None
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.app.config["LIKES_FLUSH_INTERVAL_MS"] / 1000)
+            self._wake.clear()
+            self.flush()
+
+
+class LikeFolder:
+    """ Folds the like shards into the Recommendation rows on a schedule """
+
+    def __init__(self, app):
+        self.app = app
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stats = {"folds": 0, "likes_folded": 0}
+        self._liked = False  # likes were written to the rows since the last fold
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self):
+        """ Starts the fold thread once in every worker process, unless LIKES_FOLD_INTERVAL_MS is 0 """
+        if self._pid == os.getpid() or not self.app.config["LIKES_FOLD_INTERVAL_MS"]:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            threading.Thread(target=self._run, name="like-folder", daemon=True).start()
+            atexit.register(self.fold)
+
+    def stop(self):
+        """ Stops the fold thread of this process """
+        with self._lock:
+            self._stop.set()
+            self._pid = None
+
+    def liked(self):
+        """ Notes likes written to the Recommendation rows, counted as a change at the next fold
+
+        They are counted on the spot when LIKES_FOLD_INTERVAL_MS is 0.
+        """
+        if not self.app.config["LIKES_FOLD_INTERVAL_MS"]:
+            Recommendation.record_likes()
+            return
+        self.start()
+        with self._lock:
+            self._liked = True
+
+    def fold(self):
+        """ Folds the shards once, when LIKE_SHARDS is on, and returns the number of likes folded """
+        with self._lock:
+            liked, self._liked = self._liked, False
+        try:
+            with nullcontext() if has_app_context() else self.app.app_context():
+                folded = Recommendation.fold_likes() if self.app.config["LIKE_SHARDS"] else 0
+                if liked:
+                    Recommendation.record_likes()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Could not fold the like shards, trying again later")
+            with self._lock:
+                self._liked = self._liked or liked
+            return 0
+        with self._lock:
+            self._stats["folds"] += 1
+            self._stats["likes_folded"] += folded
+        return folded
+
+    def stats(self):
+        """ Returns the fold counters """
+        with self._lock:
+            return dict(self._stats)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._liked = False
+
+    def _run(self):
+        stop = self._stop
+        while not stop.wait(self.app.config["LIKES_FOLD_INTERVAL_MS"] / 1000):
+            self.fold()
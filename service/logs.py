@@ -0,0 +1,179 @@
+"""
+Log pipeline
+
+Requests never write log records themselves: the handlers of app.logger,
+which the flask.app logger of the models and helpers now shares, are
+moved behind a QueueHandler, and a QueueListener thread of each
+process writes the records. The request thread only formats the message
+and puts the record on a bounded queue of LOG_QUEUE_SIZE. When the
+writer falls that far behind, records are dropped and counted rather than
+slowing requests down. LOG_QUEUE_SIZE=0 writes in the request thread as
+before.
+
+Every request also logs one access record on the flask.app.access logger,
+with its status and the timings of service/timing.py as key=value pairs.
+
+The lookup logs are chatty, so records below WARNING can be thinned out:
+- LOG_SAMPLING keeps a fraction of the records of a level, for example
+  "INFO=0.1,DEBUG=0".
+- LOG_RATE_LIMIT keeps at most that many records per second of each
+  message, for example "INFO=20". The next record that is kept says how
+  many were left out.
+Warnings, errors and the access records are always kept.
+"""
+import os
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from flask import request
+from service import timing
+
+logger = logging.getLogger("flask.app")
+access_logger = logging.getLogger("flask.app.access")
+
+
+def parse_levels(setting):
+    """ Returns {level number: value} from a setting like "INFO=0.1,DEBUG=0" """
+    levels = {}
+    for item in filter(None, (part.strip() for part in setting.split(","))):
+        name, _, value = item.partition("=")
+        level = logging.getLevelName(name.strip().upper())
+        if not isinstance(level, int):
+            raise ValueError("Unknown log level {!r} in {!r}".format(name, setting))
+        levels[level] = float(value)
+    return levels
+
+
+class SamplingFilter(logging.Filter):
+    """ Keeps a sample of the records below WARNING and limits how often a message repeats """
+
+    def __init__(self, sampling=None, rate_limits=None):
+        super().__init__()
+        self.sampling = sampling or {}
+        self.rate_limits = rate_limits or {}
+        self._lock = threading.Lock()
+        self._windows = {}  # (level, message) -> [second, kept, suppressed]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        fraction = self.sampling.get(record.levelno)
+        if fraction is not None and random.random() >= fraction:
+            return False
+        limit = self.rate_limits.get(record.levelno)
+        if limit is None:
+            return True
+        second = int(time.monotonic())
+        with self._lock:
+            window = self._windows.setdefault((record.levelno, record.msg), [second, 0, 0])
+            if window[0] != second:
+                suppressed = window[2]
+                window[:] = [second, 0, 0]
+                if suppressed:
+                    record.msg = "{} [{} similar suppressed]".format(record.msg, suppressed)
+            if window[1] >= limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class BackgroundHandler(QueueHandler):
+    """ Puts records on a bounded queue that a listener thread of this process writes out
+
+    The listener is started on the first record of every process, so a
+    gunicorn worker forked from a preloaded master gets its own.
+    """
+
+    def __init__(self, handlers, size):
+        super().__init__(None)
+        self.handlers = handlers
+        self.size = size
+        self.dropped = 0
+        self._pid = None
+        self._listener = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """ Starts the listener of this process """
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.SimpleQueue()
+            self.dropped = 0
+            self._listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """ Writes the records still queued and stops the listener of this process """
+        with self._start_lock:
+            if self._pid == os.getpid():
+                self._listener.stop()
+                self._pid = None
+
+    def prepare(self, record):
+        # format the message here, its arguments may be ORM objects bound to this thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        if self.queue.qsize() >= self.size:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            self.queue.put_nowait(logger.makeRecord(
+                logger.name, logging.WARNING, __file__, 0,
+                "Dropped %s log records, the log queue was full", (dropped,), None,
+            ))
+        self.queue.put_nowait(record)
+
+
+def init_app(app):
+    """ Moves the app's log handlers behind a queue and starts the access log """
+    if app.extensions.get("logs"):
+        return
+    app.extensions["logs"] = True
+
+    handlers = list(app.logger.handlers)
+    if app.config["LOG_QUEUE_SIZE"] and handlers:
+        app.logger.handlers = [BackgroundHandler(handlers, app.config["LOG_QUEUE_SIZE"])]
+    if logger is not app.logger:
+        # the models and helpers log to flask.app, Flask 1.1 names app.logger after the app
+        logger.handlers = app.logger.handlers
+        logger.setLevel(app.logger.level)
+        logger.propagate = app.logger.propagate
+    # on the loggers, not their handlers, so the access records are never left out
+    sampling = SamplingFilter(parse_levels(app.config["LOG_SAMPLING"]), parse_levels(app.config["LOG_RATE_LIMIT"]))
+    app.logger.addFilter(sampling)
+    logger.addFilter(sampling)
+
+    if not app.config["LOG_ACCESS"]:
+        return
+
+    timing.init_app(app)
+    timing.on_request_end(log_access)
+
+
+def log_access(request_timing):
+    """ Logs the access record of a request that is done """
+    if not access_logger.isEnabledFor(logging.INFO):
+        return
+    start, queries, query_seconds, status = request_timing
+    access_logger.info(
+        "method=%s path=%s status=%s duration_ms=%.2f sql=%s sql_ms=%.2f remote=%s",
+        request.method, request.full_path.rstrip("?"), status,
+        (time.perf_counter() - start) * 1000, queries, query_seconds * 1000, request.remote_addr,
+    )
@@ -0,0 +1,80 @@
+"""
+Prometheus metrics
+
+Every request is counted and timed by route template, method and status,
+along with the requests in flight and the number and time of the SQL
+statements it ran, which come from service/timing.py. GET /metrics
+returns them in the Prometheus text format.
+
+Under gunicorn each worker keeps its own values. Set PROMETHEUS_MULTIPROC_DIR
+(gunicorn_config.py does when it is not set) and the workers write their
+values to files in that directory, which GET /metrics adds up across
+the workers.
+"""
+import os
+import time
+from flask import request
+from prometheus_client import (
+    REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from service import timing
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests served", ["method", "route", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to serve an HTTP request", ["method", "route"], buckets=LATENCY_BUCKETS
+)
+IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests being served", multiprocess_mode="livesum"
+)
+REQUEST_QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements run by an HTTP request", ["route"], buckets=QUERY_COUNT_BUCKETS
+)
+REQUEST_QUERY_TIME = Histogram(
+    "db_query_seconds_per_request", "Time an HTTP request spent in SQL", ["route"], buckets=LATENCY_BUCKETS
+)
+QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds", "Time to run one SQL statement", buckets=LATENCY_BUCKETS
+)
+
+
+def init_app(app):
+    """ Instruments the requests of the app and the SQL of every engine """
+    if not app.config["METRICS_ENABLED"] or app.extensions.get("metrics"):
+        return
+    app.extensions["metrics"] = True
+    timing.init_app(app)
+    timing.on_request_start(IN_FLIGHT.inc)
+    timing.on_query(record_query)
+    timing.on_request_end(record_request)
+
+
+def record_request(request_timing):
+    """ Records a request once it is done, including a streamed body """
+    IN_FLIGHT.dec()
+    start, queries, query_seconds, status = request_timing
+    method = request.method
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUESTS.labels(method, route, status).inc()
+    REQUEST_LATENCY.labels(method, route).observe(time.perf_counter() - start)
+    REQUEST_QUERIES.labels(route).observe(queries)
+    REQUEST_QUERY_TIME.labels(route).observe(query_seconds)
+
+
+def record_query(statement, parameters, seconds, executemany):  # pylint: disable=unused-argument
+    """ Records the time of a SQL statement """
+    QUERY_LATENCY.observe(seconds)
+
+
+def exposition():
+    """ Returns the metrics of every worker in the Prometheus text format and its content type """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,279 @@
+"""
+Schema Migrations for Recommendation
+
+db.create_all() only creates the tables that are missing, it never changes
+a table that already holds data. Every change to a live table is recorded
+here as a numbered migration and upgrade() applies the ones that have not
+run yet, remembering the last applied version in the schema_version table.
+"""
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import inspect
+from service.models import db, Product, Recommendation, RecommendationLikeShard, RecommendationChange
+
+logger = logging.getLogger("flask.app")
+
+schema_version = db.Table(
+    "schema_version",
+    db.Column("version", db.Integer, primary_key=True),
+    db.Column("description", db.String(255), nullable=False),
+    db.Column("applied_at", db.DateTime, nullable=False),
+)
+
+# (version, description, function) tuples registered by @migration
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """ Registers a function as the migration with the given version """
+
+    def register(function):
+        MIGRATIONS.append((version, description, function))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return function
+
+    return register
+
+
+def current_version(engine):
+    """ Returns the last migration version applied to the database """
+    schema_version.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        version = conn.execute(db.select([db.func.max(schema_version.c.version)])).scalar()
+    return version or 0
+
+
+def upgrade(engine, target=None):
+    """
+    Applies every pending migration in order
+
+    Args:
+        engine (Engine): the SQLAlchemy engine of the database to upgrade
+        target (int): stop after this version instead of the last one
+    Returns:
+        list: the versions that were applied
+    """
+    version = current_version(engine)
+    applied = []
+    for number, description, function in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        logger.info("Applying migration %s: %s", number, description)
+        with engine.connect() as conn:
+            function(conn)
+        with engine.begin() as conn:
+            conn.execute(
+                schema_version.insert(),
+                version=number,
+                description=description,
+                applied_at=datetime.utcnow(),
+            )
+        applied.append(number)
+    return applied
+
+
+######################################################################
+#  M I G R A T I O N   H E L P E R S
+######################################################################
+
+def create_index(conn, name, table, columns, unique=False):
+    """
+    Creates an index unless it already exists
+
+    On PostgreSQL the index is built CONCURRENTLY so that a live table keeps
+    taking reads and writes while it is built. A concurrent build that
+    fails leaves an invalid index behind, which is dropped again so that
+    the migration can be retried.
+    """
+    if name in {index["name"] for index in inspect(conn).get_indexes(table)}:
+        return
+    logger.info("Creating index %s on %s", name, table)
+    statement = "CREATE {}INDEX {{}}{} ON {} ({})".format("UNIQUE " if unique else "", name, table, ", ".join(columns))
+    if conn.dialect.name != "postgresql":
+        conn.execute(statement.format(""))
+        return
+    with autocommit(conn) as own:
+        try:
+            own.execute(statement.format("CONCURRENTLY "))
+        except Exception:
+            own.execute("DROP INDEX CONCURRENTLY IF EXISTS {}".format(name))
+            raise
+
+
+def has_column(conn, table, column):
+    """ Returns whether a table has a column """
+    return column in {info["name"] for info in inspect(conn).get_columns(table)}
+
+
+def drop_index(conn, name, table):
+    """ Drops an index if it exists """
+    if name not in {index["name"] for index in inspect(conn).get_indexes(table)}:
+        return
+    logger.info("Dropping index %s on %s", name, table)
+    if conn.dialect.name != "postgresql":
+        conn.execute("DROP INDEX {}".format(name))
+        return
+    with autocommit(conn) as own:
+        own.execute("DROP INDEX CONCURRENTLY {}".format(name))
+
+
+@contextmanager
+def autocommit(conn):
+    """
+    Yields a connection of its own that runs every statement outside a transaction
+
+    CONCURRENTLY cannot run inside a transaction block. AUTOCOMMIT set on
+    the migration's connection would stay on its DBAPI connection until it
+    goes back to the pool, and a later conn.begin() would not be atomic.
+    """
+    with conn.engine.connect() as own:
+        yield own.execution_options(isolation_level="AUTOCOMMIT")
+
+
+######################################################################
+#  M I G R A T I O N S
+######################################################################
+
+@migration(1, "Add product and recommendation type lookup indexes")
+def add_lookup_indexes(conn):
+    """ Indexes the columns used by the find_by_* queries """
+    # tables made since migration 7 hold product ids, which it indexes
+    if has_column(conn, "recommendation", "product_a"):
+        create_index(conn, "ix_recommendation_product_a_recom_type", "recommendation", ["product_a", "recom_type"])
+        create_index(conn, "ix_recommendation_product_b_recom_type", "recommendation", ["product_b", "recom_type"])
+    create_index(conn, "ix_recommendation_recom_type", "recommendation", ["recom_type"])
+
+
+@migration(2, "Default likes to 0 and index them for sorting")
+def add_likes_index(conn):
+    """ Backfills missing likes and indexes the (likes, id) sort key """
+    conn.execute("UPDATE recommendation SET likes = 0 WHERE likes IS NULL")
+    create_index(conn, "ix_recommendation_likes_id", "recommendation", ["likes", "id"])
+
+
+@migration(3, "Add the sharded like counter table")
+def add_like_shards(conn):
+    """ Creates the recommendation_like_shard table """
+    RecommendationLikeShard.__table__.create(conn, checkfirst=True)
+
+
+@migration(4, "Rank the recommendations of a product by likes from the index")
+def add_top_likes_indexes(conn):
+    """ Extends the product_a indexes with the (likes, id) sort key """
+    if not has_column(conn, "recommendation", "product_a"):
+        return
+    create_index(conn, "ix_recommendation_product_a_recom_type_likes", "recommendation",
+                 ["product_a", "recom_type", "likes", "id"])
+    create_index(conn, "ix_recommendation_product_a_likes", "recommendation", ["product_a", "likes", "id"])
+    # a prefix of the new index
+    drop_index(conn, "ix_recommendation_product_a_recom_type", "recommendation")
+
+
+@migration(5, "Version the recommendations for conditional GETs")
+def add_versions(conn):
+    """ Adds the row version column and the change counter table """
+    if not has_column(conn, "recommendation", "version"):
+        # a constant default does not rewrite the table on PostgreSQL 11+
+        conn.execute("ALTER TABLE recommendation ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+    RecommendationChange.__table__.create(conn, checkfirst=True)
+
+
+@migration(6, "Make (product_a, product_b, recom_type) unique")
+def add_unique_pairs(conn):
+    """ Merges the duplicate Recommendations and adds the unique index the upserts need """
+    if not has_column(conn, "recommendation", "product_a"):
+        return
+    Recommendation.deduplicate(conn=conn, columns=("product_a", "product_b"))
+    # a duplicate written since the merge fails the build, run the upgrade again then
+    create_index(conn, "ix_recommendation_pair", "recommendation", ["product_a", "product_b", "recom_type"],
+                 unique=True)
+
+
+# the product name indexes of migrations 1 to 6, replaced by migration 7
+NAME_INDEXES = [
+    "ix_recommendation_product_a_recom_type",
+    "ix_recommendation_product_a_recom_type_likes",
+    "ix_recommendation_product_a_likes",
+    "ix_recommendation_product_b_recom_type",
+    "ix_recommendation_pair",
+]
+
+
+@migration(7, "Store the products as ids of a product table")
+def add_products(conn, chunk_size=10000):
+    """
+    Moves the product names of the Recommendations into the product table
+
+    The ids are filled in id range chunks of their own transactions, then a
+    last pass picks up the rows written meanwhile, and the product id
+    indexes are built before the name columns and their indexes are
+    dropped. SQLite cannot make the added columns NOT NULL, the model
+    always fills them.
+    """
+    Product.__table__.create(conn, checkfirst=True)
+    if has_column(conn, "recommendation", "product_a") and has_column(conn, "recommendation", "product_b"):
+        for column in ("product_a_id", "product_b_id"):
+            if not has_column(conn, "recommendation", column):
+                conn.execute("ALTER TABLE recommendation ADD COLUMN {} INTEGER REFERENCES product (id)".format(column))
+        low, high = conn.execute("SELECT MIN(id), MAX(id) FROM recommendation").first()
+        for start in range(low or 0, (high or 0) + 1, chunk_size):
+            with conn.begin():
+                fill_product_ids(conn, "id >= {} AND id < {}".format(start, start + chunk_size))
+        with conn.begin():
+            fill_product_ids(conn, "product_a_id IS NULL OR product_b_id IS NULL")
+
+    create_index(conn, "ix_recommendation_product_a_id_recom_type_likes", "recommendation",
+                 ["product_a_id", "recom_type", "likes", "id"])
+    create_index(conn, "ix_recommendation_product_a_id_likes", "recommendation", ["product_a_id", "likes", "id"])
+    create_index(conn, "ix_recommendation_product_b_id_recom_type", "recommendation", ["product_b_id", "recom_type"])
+    create_index(conn, "ix_recommendation_product_pair", "recommendation",
+                 ["product_a_id", "product_b_id", "recom_type"], unique=True)
+    for name in NAME_INDEXES:
+        drop_index(conn, name, "recommendation")
+
+    if conn.dialect.name == "postgresql":
+        set_product_ids_not_null(conn)
+    # every step checks what is left to do, so a rerun finishes an upgrade
+    # that failed half way; DROP COLUMN needs SQLite 3.35, as the upserts do
+    for column in ("product_a", "product_b"):
+        if has_column(conn, "recommendation", column):
+            conn.execute("ALTER TABLE recommendation DROP COLUMN {}".format(column))
+
+
+def set_product_ids_not_null(conn):
+    """
+    Makes the product id columns NOT NULL without locking out the Recommendations for a scan
+
+    SET NOT NULL alone scans the table under an ACCESS EXCLUSIVE lock. A
+    CHECK constraint added NOT VALID takes that lock only for a moment,
+    VALIDATE CONSTRAINT scans under a lock that lets reads and writes go
+    on, and SET NOT NULL then trusts the valid constraint (PostgreSQL 12+).
+    """
+    if not any(column["nullable"] for column in inspect(conn).get_columns("recommendation")
+               if column["name"] in ("product_a_id", "product_b_id")):
+        return
+    constraint = "ck_recommendation_product_ids_not_null"
+    if constraint not in {check["name"] for check in inspect(conn).get_check_constraints("recommendation")}:
+        conn.execute("ALTER TABLE recommendation ADD CONSTRAINT {} "
+                     "CHECK (product_a_id IS NOT NULL AND product_b_id IS NOT NULL) NOT VALID".format(constraint))
+    conn.execute("ALTER TABLE recommendation VALIDATE CONSTRAINT {}".format(constraint))
+    conn.execute("ALTER TABLE recommendation ALTER COLUMN product_a_id SET NOT NULL, "
+                 "ALTER COLUMN product_b_id SET NOT NULL")
+    conn.execute("ALTER TABLE recommendation DROP CONSTRAINT {}".format(constraint))
+
+
+def fill_product_ids(conn, where):
+    """ Adds the products named by the Recommendations matching where and sets their ids """
+    conn.execute(
+        "INSERT INTO product (name) SELECT name FROM ("
+        "SELECT product_a AS name FROM recommendation WHERE {0} "
+        "UNION SELECT product_b FROM recommendation WHERE {0}) AS names "
+        "WHERE NOT EXISTS (SELECT 1 FROM product WHERE product.name = names.name)".format(where)
+    )
+    conn.execute(
+        "UPDATE recommendation SET "
+        "product_a_id = (SELECT id FROM product WHERE product.name = recommendation.product_a), "
+        "product_b_id = (SELECT id FROM product WHERE product.name = recommendation.product_b) "
+        "WHERE {}".format(where)
+    )
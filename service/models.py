@@ -4,7 +4,12 @@ Models for Recommendation
 All of the models are stored in this module
 """
 import logging
+import random
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from service.cache import RecommendationCache, ProductNames
+from service.pool import engine_options
 
 logger = logging.getLogger("flask.app")
 
@@ -16,45 +21,516 @@ class DataValidationError(Exception):
     pass
 
 
+class DataConflictError(Exception):
+    """ Used when a write would duplicate an existing Recommendation """
+    pass
+
+
 class Recommendation(db.Model):
     """
     Class that represents a <your resource model name>
     """
 
     app = None
+    cache = RecommendationCache()
+
+    # Indexes matching the find_by_* query shapes. The composite indexes
+    # lead with the product so they also serve the single column lookups,
+    # and the product_a ones end in (likes, id) so the top recommendations
+    # of a product are read in order straight from the index.
+    __table_args__ = (
+        db.Index("ix_recommendation_product_a_id_recom_type_likes", "product_a_id", "recom_type", "likes", "id"),
+        db.Index("ix_recommendation_product_a_id_likes", "product_a_id", "likes", "id"),
+        db.Index("ix_recommendation_product_b_id_recom_type", "product_b_id", "recom_type"),
+        db.Index("ix_recommendation_recom_type", "recom_type"),
+        db.Index("ix_recommendation_likes_id", "likes", "id"),
+        # a pair of products has one Recommendation of each type, see upsert()
+        db.Index("ix_recommendation_product_pair", "product_a_id", "product_b_id", "recom_type", unique=True),
+        # never hand out the id of a deleted row again, ETags include it
+        {"sqlite_autoincrement": True},
+    )
 
-    # Table Schema
+    # Table Schema. The products are stored as ids of the product table,
+    # product_a and product_b below get and set their names.
     id = db.Column(db.Integer, primary_key=True)
-    product_a = db.Column(db.String(128), nullable=False)
-    product_b = db.Column(db.String(128), nullable=False)
+    product_a_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
+    product_b_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
     recom_type = db.Column(db.String(1), nullable=False)
-    likes = db.Column(db.Integer)
-    
+    likes = db.Column(db.Integer, default=0)
+    # bumped by every write to the row, see etag()
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    # Fields of a serialized Recommendation, in order
+    FIELDS = ("id", "product_a", "product_b", "recom_type", "likes")
+    # The columns that hold them, see named_rows()
+    COLUMNS = ("id", "product_a_id", "product_b_id", "recom_type", "likes")
+
+    # product names set since the ids were, see resolve_products()
+    _names = None
+
+    # Keyset pagination orders: sort name -> (key columns, descending)
+    SORT_KEYS = {
+        "id": (("id",), False),
+        "-id": (("id",), True),
+        "likes": (("likes", "id"), False),
+        "-likes": (("likes", "id"), True),
+    }
 
     def __repr__(self):
         return "<Recommendation %r id=[%s]>" % (self.product_a, self.id)
 
+    @property
+    def product_a(self):
+        """ The name of the product the Recommendation is made for """
+        return self._product_name("product_a")
+
+    @product_a.setter
+    def product_a(self, name):
+        self._set_product_name("product_a", name)
+
+    @property
+    def product_b(self):
+        """ The name of the product that is recommended """
+        return self._product_name("product_b")
+
+    @product_b.setter
+    def product_b(self, name):
+        self._set_product_name("product_b", name)
+
+    def _product_name(self, field):
+        if self._names and field in self._names:
+            return self._names[field]
+        product_id = getattr(self, field + "_id")
+        if product_id is None:
+            return None
+        return Product.names_for([product_id])[product_id]
+
+    def _set_product_name(self, field, name):
+        if self._names is None:
+            self._names = {}
+        self._names[field] = name
+
+    @classmethod
+    def resolve_products(cls, recommendations):
+        """ Sets the product ids of the names given to Recommendations, adding the new products """
+        pending = [recommendation for recommendation in recommendations if recommendation._names]
+        if not pending:
+            return
+        ids = Product.ids_for({name for recommendation in pending for name in recommendation._names.values()},
+                              create=True)
+        for recommendation in pending:
+            for field, name in recommendation._names.items():
+                setattr(recommendation, field + "_id", ids[name])
+
     def create(self):
         """
         Creates a Recommendation to the database
         """
         logger.info("Creating %s", self.product_a)
+        self.resolve_products([self])
         self.id = None  # id must be none to generate next primary key
         db.session.add(self)
-        db.session.commit()
+        RecommendationChange.record()
+        self._commit_unique()
+        self.cache.invalidate(self.id)
+
+    @classmethod
+    def create_many(cls, recommendations, chunk_size=1000, skip_existing=False):
+        """
+        Creates Recommendations in chunks with one transaction per chunk
+
+        Each chunk goes in with a single INSERT ... ON CONFLICT DO NOTHING,
+        which PostgreSQL and SQLite (3.35 or later) both run, so a
+        Recommendation another request created meanwhile is found per row.
+
+        Args:
+            recommendations (list): the new Recommendations, which get their ids set
+            chunk_size (int): how many Recommendations to insert per transaction
+            skip_existing (bool): leave out the Recommendations of products and
+                a type that already have one, instead of refusing their chunk
+        Returns:
+            list: the Recommendations that were left out, their id is None
+        """
+        logger.info("Creating %s Recommendations", len(recommendations))
+        cls.resolve_products(recommendations)
+        skipped = []
+        for start in range(0, len(recommendations), chunk_size):
+            chunk = recommendations[start:start + chunk_size]
+            values = ", ".join("(:a{0}, :b{0}, :t{0}, :l{0})".format(number) for number in range(len(chunk)))
+            params = {}
+            for number, recommendation in enumerate(chunk):
+                params.update({"a%d" % number: recommendation.product_a_id, "b%d" % number: recommendation.product_b_id,
+                               "t%d" % number: recommendation.recom_type, "l%d" % number: recommendation.likes or 0})
+            rows = db.session.execute(
+                "INSERT INTO recommendation (product_a_id, product_b_id, recom_type, likes) VALUES " + values +
+                " ON CONFLICT (product_a_id, product_b_id, recom_type) DO NOTHING"
+                " RETURNING id, product_a_id, product_b_id, recom_type",
+                params,
+            ).fetchall()
+            ids = {tuple(row[1:]): row[0] for row in rows}
+            left_out = []
+            for recommendation in chunk:
+                # a repeat within the chunk is left out like an existing one
+                recommendation.id = ids.pop((recommendation.product_a_id, recommendation.product_b_id,
+                                             recommendation.recom_type), None)
+                if recommendation.id is None:
+                    left_out.append(recommendation)
+            if left_out and not skip_existing:
+                db.session.rollback()
+                for recommendation in chunk:
+                    recommendation.id = None
+                raise DataConflictError(
+                    "Recommendations {} to {} hold one that already exists".format(start, start + len(chunk) - 1)
+                )
+            skipped.extend(left_out)
+            if rows:
+                RecommendationChange.record()
+            db.session.commit()
+            cls.cache.invalidate(*(row[0] for row in rows))
+        return skipped
 
     def save(self):
         """
         Updates a Recommendation to the database
         """
         logger.info("Saving %s", self.product_a)
-        db.session.commit()
+        self.resolve_products([self])
+        self.version = Recommendation.version + 1
+        RecommendationChange.record()
+        self._commit_unique()
+        self.cache.invalidate(self.id)
+
+    def _commit_unique(self):
+        """ Commits the session, raising DataConflictError when the pair is taken """
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise DataConflictError(
+                "A Recommendation of type {} from {} to {} already exists".format(
+                    self.recom_type, self.product_a, self.product_b)
+            )
 
     def delete(self):
         """ Removes a Recommendation from the data store """
         logger.info("Deleting %s", self.product_a)
+        by_id = self.id
+        RecommendationLikeShard.query.filter_by(recommendation_id=by_id).delete()
         db.session.delete(self)
+        RecommendationChange.record()
+        db.session.commit()
+        self.cache.invalidate(by_id)
+
+    @classmethod
+    def delete_many(cls, query, chunk_size=1000):
+        """
+        Removes the Recommendations of a query in chunks with one transaction per chunk
+
+        Args:
+            query (Query): the query of Recommendations to remove
+            chunk_size (int): how many Recommendations to remove per transaction
+        Returns:
+            int: the number of Recommendations that were removed
+        """
+        logger.info("Deleting Recommendations in chunks of %s", chunk_size)
+        deleted = 0
+        last_id = 0
+        while True:
+            ids = [row.id for row in query.with_entities(cls.id)
+                   .filter(cls.id > last_id).order_by(cls.id).limit(chunk_size)]
+            if not ids:
+                break
+            RecommendationLikeShard.query.filter(
+                RecommendationLikeShard.recommendation_id.in_(ids)
+            ).delete(synchronize_session=False)
+            cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
+            RecommendationChange.record()
+            db.session.commit()
+            cls.cache.invalidate(*ids)
+            deleted += len(ids)
+            last_id = ids[-1]
+        logger.info("Deleted %s Recommendations", deleted)
+        return deleted
+
+    @classmethod
+    def truncate(cls):
+        """ Removes every Recommendation at once """
+        logger.info("Truncating Recommendations")
+        if db.session.bind.dialect.name == "postgresql":
+            db.session.execute("TRUNCATE recommendation_like_shard, recommendation")
+        else:
+            db.session.execute(RecommendationLikeShard.__table__.delete())
+            db.session.execute(cls.__table__.delete())
+        RecommendationChange.record()
+        db.session.commit()
+        cls.cache.invalidate_all()
+
+    @classmethod
+    def add_likes(cls, by_id, count=1, shards=0):
+        """
+        Adds likes to a Recommendation with an atomic update in the database
+
+        Args:
+            by_id (int): the id of the Recommendation that was liked
+            count (int): how many likes to add
+            shards (int): spread the likes over this many counter rows
+                instead of updating the Recommendation row itself
+        Returns:
+            dict: the serialized Recommendation with its new like count,
+                or None when there is no such Recommendation
+
+        The change counter of the lists is left out of the transaction, so
+        likes do not queue up on its rows: count them with record_likes().
+        """
+        logger.info("Adding %s likes to id %s ...", count, by_id)
+        if shards:
+            if not RecommendationLikeShard.add(by_id, random.randrange(shards), count):
+                db.session.rollback()
+                return None
+            # still inside the transaction, so this reads our own update
+            sharded = db.select([db.func.coalesce(db.func.sum(RecommendationLikeShard.likes), 0)]).where(
+                RecommendationLikeShard.recommendation_id == cls.id).as_scalar()
+            columns = [getattr(cls, name) for name in cls.COLUMNS] + [sharded]
+            rows = cls.read_rows(cls.query.filter(cls.id == by_id).with_entities(*columns).statement)
+        else:
+            # the row comes back from the update itself, in one round trip
+            rows = cls.named_rows(db.session.execute(
+                "UPDATE recommendation SET likes = COALESCE(likes, 0) + :count, version = version + 1"
+                " WHERE id = :id RETURNING " + ", ".join(cls.COLUMNS),
+                {"count": count, "id": by_id},
+            ).fetchall())
+        if not rows:
+            db.session.rollback()
+            return None
+        db.session.commit()
+        cls.cache.invalidate(by_id)
+        message = dict(zip(cls.FIELDS, rows[0]))
+        message["likes"] = (message["likes"] or 0) + sum(rows[0][len(cls.FIELDS):])
+        return message
+
+    @classmethod
+    def record_likes(cls):
+        """ Counts the likes add_likes() wrote to the rows as one change to the lists """
+        RecommendationChange.record()
+        db.session.commit()
+
+    @classmethod
+    def add_likes_many(cls, likes):
+        """
+        Adds likes to many Recommendations with one batched update
+
+        Args:
+            likes (dict): the number of likes to add by Recommendation id
+        """
+        logger.info("Adding likes to %s Recommendations", len(likes))
+        table = cls.__table__
+        # in id order, so that workers updating the same rows lock them in the same order
+        db.session.execute(
+            table.update()
+            .where(table.c.id == db.bindparam("rid"))
+            .values(likes=db.func.coalesce(table.c.likes, 0) + db.bindparam("count"),
+                    version=table.c.version + 1),
+            [{"rid": rid, "count": likes[rid]} for rid in sorted(likes)],
+        )
+        RecommendationChange.record()
         db.session.commit()
+        cls.cache.invalidate(*likes)
+
+    @classmethod
+    def fold_likes(cls, chunk_size=1000):
+        """
+        Moves the likes counted in the shards into the Recommendation rows
+
+        The shards are folded and deleted chunk_size at a time, with one
+        transaction per chunk, so no lock is held for long and no emptied
+        shard is left for the next fold to read. A like that waited for the
+        lock on a folded shard starts a new one.
+        Args:
+            chunk_size (int): how many shards to fold per transaction
+        Returns:
+            int: the number of likes that were folded
+        """
+        logger.info("Folding sharded likes")
+        shards = RecommendationLikeShard.__table__
+        table = cls.__table__
+        folded = 0
+        after = None
+        while True:
+            # in id order, as add_likes_many() locks the rows, and locked, so
+            # that workers folding at the same time never fold a like twice:
+            # the shards another worker is folding are left to it
+            query = (
+                db.select([shards.c.recommendation_id, shards.c.shard, shards.c.likes])
+                .order_by(shards.c.recommendation_id, shards.c.shard)
+                .limit(chunk_size)
+                .with_for_update(skip_locked=True)
+            )
+            if after is not None:
+                query = query.where(db.tuple_(shards.c.recommendation_id, shards.c.shard) > after)
+            rows = db.session.execute(query).fetchall()
+            if not rows:
+                break
+            after = tuple(rows[-1][:2])
+            db.session.execute(
+                shards.delete().where(db.and_(shards.c.recommendation_id == db.bindparam("rid"),
+                                              shards.c.shard == db.bindparam("number"))),
+                [{"rid": rid, "number": shard} for rid, shard, _ in rows],
+            )
+            likes = {}
+            for rid, _, count in rows:
+                likes[rid] = likes.get(rid, 0) + count
+            likes = {rid: count for rid, count in likes.items() if count}
+            if likes:
+                db.session.execute(
+                    table.update()
+                    .where(table.c.id == db.bindparam("rid"))
+                    .values(likes=db.func.coalesce(table.c.likes, 0) + db.bindparam("count"),
+                            version=table.c.version + 1),
+                    [{"rid": rid, "count": count} for rid, count in sorted(likes.items())],
+                )
+                RecommendationChange.record()
+            db.session.commit()
+            if likes:
+                cls.cache.invalidate(*likes)
+            folded += sum(likes.values())
+            if len(rows) < chunk_size:
+                break
+        return folded
+
+    @classmethod
+    def upsert(cls, recommendations, chunk_size=1000):
+        """
+        Creates Recommendations, adding the likes of the ones that exist to them instead
+
+        Each chunk goes in with a single INSERT ... ON CONFLICT DO UPDATE,
+        which PostgreSQL and SQLite (3.35 or later) both run, so concurrent
+        upserts of the same pair add up without a lost update.
+
+        Args:
+            recommendations (list): the Recommendations to create or merge, ids are ignored
+            chunk_size (int): how many Recommendations to write per transaction
+        Returns:
+            list: one (serialized Recommendation, created) pair per Recommendation,
+                in order, created being False when the likes were merged
+        """
+        logger.info("Upserting %s Recommendations", len(recommendations))
+        cls.resolve_products(recommendations)
+        # a statement may not update the same row twice, so merge the repeats first
+        merged = {}
+        for recommendation in recommendations:
+            key = (recommendation.product_a_id, recommendation.product_b_id, recommendation.recom_type)
+            merged[key] = merged.get(key, 0) + (recommendation.likes or 0)
+        keys = list(merged)
+        rows = {}
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            values = ", ".join("(:a{0}, :b{0}, :t{0}, :l{0})".format(number) for number in range(len(chunk)))
+            params = {}
+            for number, key in enumerate(chunk):
+                params.update({"a%d" % number: key[0], "b%d" % number: key[1],
+                               "t%d" % number: key[2], "l%d" % number: merged[key]})
+            result = db.session.execute(
+                "INSERT INTO recommendation (product_a_id, product_b_id, recom_type, likes) VALUES " + values +
+                " ON CONFLICT (product_a_id, product_b_id, recom_type) DO UPDATE"
+                " SET likes = COALESCE(recommendation.likes, 0) + excluded.likes,"
+                " version = recommendation.version + 1"
+                " RETURNING id, product_a_id, product_b_id, recom_type, likes, version",
+                params,
+            ).fetchall()
+            RecommendationChange.record()
+            db.session.commit()
+            for row in result:
+                rows[tuple(row[1:4])] = row
+            cls.cache.invalidate(*(row[0] for row in result))
+        results = []
+        seen = set()
+        for recommendation in recommendations:
+            key = (recommendation.product_a_id, recommendation.product_b_id, recommendation.recom_type)
+            row = rows[key]
+            # a new row is at version 1, only its first occurrence created it
+            message = dict(zip(cls.FIELDS, (row[0], recommendation.product_a, recommendation.product_b) + tuple(row[3:5])))
+            results.append((message, row[5] == 1 and key not in seen))
+            seen.add(key)
+        return results
+
+    @classmethod
+    def deduplicate(cls, chunk_size=100, conn=None, columns=("product_a_id", "product_b_id")):
+        """
+        Merges the Recommendations that share a (product_a, product_b, recom_type)
+
+        The oldest Recommendation of each pair keeps the likes of all of
+        them, including the likes still in their shards, and the others are
+        removed. The table is walked product_a by product_a in short
+        transactions, so no lock is held for long on a large table.
+
+        Args:
+            chunk_size (int): how many product_a values to merge per transaction
+            conn (Connection): run on this connection instead of the session, as the migrations do
+            columns (tuple): the product columns to merge on, migration 6 runs
+                on the product names the table held before migration 7
+        Returns:
+            int: the number of Recommendations that were removed
+        """
+        logger.info("Merging duplicate Recommendations")
+        product_a, product_b = columns
+        table = db.table("recommendation", *(db.column(name) for name in
+                                             ("id", product_a, product_b, "recom_type", "likes", "version")))
+        shards = RecommendationLikeShard.__table__
+        execute = conn.execute if conn is not None else db.session.execute
+        removed = 0
+        after = None
+        while True:
+            query = db.select([table.c[product_a]]).distinct().order_by(table.c[product_a]).limit(chunk_size)
+            if after is not None:
+                query = query.where(table.c[product_a] > after)
+            products = [row[0] for row in execute(query)]
+            if not products:
+                break
+            after = products[-1]
+            transaction = conn.begin() if conn is not None else None
+            rows = execute(
+                db.select([table.c.id, table.c[product_a], table.c[product_b], table.c.recom_type])
+                .where(table.c[product_a].in_(products))
+                .order_by(table.c[product_a], table.c[product_b], table.c.recom_type, table.c.id)
+            ).fetchall()
+            keepers = {}
+            losers = {}  # loser id -> keeper id
+            for row in rows:
+                keeper_id = keepers.setdefault(tuple(row[1:4]), row[0])
+                if keeper_id != row[0]:
+                    losers[row[0]] = keeper_id
+            if losers:
+                # delete first and add what the deleted rows held, so a like
+                # committed since the read above is never overwritten or lost
+                ids = db.bindparam("ids", expanding=True)
+                deleted = execute(
+                    db.text("DELETE FROM recommendation_like_shard WHERE recommendation_id IN :ids"
+                            " RETURNING recommendation_id, likes").bindparams(ids),
+                    {"ids": list(losers)},
+                ).fetchall()
+                deleted += execute(
+                    db.text("DELETE FROM recommendation WHERE id IN :ids RETURNING id, likes").bindparams(ids),
+                    {"ids": list(losers)},
+                ).fetchall()
+                merged = {}
+                for loser_id, likes in deleted:
+                    merged[losers[loser_id]] = merged.get(losers[loser_id], 0) + (likes or 0)
+                execute(
+                    table.update().where(table.c.id == db.bindparam("rid"))
+                    .values(likes=db.func.coalesce(table.c.likes, 0) + db.bindparam("delta"),
+                            version=table.c.version + 1),
+                    [{"rid": rid, "delta": merged.get(rid, 0)} for rid in sorted(set(losers.values()))],
+                )
+                RecommendationChange.record(conn)
+                removed += len(losers)
+            if transaction is not None:
+                transaction.commit()
+            else:
+                db.session.commit()
+            if losers:
+                cls.cache.invalidate(*(list(losers) + sorted(set(losers.values()))))
+        logger.info("Removed %s duplicate Recommendations", removed)
+        return removed
 
     def serialize(self):
         """ Serializes a Recommendation into a dictionary """
@@ -84,17 +560,40 @@ class Recommendation(db.Model):
             raise DataValidationError(
                 "Invalid Recommendation: body of request contained" "bad or no data"
             )
+        except ValueError as error:
+            raise DataValidationError("Invalid Recommendation: likes must be an integer")
+        for name in ("product_a", "product_b", "recom_type"):
+            if not isinstance(getattr(self, name), str):
+                raise DataValidationError("Invalid Recommendation: {} must be a string".format(name))
         return self
 
     @classmethod
-    def init_db(cls, app):
-        """ Initializes the database session """
-        logger.info("Initializing database")
+    def init_app(cls, app):
+        """ Binds the model to the Flask app without connecting to the database """
         cls.app = app
-        # This is where we initialize SQLAlchemy from the Flask app
+        cls.cache = RecommendationCache.from_config(app.config)
+        Product.interned = ProductNames(app.config.get("PRODUCT_CACHE_SIZE", 100000))
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
+        # This is where we initialize SQLAlchemy from the Flask app,
+        # the engine and its first connection are only made on first use
         db.init_app(app)
+
+    @classmethod
+    def create_schema(cls):
+        """ Creates the missing tables and applies the pending migrations """
+        logger.info("Creating the database schema")
+        db.create_all(app=cls.app)  # make our sqlalchemy tables
+        # create_all() never alters a live table, so bring it up to date
+        from service import migrations
+        migrations.upgrade(db.get_engine(cls.app))
+
+    @classmethod
+    def init_db(cls, app):
+        """ Initializes the database session and the schema """
+        logger.info("Initializing database")
+        cls.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        cls.create_schema()
 
     @classmethod
     def all(cls):
@@ -108,12 +607,274 @@ class Recommendation(db.Model):
         logger.info("Processing lookup for id %s ...", by_id)
         return cls.query.get(by_id)
 
+    @classmethod
+    def find_version(cls, by_id):
+        """ Returns the version of the Recommendation with the given id, or None """
+        logger.info("Processing version lookup for id %s ...", by_id)
+        return db.session.query(cls.version).filter(cls.id == by_id).scalar()
+
+    @classmethod
+    def find_serialized(cls, by_id):
+        """ Returns the serialized Recommendation with the given id through the cache, or None """
+        return cls.find_serialized_version(by_id)[0]
+
+    @classmethod
+    def find_serialized_version(cls, by_id, version=None):
+        """ Returns the serialized Recommendation with the given id and its version through the cache
+
+        Args:
+            by_id (int): the id of the Recommendation
+            version (int): the version from find_version(), a cached entry
+                of another version is read again
+        Returns:
+            tuple: the serialized Recommendation and its version, (None, None) when there is none
+        """
+        logger.info("Processing cached lookup for id %s ...", by_id)
+
+        def load():
+            columns = [getattr(cls, name) for name in cls.COLUMNS] + [cls.version]
+            rows = cls.read_rows(cls.query.filter(cls.id == by_id).with_entities(*columns).statement)
+            return {"recommendation": dict(zip(cls.FIELDS, rows[0])), "version": rows[0][-1]} if rows else {}
+
+        entry = cls.cache.fetch_one(by_id, load, version)
+        if not entry:
+            return None, None
+        return dict(entry["recommendation"]), entry["version"]
+
+    @classmethod
+    def rows_statement(cls, query, count=False):
+        """ Returns the Core SELECT of the COLUMNS of a query
+
+        Executing it skips building Recommendation objects, which costs
+        more than the SQL on large lists.
+        Args:
+            query (Query): the query of Recommendations to read
+            count (bool): add a last column holding the number of rows the
+                query matches before any LIMIT, counted by a window function
+        """
+        columns = [getattr(cls, name) for name in cls.COLUMNS]
+        if count:
+            columns.append(db.func.count().over().label("total"))
+        return query.with_entities(*columns).statement
+
+    @classmethod
+    def named_rows(cls, rows):
+        """ Returns rows of COLUMNS as tuples of FIELDS, with the names of the products instead of their ids """
+        names = Product.names_for({product_id for row in rows for product_id in row[1:3]})
+        return [(row[0], names[row[1]], names[row[2]]) + tuple(row[3:]) for row in rows]
+
+    @classmethod
+    def read_rows(cls, statement):
+        """ Executes a rows_statement() and returns its rows of FIELDS """
+        return cls.named_rows(db.session.execute(statement).fetchall())
+
+    @classmethod
+    def find_rows(cls, query, key, version=None, count=False):
+        """ Returns the rows of FIELDS of a query through the cache
+
+        The rows are read without building Recommendation objects.
+        Args:
+            query (Query): the query of Recommendations to read
+            key (string): identifies the query in the cache
+            version (int): the RecommendationChange.total() the rows are for
+            count (bool): end every row with the number of matches, see rows_statement()
+        """
+        logger.info("Processing cached rows for %s ...", key)
+        statement = cls.rows_statement(query, count)
+        return cls.cache.fetch_list(key, lambda: cls.read_rows(statement), version)
+
     @classmethod
     def find_or_404(cls, by_id):
         """ Find a Recommendation by it's id """
         logger.info("Processing lookup or 404 for id %s ...", by_id)
         return cls.query.get_or_404(by_id)
 
+    @classmethod
+    def find_page(cls, query, limit, after=None, sort="id", count=False):
+        """ Returns a page of Recommendations using keyset pagination
+
+        Args:
+            query (Query): the query of Recommendations to page through
+            limit (int): the maximum number of Recommendations on the page
+            after (tuple): the sort key of the last Recommendation of the previous page
+            sort (string): one of the SORT_KEYS orders
+            count (bool): end every row with the number of matches on all
+                the pages, see rows_statement()
+        Returns:
+            tuple: the rows of FIELDS on the page and the sort key to
+                continue after, which is None on the last page
+        """
+        logger.info("Processing page of %s after %s sorted by %s ...", limit, after, sort)
+        names, descending = cls.sort_key(sort)
+        if count:
+            # count the matches before the cursor leaves the earlier pages out
+            matches = cls.rows_statement(query, count).alias("matches")
+            columns = [matches.c[name] for name in names]
+            statement = db.select(list(matches.c))
+        else:
+            columns = [getattr(cls, name) for name in names]
+            statement = cls.rows_statement(query)
+        if after is not None:
+            key = db.tuple_(*columns) if len(columns) > 1 else columns[0]
+            value = db.tuple_(*after) if len(columns) > 1 else after[0]
+            statement = statement.where(key < value if descending else key > value)
+        statement = statement.order_by(*[column.desc() if descending else column for column in columns])
+        rows = cls.read_rows(statement.limit(limit + 1))
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, tuple(rows[-1][cls.FIELDS.index(name)] for name in names)
+
+    @classmethod
+    def sort_key(cls, sort):
+        """ Returns the key column names of a SORT_KEYS order and whether it descends """
+        if sort not in cls.SORT_KEYS:
+            raise DataValidationError("Invalid sort: " + sort)
+        return cls.SORT_KEYS[sort]
+
+    @classmethod
+    def sort_by(cls, query, sort):
+        """ Orders a query of Recommendations by one of the SORT_KEYS orders """
+        names, descending = cls.sort_key(sort)
+        columns = [getattr(cls, name) for name in names]
+        return query.order_by(*[column.desc() if descending else column for column in columns])
+
+    @classmethod
+    def stream(cls, query, batch_size=1000):
+        """ Yields the rows of FIELDS of a query a batch at a time
+
+        Args:
+            query (Query): the query of Recommendations to read
+            batch_size (int): how many rows to fetch from the cursor at once
+        """
+        logger.info("Processing stream in batches of %s ...", batch_size)
+        # stream_results reads through a server side cursor where the driver has one
+        result = db.session.execute(cls.rows_statement(query).execution_options(stream_results=True))
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            yield cls.named_rows(rows)
+
+    @classmethod
+    def find_by_filters(cls, product_a=None, product_b=None, recom_type=None, ids=None, min_likes=None):
+        """ Returns the Recommendations that match every filter given
+
+        The product and type filters take a string, or a list to match any of.
+        Args:
+            product_a (string or list): the Product_a of the Recommendations you want to match
+            product_b (string or list): the Product_b of the Recommendations you want to match
+            recom_type (string or list): the Recommendations Type you want to match
+            ids (list): the ids of the Recommendations you want to match
+            min_likes (int): the fewest likes the Recommendations may have
+        """
+        logger.info("Processing filter query for %s %s %s %s %s ...",
+                    product_a, product_b, recom_type, ids, min_likes)
+        query = cls.query
+        for column, value in [(cls.product_a_id, product_a), (cls.product_b_id, product_b)]:
+            if value:
+                query = cls.filter_products(query, column, value)
+        if recom_type:
+            if isinstance(recom_type, str):
+                query = query.filter(cls.recom_type == recom_type)
+            else:
+                query = query.filter(cls.recom_type.in_(recom_type))
+        if ids is not None:
+            query = query.filter(cls.id.in_(ids))
+        if min_likes is not None:
+            query = query.filter(cls.likes >= min_likes)
+        return query
+
+    @classmethod
+    def filter_products(cls, query, column, names):
+        """ Filters a query on a product id column by product names
+
+        Args:
+            query (Query): the query of Recommendations to filter
+            column (Column): product_a_id or product_b_id
+            names (string or list): the name of the product, or a list to match any of
+        """
+        ids = list(Product.ids_for([names] if isinstance(names, str) else names).values())
+        if not ids:
+            return query.filter(db.false())  # an unknown product has no Recommendations
+        return query.filter(column == ids[0] if len(ids) == 1 else column.in_(ids))
+
+    @classmethod
+    def find_top_for_product(cls, product_a, limit, recom_type=None):
+        """ Returns the most liked Recommendations for a Product A, best first
+
+        Args:
+            product_a (string): the Product_a of the Recommendations you want to rank
+            limit (int): how many Recommendations to return
+            recom_type (string): only rank Recommendations of this type
+        """
+        logger.info("Processing top %s query for %s ...", limit, product_a)
+        query = cls.filter_products(cls.query, cls.product_a_id, product_a)
+        if recom_type:
+            query = query.filter(cls.recom_type == recom_type)
+        return query.order_by(cls.likes.desc(), cls.id.desc()).limit(limit)
+
+    @classmethod
+    def find_graph(cls, product, depth, fanout, recom_type=None, max_products=1000):
+        """ Returns the products within depth hops of a product and the Recommendations that lead to them
+
+        The Recommendations form a graph from product_a to product_b. Every hop
+        is one query that follows the fanout most liked Recommendations of
+        each product the hop before reached. A product is followed once, from
+        the hop that first reaches it, and scores the combined likes of every
+        followed Recommendation that points to it.
+        Args:
+            product (string): the product to start from
+            depth (int): how many hops to follow
+            fanout (int): how many Recommendations to follow from each product
+            recom_type (list): only follow Recommendations of these types
+            max_products (int): stop adding products once this many were reached
+        Returns:
+            tuple: the rows of FIELDS of the followed Recommendations, and
+                (product, depth, score) of the reached products, best first
+        """
+        logger.info("Processing graph query for %s, %s hops of %s ...", product, depth, fanout)
+        start = Product.ids_for([product]).get(product)
+        if start is None:
+            return [], []
+        rank = db.func.row_number().over(
+            partition_by=cls.product_a_id, order_by=(cls.likes.desc(), cls.id.desc())
+        ).label("rank")
+        edges = []
+        reached = {start: [0, 0]}  # product id -> [depth, score]
+        frontier = [start]
+        for hop in range(1, depth + 1):
+            rows = []
+            for chunk_start in range(0, len(frontier), 500):
+                query = cls.query.with_entities(*[getattr(cls, name) for name in cls.COLUMNS], rank).filter(
+                    cls.product_a_id.in_(frontier[chunk_start:chunk_start + 500])
+                )
+                if recom_type:
+                    query = query.filter(cls.recom_type.in_(recom_type))
+                ranked = query.subquery()
+                rows.extend(db.session.execute(
+                    db.select([ranked.c[name] for name in cls.COLUMNS])
+                    .where(ranked.c.rank <= fanout)
+                    .order_by(ranked.c.product_a_id, ranked.c.rank)
+                ))
+            frontier = []
+            for row in rows:
+                node = reached.get(row[2])
+                if node is None:
+                    if len(reached) > max_products:
+                        continue
+                    node = reached[row[2]] = [hop, 0]
+                    frontier.append(row[2])
+                node[1] += row[4] or 0
+                edges.append(row)
+            if not frontier:
+                break
+        del reached[start]
+        names = Product.names_for(reached)
+        products = sorted(((names[product_id], hop, score) for product_id, (hop, score) in reached.items()),
+                          key=lambda item: (-item[2], item[1], item[0]))
+        return cls.named_rows(edges), products
+
     @classmethod
     def find_by_product_a(cls, product_a):
         """ Returns a Recommendation with the given Product Name (product a)
@@ -122,7 +883,7 @@ class Recommendation(db.Model):
             product_a (string): the Product_a of the Recommendations you want to match
         """
         logger.info("Processing Product A query for %s ...", product_a)
-        return cls.query.filter(cls.product_a == product_a)
+        return cls.filter_products(cls.query, cls.product_a_id, product_a)
 
     @classmethod
     def find_by_product_b(cls, product_b):
@@ -132,7 +893,7 @@ class Recommendation(db.Model):
             product_b (string): the Product_b of the Recommendations you want to match
         """
         logger.info("Processing Product_A query for %s ...", product_b)
-        return cls.query.filter(cls.product_b == product_b)
+        return cls.filter_products(cls.query, cls.product_b_id, product_b)
 
     @classmethod
     def find_by_recommendation_type(cls, recom_type):
@@ -151,7 +912,7 @@ class Recommendation(db.Model):
             product_b (string): the Product_a of the Recommendations you want to match
         """
         logger.info("Processing Recommendations Type query for %s ...", recom_type)
-        return cls.query.filter(cls.recom_type == recom_type , cls.product_a == product_a)
+        return cls.filter_products(cls.query.filter(cls.recom_type == recom_type), cls.product_a_id, product_a)
 
     @classmethod
     def find_by_recommendation_type_and_product_b(cls, recom_type, product_b):
@@ -161,4 +922,178 @@ class Recommendation(db.Model):
             product_b (string): the Product_B of the Recommendations you want to match
         """
         logger.info("Processing Recommendations Type query for %s ...", recom_type)
-        return cls.query.filter(cls.recom_type == recom_type , cls.product_b == product_b)
+        return cls.filter_products(cls.query.filter(cls.recom_type == recom_type), cls.product_b_id, product_b)
+
+
+class Product(db.Model):
+    """
+    Class that represents a product a Recommendation refers to
+
+    Recommendations hold the integer ids of their products, which keeps their
+    rows and indexes small and turns every product filter into an integer
+    comparison. The names are interned by every worker in Product.interned.
+    """
+
+    __tablename__ = "product"
+    __table_args__ = (
+        # never hand out the id of a product again, the workers remember them
+        {"sqlite_autoincrement": True},
+    )
+
+    interned = ProductNames()
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(128), nullable=False, unique=True)
+
+    def __repr__(self):
+        return "<Product %r id=[%s]>" % (self.name, self.id)
+
+    @classmethod
+    def ids_for(cls, names, create=False):
+        """ Returns {name: id} of the products with the given names
+
+        Args:
+            names (iterable): the product names to look up
+            create (bool): add the products that do not exist yet, in a
+                transaction of their own so that only committed ids are interned
+        Returns:
+            dict: the ids by name, without the unknown names unless created
+        """
+        names = set(names)
+        ids = cls.interned.ids(names)
+        missing = list(names.difference(ids))
+        if not missing:
+            return ids
+        table = cls.__table__
+        if create:
+            with db.engine.begin() as conn:
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    values = ", ".join("(:n{})".format(number) for number in range(len(chunk)))
+                    conn.execute("INSERT INTO product (name) VALUES " + values + " ON CONFLICT (name) DO NOTHING",
+                                 {"n%d" % number: name for number, name in enumerate(chunk)})
+                found = cls._select(conn.execute, table.c.name, missing)
+        else:
+            found = cls._select(db.session.execute, table.c.name, missing)
+        cls.interned.add(found)
+        ids.update(found)
+        return ids
+
+    @classmethod
+    def names_for(cls, ids):
+        """ Returns {id: name} of the products with the given ids """
+        ids = set(ids)
+        names = cls.interned.names(ids)
+        missing = list(ids.difference(names))
+        if missing:
+            found = cls._select(db.session.execute, cls.__table__.c.id, missing)
+            cls.interned.add(found)
+            names.update((by_id, name) for name, by_id in found)
+        return names
+
+    @classmethod
+    def _select(cls, execute, column, values):
+        """ Returns the (name, id) pairs of the products whose column holds one of the values """
+        table = cls.__table__
+        pairs = []
+        for start in range(0, len(values), 500):
+            pairs.extend(tuple(row) for row in execute(
+                db.select([table.c.name, table.c.id]).where(column.in_(values[start:start + 500]))
+            ))
+        return pairs
+
+
+@event.listens_for(Product.__table__, "after_create")
+@event.listens_for(Product.__table__, "after_drop")
+def forget_product_names(table, connection, **kwargs):  # pylint: disable=unused-argument
+    """ Forgets the interned names when the ids they map to are gone """
+    Product.interned.clear()
+
+
+class RecommendationLikeShard(db.Model):
+    """
+    Class that represents one slice of the like counter of a Recommendation
+
+    Spreading the likes of a popular Recommendation over several rows keeps
+    concurrent likes from queueing up on a single row lock.
+    """
+
+    __tablename__ = "recommendation_like_shard"
+
+    recommendation_id = db.Column(db.Integer, db.ForeignKey("recommendation.id", ondelete="CASCADE"),
+                                  primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    likes = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<RecommendationLikeShard id=[%s] shard=[%s]>" % (self.recommendation_id, self.shard)
+
+    @classmethod
+    def add(cls, recommendation_id, shard, count):
+        """ Adds likes to one shard, returning False when there is no such Recommendation """
+        table = cls.__table__
+        increment = (
+            table.update()
+            .where(db.and_(table.c.recommendation_id == recommendation_id, table.c.shard == shard))
+            .values(likes=table.c.likes + count)
+        )
+        if db.session.execute(increment).rowcount:
+            return True
+        if Recommendation.query.filter(Recommendation.id == recommendation_id).count() == 0:
+            return False
+        try:
+            db.session.execute(table.insert(), {"recommendation_id": recommendation_id,
+                                                "shard": shard, "likes": count})
+        except IntegrityError:
+            # another worker created the shard first, so add to theirs
+            db.session.rollback()
+            db.session.execute(increment)
+        return True
+
+    @classmethod
+    def total(cls, recommendation_id):
+        """ Returns the likes of a Recommendation that are still in its shards """
+        return db.session.query(db.func.coalesce(db.func.sum(cls.likes), 0)).filter(
+            cls.recommendation_id == recommendation_id
+        ).scalar()
+
+
+
+class RecommendationChange(db.Model):
+    """
+    Class that represents one slice of the counter of writes to the Recommendations
+
+    Every transaction that changes what a list of Recommendations returns
+    adds one to a random slice, so the sum only grows and a list ETag can
+    be checked without reading a single Recommendation. Slicing keeps
+    concurrent writers from queueing up on a single row lock.
+    """
+
+    __tablename__ = "recommendation_change"
+
+    SHARDS = 16
+
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    changes = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<RecommendationChange shard=[%s] changes=[%s]>" % (self.shard, self.changes)
+
+    @classmethod
+    def record(cls, conn=None):
+        """ Counts a write in the current transaction, of the session unless a connection is given """
+        table = cls.__table__
+        (conn if conn is not None else db.session).execute(
+            table.update().where(table.c.shard == random.randrange(cls.SHARDS)).values(changes=table.c.changes + 1)
+        )
+
+    @classmethod
+    def total(cls):
+        """ Returns the number of writes made to the Recommendations """
+        return db.session.query(db.func.coalesce(db.func.sum(cls.changes), 0)).scalar()
+
+
+@event.listens_for(RecommendationChange.__table__, "after_create")
+def add_change_shards(table, connection, **kwargs):  # pylint: disable=unused-argument
+    """ Creates the slices of the change counter along with their table """
+    connection.execute(table.insert(), [{"shard": shard, "changes": 0} for shard in range(RecommendationChange.SHARDS)])
@@ -0,0 +1,92 @@
+"""
+Connection Pool for the SQLAlchemy engine
+
+The DB_POOL_* settings size the pool of every worker. Connections are
+pinged before use so that the pool drops the dead connections left by a
+database failover. A connection is never handed to a process other than
+the one that opened it: a worker forked by gunicorn discards the sockets it
+inherited and opens its own. The pool also times how long checkouts wait
+so saturation shows up in GET /stats before it shows up as latency.
+"""
+import os
+import time
+import threading
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    """ A QueuePool that records how long checkouts wait for a connection """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self._wait_lock:
+                self.wait_count += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+@event.listens_for(TimedQueuePool, "connect")
+def remember_pid(dbapi_connection, connection_record):
+    """ Records the process that opened a connection """
+    connection_record.info["pid"] = os.getpid()
+
+
+@event.listens_for(TimedQueuePool, "checkout")
+def check_pid(dbapi_connection, connection_record, connection_proxy):
+    """ Replaces a connection that was inherited from the parent process """
+    pid = os.getpid()
+    if connection_record.info["pid"] != pid:
+        # drop the socket without closing it, it still belongs to the parent
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            "Connection record belongs to pid {}, attempting to check out in pid {}".format(
+                connection_record.info["pid"], pid
+            )
+        )
+
+
+def engine_options(config):
+    """ Returns the create_engine() pool options for the configured database """
+    if config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        return {}  # SQLite picks its own pool and takes none of these
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
+
+
+def pool_stats(engine):
+    """ Returns the checkout, overflow and wait counters of the engine's pool """
+    pool = engine.pool
+    stats = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    if isinstance(pool, TimedQueuePool):
+        with pool._wait_lock:  # pylint: disable=protected-access
+            stats.update(
+                checkouts=pool.wait_count,
+                wait_ms_total=round(pool.wait_seconds * 1000, 3),
+                wait_ms_max=round(pool.max_wait_seconds * 1000, 3),
+            )
+    return stats
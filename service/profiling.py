@@ -0,0 +1,149 @@
+"""
+Slow request and slow query log, and on-demand profiling
+
+Every request that takes SLOW_REQUEST_MS or longer and every SQL statement
+that takes SLOW_QUERY_MS or longer is logged as a warning, with the SQL
+count and time of the request kept by service/timing.py, so the slow
+ones can be found in the logs.
+
+A request sent with an X-Profile header holding PROFILE_TOKEN is run under
+cProfile and has every SQL statement recorded with its parameters, time
+and EXPLAIN plan. The report is saved in PROFILE_DIR under the id the
+response returns in X-Profile-Id, and GET /profiles/<id> (with the same
+header) returns it. Profiling is off while PROFILE_TOKEN is empty.
+"""
+import os
+import hmac
+import json
+import time
+import uuid
+import pstats
+import logging
+import cProfile
+from io import StringIO
+from flask import g, request, has_request_context
+from service import timing
+from service.models import db
+
+logger = logging.getLogger("flask.app")
+
+PROFILE_HEADER = "X-Profile"
+
+
+class RequestProfile:
+    """ The cProfile run and the SQL statements of one profiled request """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.profiler = cProfile.Profile()
+        self.statements = []
+
+    def add_statement(self, statement, parameters, seconds, executemany):
+        """ Records one SQL statement run by the request """
+        self.statements.append((statement, parameters, seconds, executemany))
+
+    def report(self, status, seconds):
+        """ Returns the report of the request, explaining each SELECT it ran """
+        stream = StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats("cumulative").print_stats(40)
+        return {
+            "id": self.id,
+            "method": request.method,
+            "path": request.full_path,
+            "status": status,
+            "duration_ms": round(seconds * 1000, 3),
+            "sql_ms": round(sum(entry[2] for entry in self.statements) * 1000, 3),
+            "sql": [
+                {
+                    "statement": statement,
+                    "parameters": repr(parameters),
+                    "duration_ms": round(statement_seconds * 1000, 3),
+                    "plan": None if executemany else explain(db.engine, statement, parameters),
+                }
+                for statement, parameters, statement_seconds, executemany in self.statements
+            ],
+            "profile": stream.getvalue(),
+        }
+
+
+def init_app(app):
+    """ Installs the slow request and query log and the profiling hook """
+    if app.extensions.get("profiling"):
+        return
+    app.extensions["profiling"] = True
+    timing.init_app(app)
+
+    @app.before_request
+    def start_profile():
+        if authorized(app):
+            g.request_profile = RequestProfile()
+            g.request_profile.profiler.enable()
+
+    @app.after_request
+    def add_profile_id(response):
+        if "request_profile" in g:
+            response.headers["X-Profile-Id"] = g.request_profile.id
+        return response
+
+    def finish_request(request_timing):
+        start, queries, query_seconds, status = request_timing
+        seconds = time.perf_counter() - start
+        profile = g.pop("request_profile", None)
+        if profile:
+            profile.profiler.disable()
+            save_report(app, profile.report(status, seconds))
+        if seconds * 1000 >= app.config["SLOW_REQUEST_MS"]:
+            logger.warning("Slow request: %s %s %s in %.1f ms, %s SQL statements in %.1f ms",
+                           request.method, request.full_path, status, seconds * 1000, queries, query_seconds * 1000)
+
+    def finish_query(statement, parameters, seconds, executemany):
+        if seconds * 1000 >= app.config["SLOW_QUERY_MS"]:
+            logger.warning("Slow query in %.1f ms (%s): %s", seconds * 1000,
+                           request.endpoint if has_request_context() else "no request", " ".join(statement.split()))
+        profile = g.get("request_profile") if has_request_context() else None
+        if profile is not None:
+            profile.add_statement(statement, parameters, seconds, executemany)
+
+    timing.on_query(finish_query)
+    timing.on_request_end(finish_request)
+
+
+def explain(engine, statement, parameters):
+    """ Returns the query plan of a SELECT without running it, or None for other statements """
+    if not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(prefix + statement, parameters)
+        return [" | ".join(str(value) for value in row) for row in cursor.fetchall()]
+    except Exception as error:  # pylint: disable=broad-except
+        return ["EXPLAIN failed: {}".format(error)]
+    finally:
+        connection.close()
+
+
+def save_report(app, report):
+    """ Writes a profile report into PROFILE_DIR """
+    os.makedirs(app.config["PROFILE_DIR"], exist_ok=True)
+    path = os.path.join(app.config["PROFILE_DIR"], report["id"] + ".json")
+    with open(path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    logger.info("Saved the profile of %s %s to %s", report["method"], report["path"], path)
+
+
+def load_report(app, profile_id):
+    """ Returns a saved profile report, or None when there is none with that id """
+    path = os.path.join(app.config["PROFILE_DIR"], profile_id + ".json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as report_file:
+        return json.load(report_file)
+
+
+def authorized(app):
+    """ Returns whether the request carries the profiling token """
+    token = app.config["PROFILE_TOKEN"]
+    header = request.headers.get(PROFILE_HEADER)
+    return bool(token and header and hmac.compare_digest(header, token))
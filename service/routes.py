@@ -5,20 +5,37 @@ Describe what your service does here
 """
 
 import os
+import re
 import sys
+import json
+import base64
 import logging
-from flask import Flask, jsonify, request, url_for, make_response, abort
+from urllib.parse import urlencode
+import click
+from flask import Flask, Response, jsonify, request, url_for, make_response, abort, stream_with_context
 from flask_api import status  # HTTP Status Codes
 from werkzeug.exceptions import NotFound
 
 # For this example we'll use SQLAlchemy, a popular ORM that supports a
 # variety of backends including SQLite, MySQL, and PostgreSQL
 from flask_sqlalchemy import SQLAlchemy
-from service.models import Recommendation, DataValidationError
+from service.models import (
+    db, Recommendation, RecommendationLikeShard, RecommendationChange, DataValidationError, DataConflictError
+)
+from service.likes_buffer import LikeBuffer, LikeFolder
+from service.encodings import JSON, NDJSON, ETAG_SUFFIXES, media_types, dumps, encode_rows, encode_lines
+from service.compression import compress_response, encoded_etags
+from service.pool import pool_stats
+from service import metrics, profiling
 
 # Import Flask application
 from . import app
 
+likes_buffer = LikeBuffer(app)
+like_folder = LikeFolder(app)
+metrics.init_app(app)
+profiling.init_app(app)
+
 ######################################################################
 # Error Handlers
 ######################################################################
@@ -28,6 +45,12 @@ def request_validation_error(error):
     return bad_request(error)
 
 
+@app.errorhandler(DataConflictError)
+def request_conflict_error(error):
+    """ Handles writes that would duplicate a Recommendation """
+    return conflict(error)
+
+
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """ Handles bad reuests with 400_BAD_REQUEST """
@@ -67,6 +90,17 @@ def method_not_supported(error):
     )
 
 
+@app.errorhandler(status.HTTP_409_CONFLICT)
+def conflict(error):
+    """ Handles requests that conflict with existing data with 409_CONFLICT """
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(status=status.HTTP_409_CONFLICT, error="Conflict", message=message),
+        status.HTTP_409_CONFLICT,
+    )
+
+
 @app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 def mediatype_not_supported(error):
     """ Handles unsuppoted media requests with 415_UNSUPPORTED_MEDIA_TYPE """
@@ -97,6 +131,14 @@ def internal_server_error(error):
     )
 
 
+######################################################################
+# Response Compression
+######################################################################
+@app.after_request
+def compress(response):
+    """ Compresses large responses in a coding the client accepts """
+    return compress_response(response, app.config)
+
 ######################################################################
 # GET INDEX
 ######################################################################
@@ -125,35 +167,223 @@ def create_recommendation():
         jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
     )
 
+######################################################################
+# CREATE MANY NEW RECOMMENDATIONS
+######################################################################
+@app.route("/recommendations/bulk", methods=["POST"])
+def create_recommendations():
+    """
+    Creates many Recommendations
+    This endpoint takes a JSON array, or NDJSON with one Recommendation per
+    line, creates every valid one in chunks and returns one result per item
+    """
+    app.logger.info("Request to create recommendations in bulk")
+    check_content_type("application/json", NDJSON)
+    results = []
+    recommendations = []
+    for item in get_bulk_items():
+        try:
+            recommendation = Recommendation().deserialize(item)
+        except DataValidationError as error:
+            results.append({"status": status.HTTP_400_BAD_REQUEST, "message": str(error)})
+            continue
+        recommendations.append(recommendation)
+        results.append(recommendation)
+    # report the items that repeat a Recommendation instead of failing their chunk
+    Recommendation.create_many(recommendations, app.config["BULK_CHUNK_SIZE"], skip_existing=True)
+    for number, result in enumerate(results):
+        if isinstance(result, Recommendation) and result.id is None:
+            results[number] = {"status": status.HTTP_409_CONFLICT,
+                               "message": "Recommendation {} already exists".format(pair_of(result))}
+    recommendations = [result for result in results if isinstance(result, Recommendation)]
+    results = [
+        {"status": status.HTTP_201_CREATED, "recommendation": result.serialize()}
+        if isinstance(result, Recommendation) else result
+        for result in results
+    ]
+    app.logger.info("Created %s of %s recommendations", len(recommendations), len(results))
+    if len(recommendations) == len(results):
+        return make_response(jsonify(results), status.HTTP_201_CREATED)
+    return make_response(jsonify(results), status.HTTP_207_MULTI_STATUS)
+
+######################################################################
+# CREATE OR MERGE RECOMMENDATIONS
+######################################################################
+@app.route("/recommendations/upsert", methods=["POST"])
+def upsert_recommendations():
+    """
+    Creates Recommendations or adds their likes to the existing ones
+    This endpoint takes one Recommendation, and answers 201 when it was
+    created or 200 when its likes were added to the Recommendation of the
+    same products and type. A JSON array or NDJSON body is merged in
+    chunks and answered with one result per item.
+    """
+    app.logger.info("Request to upsert recommendations")
+    check_content_type("application/json", NDJSON)
+    if request.headers["Content-Type"] == "application/json" and isinstance(request.get_json(), dict):
+        recommendation = Recommendation().deserialize(request.get_json())
+        message, created = Recommendation.upsert([recommendation])[0]
+        if not created:
+            return make_response(jsonify(message), status.HTTP_200_OK)
+        location_url = url_for("get_recommendations", recommendation_id=message["id"], _external=True)
+        return make_response(jsonify(message), status.HTTP_201_CREATED, {"Location": location_url})
+
+    results = []
+    recommendations = []
+    for item in get_bulk_items():
+        try:
+            recommendations.append(Recommendation().deserialize(item))
+            results.append(None)
+        except DataValidationError as error:
+            results.append({"status": status.HTTP_400_BAD_REQUEST, "message": str(error)})
+    upserted = iter(Recommendation.upsert(recommendations, app.config["BULK_CHUNK_SIZE"]))
+    for number, result in enumerate(results):
+        if result is None:
+            message, created = next(upserted)
+            results[number] = {"status": status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+                               "recommendation": message}
+    app.logger.info("Upserted %s of %s recommendations", len(recommendations), len(results))
+    if len(recommendations) == len(results):
+        return make_response(jsonify(results), status.HTTP_200_OK)
+    return make_response(jsonify(results), status.HTTP_207_MULTI_STATUS)
+
 ######################################################################
 # LIST ALL RECOMMENDATIONS
 ######################################################################
 @app.route("/recommendations", methods=["GET"])
 def list_recommendations():
-    """ Returns all of the Recommendations """
+    """
+    Returns all of the Recommendations
+
+    The filters product_a, product_b, recom_type and id match any of the
+    values they are repeated with, recom_type and id also take a comma
+    separated list. min_likes leaves out the less liked ones, and every
+    filter given has to match.
+    sort is one of id, -id, likes and -likes.
+    Pass limit (and the cursor from the rel="next" Link header) to read the
+    list one page at a time. With count=true the X-Total-Count header holds
+    the number of matches on all the pages, counted in the same query.
+    Clients that Accept application/x-ndjson get every match streamed
+    as one Recommendation per line instead, and the other encodings of
+    service/encodings.py can be asked for the same way.
+    The ETag changes with every write to the Recommendations, so a client
+    that sends it back in If-None-Match gets a 304 without a row being read.
+    """
     app.logger.info("Request for Recommendation list")
-    recommendations=[]
-
-    recom_type = request.args.get('recom_type')
-    product_a = request.args.get('product_a')
-    product_b = request.args.get('product_b')
-
-    if recom_type:
-        app.logger.info('Find by category: %s', recom_type)
-        recommendations = Recommendation.find_by_recommendation_type(recom_type)
-    elif product_a:
-        app.logger.info('Find by category: %s', product_a)
-        recommendations = Recommendation.find_by_product_a(product_a)
-    elif product_b:
-        app.logger.info('Find by category: %s', product_b)
-        recommendations = Recommendation.find_by_product_b(product_b)
-    else:
-        app.logger.info('Find all')
-        recommendations = Recommendation.all()
-    results = [recommendations.serialize() for recommendations in recommendations]
-    return make_response(jsonify(results), status.HTTP_200_OK)
-
-    
+    recommendations = find_recommendations()
+    sort = request.args.get("sort")
+    count = request.args.get("count") == "true"
+    media_type = request.accept_mimetypes.best_match(media_types() + [NDJSON]) or JSON
+    changes = RecommendationChange.total()
+    etag = "c{}{}".format(changes, ETAG_SUFFIXES[media_type])
+    response = not_modified(etag)
+    if response:
+        return response
+    limit = 0 if media_type == NDJSON else get_page_size()
+    if not limit:
+        if sort:
+            recommendations = Recommendation.sort_by(recommendations, sort)
+        if media_type == NDJSON:
+            response = stream_recommendations(recommendations)
+            response.set_etag(etag)
+            return response
+        key = urlencode(sorted(request.args.items(multi=True)))
+        rows = Recommendation.find_rows(recommendations, key, changes, count)
+        return rows_response(rows, media_type, etag, count)
+
+    sort = sort or "id"
+    after = decode_cursor(request.args.get("cursor"), sort)
+    rows, next_after = Recommendation.find_page(recommendations, limit, after, sort, count)
+    response = rows_response(rows, media_type, etag, count)
+    if count and not rows and after is not None:
+        # a cursor past the last page leaves no row to carry the count
+        response.headers["X-Total-Count"] = recommendations.count()
+    if next_after is not None:
+        args = request.args.to_dict()
+        args.update(limit=limit, cursor=encode_cursor(next_after, sort))
+        next_url = url_for("list_recommendations", _external=True, **args)
+        response.headers["Link"] = '<{}>; rel="next"'.format(next_url)
+    return response
+
+def stream_recommendations(recommendations):
+    """ Streams the Recommendations of a query as newline delimited JSON """
+    app.logger.info("Streaming Recommendation list")
+    batch_size = app.config["STREAM_BATCH_SIZE"]
+
+    def generate():
+        for rows in Recommendation.stream(recommendations, batch_size):
+            yield encode_lines(rows, Recommendation.FIELDS)
+
+    return Response(stream_with_context(generate()), status.HTTP_200_OK, mimetype=NDJSON)
+
+######################################################################
+# TOP RECOMMENDATIONS FOR A PRODUCT
+######################################################################
+@app.route("/products/<product_a>/recommendations", methods=["GET"])
+def list_top_recommendations(product_a):
+    """
+    Returns the most liked Recommendations for a product
+    This endpoint returns up to limit Recommendations with the given product_a,
+    optionally of one recom_type (or type), ordered by likes
+    """
+    app.logger.info("Request for top recommendations of %s", product_a)
+    recom_type = request.args.get("recom_type", request.args.get("type"))
+    limit = min(get_positive_int("limit", app.config["TOP_RECOMMENDATIONS"]), app.config["MAX_PAGE_SIZE"])
+    media_type = request.accept_mimetypes.best_match(media_types()) or JSON
+    changes = RecommendationChange.total()
+    etag = "c{}{}".format(changes, ETAG_SUFFIXES[media_type])
+    response = not_modified(etag)
+    if response:
+        return response
+    recommendations = Recommendation.find_top_for_product(product_a, limit, recom_type)
+    key = urlencode([("top", product_a), ("recom_type", recom_type or ""), ("limit", limit)])
+    rows = Recommendation.find_rows(recommendations, key, changes)
+    return rows_response(rows, media_type, etag)
+
+######################################################################
+# RECOMMENDATION GRAPH OF A PRODUCT
+######################################################################
+@app.route("/products/<product_a>/graph", methods=["GET"])
+def get_recommendation_graph(product_a):
+    """
+    Returns the products a few Recommendations away from a product
+    This endpoint follows the fanout most liked Recommendations of every
+    product reached, starting from product_a, for up to depth hops, and only
+    Recommendations of the recom_type (or type) list when one is given.
+    It returns every product reached once, scored by the combined likes
+    of the Recommendations that lead to it, and those Recommendations.
+    """
+    app.logger.info("Request for the recommendation graph of %s", product_a)
+    depth = min(get_positive_int("depth", app.config["GRAPH_DEPTH"]), app.config["GRAPH_MAX_DEPTH"])
+    fanout = min(get_positive_int("fanout", app.config["TOP_RECOMMENDATIONS"]), app.config["MAX_PAGE_SIZE"])
+    recom_type = [value for arg in request.args.getlist("recom_type") + request.args.getlist("type")
+                  for value in arg.split(",") if value]
+    changes = RecommendationChange.total()
+    etag = "c{}".format(changes)
+    response = not_modified(etag)
+    if response:
+        return response
+
+    def load():
+        edges, products = Recommendation.find_graph(
+            product_a, depth, fanout, sorted(set(recom_type)), app.config["GRAPH_MAX_PRODUCTS"]
+        )
+        return {
+            "product": product_a,
+            "depth": depth,
+            "fanout": fanout,
+            "products": [{"product": name, "depth": hops, "score": score} for name, hops, score in products],
+            "recommendations": [dict(zip(Recommendation.FIELDS, row)) for row in edges],
+        }
+
+    key = urlencode([("graph", product_a), ("depth", depth), ("fanout", fanout),
+                     ("recom_type", ",".join(sorted(set(recom_type))))])
+    graph = Recommendation.cache.fetch_list(key, load, changes, rows=lambda graph: len(graph["recommendations"]))
+    response = make_response(dumps(graph), status.HTTP_200_OK)
+    response.content_type = JSON
+    response.set_etag(etag)
+    return response
+
 ######################################################################
 # UPDATE AN EXISTING RECOMMENDATION
 ######################################################################
@@ -188,6 +418,38 @@ def delete_recommendations(recommendation_id):
         recommendation.delete()
     return make_response("", status.HTTP_204_NO_CONTENT)
 
+######################################################################
+# DELETE MANY RECOMMENDATIONS
+######################################################################
+@app.route("/recommendations", methods=["DELETE"])
+def delete_many_recommendations():
+    """
+    Delete the Recommendations matching the filters
+    This endpoint deletes, in chunks, the Recommendations that match every one
+    of the filters GET /recommendations takes.
+    Deleting everything has to be asked for with all=true.
+    """
+    app.logger.info("Request to delete recommendations matching %s", request.args.to_dict())
+    filters = get_filters()
+    if not filters and request.args.get("all") != "true":
+        raise DataValidationError("Give a filter, or all=true to delete every recommendation")
+    recommendations = Recommendation.find_by_filters(**filters)
+    deleted = Recommendation.delete_many(recommendations, app.config["DELETE_CHUNK_SIZE"])
+    return make_response(jsonify(deleted=deleted), status.HTTP_200_OK)
+
+######################################################################
+# TRUNCATE ALL RECOMMENDATIONS
+######################################################################
+@app.route("/recommendations/truncate", methods=["DELETE"])
+def truncate_recommendations():
+    """
+    Delete every Recommendation at once
+    This endpoint empties the table in one statement instead of in chunks
+    """
+    app.logger.info("Request to truncate recommendations")
+    Recommendation.truncate()
+    return make_response("", status.HTTP_204_NO_CONTENT)
+
 ######################################################################
 # RETRIEVE / FIND / GET A RECOMMENDATION
 ######################################################################
@@ -196,12 +458,28 @@ def get_recommendations(recommendation_id):
     """
     Retrieve a single Recommendation
     This endpoint will return a Recommendation based on it's id
+    The ETag is made of the row version and the likes not written to the
+    row yet. A request without If-None-Match is answered from the cache,
+    one with it checks the version first, so a 304 is never stale.
     """
     app.logger.info("Request for recommendation with id: %s", recommendation_id)
-    recommendation = Recommendation.find(recommendation_id)
-    if not recommendation:
+    unwritten = unwritten_likes(recommendation_id)
+    version = None
+    if request.if_none_match:
+        version = Recommendation.find_version(recommendation_id)
+        if version is None:
+            raise NotFound("Recommendation with id '{}' was not found.".format(recommendation_id))
+        response = not_modified("{}.{}.{}".format(recommendation_id, version, unwritten))
+        if response:
+            return response
+    message, version = Recommendation.find_serialized_version(recommendation_id, version)
+    if not message:
         raise NotFound("Recommendation with id '{}' was not found.".format(recommendation_id))
-    return make_response(jsonify(recommendation.serialize()), status.HTTP_200_OK)
+    message["likes"] += unwritten
+    response = make_response(dumps(message), status.HTTP_200_OK)
+    response.content_type = JSON
+    response.set_etag("{}.{}.{}".format(recommendation_id, version, unwritten))
+    return response
 
 
 
@@ -213,15 +491,69 @@ def get_recommendations(recommendation_id):
 def like_recommendation(recommendation_id):
     """Tracks how many times a particular recommendation ID is liked"""
     app.logger.info("A recommendation was liked with this id: %s", recommendation_id )
-    recommendation = Recommendation.find(recommendation_id)
-    if not recommendation:
+    if app.config["LIKES_WRITE_BEHIND"]:
+        message = Recommendation.find_serialized(recommendation_id)
+        if not message:
+            abort(status.HTTP_404_NOT_FOUND, "Recommendation with id '{}' was not found.".format(recommendation_id))
+        likes_buffer.add(recommendation_id)
+        message["likes"] += unwritten_likes(recommendation_id)
+        return make_response(jsonify(message), status.HTTP_200_OK)
+
+    if app.config["LIKE_SHARDS"]:
+        like_folder.start()
+    message = Recommendation.add_likes(recommendation_id, shards=app.config["LIKE_SHARDS"])
+    if not message:
         abort(status.HTTP_404_NOT_FOUND, "Recommendation with id '{}' was not found.".format(recommendation_id))
-    recommendation.likes += 1
-    recommendation.save()
-    return make_response(jsonify(recommendation.serialize()), status.HTTP_200_OK)
+    if not app.config["LIKE_SHARDS"]:
+        like_folder.liked()
+    return make_response(jsonify(message), status.HTTP_200_OK)
+
+
+######################################################################
+# SERVICE STATISTICS
+######################################################################
+@app.route("/stats", methods=["GET"])
+def get_stats():
+    """ Returns the counters of the in-process buffers """
+    app.logger.info("Request for service statistics")
+    stats = {
+        "likes_buffer": likes_buffer.stats(),
+        "like_folder": like_folder.stats(),
+        "cache": Recommendation.cache.stats(),
+        "pool": pool_stats(db.engine),
+    }
+    return make_response(jsonify(stats), status.HTTP_200_OK)
 
 
 
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """ Returns the request and SQL metrics of every worker in the Prometheus text format """
+    body, content_type = metrics.exposition()
+    return Response(body, status.HTTP_200_OK, content_type=content_type)
+
+
+######################################################################
+# REQUEST PROFILES
+######################################################################
+@app.route("/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    """
+    Returns the report of a profiled request
+    This endpoint needs the same X-Profile header the profiled request had
+    """
+    app.logger.info("Request for profile %s", profile_id)
+    report = None
+    if profiling.authorized(app) and re.fullmatch("[0-9a-f]{32}", profile_id):
+        report = profiling.load_report(app, profile_id)
+    if report is None:
+        raise NotFound("Profile '{}' was not found.".format(profile_id))
+    return make_response(jsonify(report), status.HTTP_200_OK)
+
+
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
@@ -231,9 +563,155 @@ def init_db():
     global app
     Recommendation.init_db(app)
 
-def check_content_type(content_type):
+def unwritten_likes(recommendation_id):
+    """ Returns the likes of a Recommendation that its row does not hold yet """
+    likes = likes_buffer.pending(recommendation_id)
+    if app.config["LIKE_SHARDS"]:
+        likes += RecommendationLikeShard.total(recommendation_id)
+    return likes
+
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """ Creates the tables and applies the pending schema migrations """
+    Recommendation.create_schema()
+    click.echo("Database schema is up to date")
+
+@app.cli.command("deduplicate")
+@click.option("--chunk-size", default=100, help="product_a values merged per transaction")
+def deduplicate(chunk_size):
+    """ Merges the recommendations that share their products and type """
+    click.echo("Removed {} duplicate recommendations".format(Recommendation.deduplicate(chunk_size)))
+
+@app.cli.command("fold-likes")
+@click.option("--chunk-size", default=1000, help="like shards folded per transaction")
+def fold_likes(chunk_size):
+    """ Moves the likes counted in the like shards into the recommendations """
+    click.echo("Folded {} likes".format(Recommendation.fold_likes(chunk_size)))
+
+def not_modified(etag):
+    """ Returns a 304 response when the request's If-None-Match holds the etag, else None
+
+    The ETags of the compressed forms of the response match as well.
+    """
+    for candidate in encoded_etags(etag):
+        if request.if_none_match.contains_weak(candidate):
+            response = make_response("", status.HTTP_304_NOT_MODIFIED)
+            response.set_etag(candidate)
+            return response
+    return None
+
+def rows_response(rows, media_type, etag, count=False):
+    """ Returns a 200 response with rows of Recommendation.FIELDS in the given media type
+
+    With count the rows end in the number of matches, which goes into X-Total-Count.
+    """
+    response = make_response(encode_rows(rows, Recommendation.FIELDS, media_type), status.HTTP_200_OK)
+    response.content_type = media_type
+    response.vary.add("Accept")
+    response.set_etag(etag)
+    if count:
+        response.headers["X-Total-Count"] = rows[0][-1] if rows else 0
+    return response
+
+def find_recommendations():
+    """ Returns the query of Recommendations matching the request filters """
+    filters = get_filters()
+    app.logger.info("Find by %s", filters or "nothing")
+    return Recommendation.find_by_filters(**filters)
+
+def get_filters():
+    """ Returns the find_by_filters() arguments given in the query string """
+    filters = {}
+    for name in ("product_a", "product_b", "recom_type", "id"):
+        values = [value for value in request.args.getlist(name) if value]
+        if name in ("recom_type", "id"):
+            # product names may hold commas, only types and ids cannot
+            values = [value for arg in values for value in arg.split(",") if value]
+        if not values:
+            continue
+        if name == "id":
+            try:
+                filters["ids"] = [int(value) for value in values]
+            except ValueError:
+                raise DataValidationError("Invalid id list: {}".format(",".join(values)))
+        else:
+            filters[name] = values[0] if len(values) == 1 else values
+    min_likes = request.args.get("min_likes")
+    if min_likes is not None:
+        try:
+            filters["min_likes"] = int(min_likes)
+        except ValueError:
+            raise DataValidationError("Invalid min_likes: {}".format(min_likes))
+    return filters
+
+def get_positive_int(name, default):
+    """ Returns the positive integer query string argument of the given name """
+    value = request.args.get(name, default)
+    try:
+        value = int(value)
+    except ValueError:
+        raise DataValidationError("Invalid {}: {}".format(name, value))
+    if value < 1:
+        raise DataValidationError("Invalid {}: {}".format(name, value))
+    return value
+
+def get_page_size():
+    """ Returns the requested page size, or 0 when the whole list is wanted """
+    limit = request.args.get("limit", app.config["DEFAULT_PAGE_SIZE"])
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise DataValidationError("Invalid limit: {}".format(limit))
+    if limit < 0:
+        raise DataValidationError("Invalid limit: {}".format(limit))
+    if not limit and "cursor" not in request.args:
+        return 0
+    return min(limit or app.config["MAX_PAGE_SIZE"], app.config["MAX_PAGE_SIZE"])
+
+def encode_cursor(after, sort):
+    """ Encodes the sort key of the last Recommendation on a page as an opaque cursor """
+    data = json.dumps({"sort": sort, "after": list(after)}).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor, sort):
+    """ Decodes a cursor made by encode_cursor for the given sort order """
+    if sort not in Recommendation.SORT_KEYS:
+        raise DataValidationError("Invalid sort: {}".format(sort))
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        after = tuple(int(value) for value in data["after"])
+    except (ValueError, TypeError, KeyError):
+        raise DataValidationError("Invalid cursor: {}".format(cursor))
+    if data.get("sort") != sort or len(after) != len(Recommendation.SORT_KEYS[sort][0]):
+        raise DataValidationError("Cursor does not match sort: {}".format(sort))
+    return after
+
+def pair_of(recommendation):
+    """ Returns the (product_a, product_b, recom_type) key of a Recommendation """
+    return (recommendation.product_a, recommendation.product_b, recommendation.recom_type)
+
+def get_bulk_items():
+    """ Returns the items of a JSON array or NDJSON request body """
+    if request.headers["Content-Type"] == NDJSON:
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(line)  # reported as bad data by deserialize
+        return items
+    items = request.get_json()
+    if not isinstance(items, list):
+        raise DataValidationError("Invalid bulk request: body must be a JSON array")
+    return items
+
+def check_content_type(*content_types):
     """ Checks that the media type is correct """
-    if request.headers["Content-Type"] == content_type:
+    if request.headers["Content-Type"] in content_types:
         return
     app.logger.error("Invalid Content-Type: %s", request.headers["Content-Type"])
-    abort(415, "Content-Type must be {}".format(content_type))
\ No newline at end of file
+    abort(415, "Content-Type must be {}".format(" or ".join(content_types)))
\ No newline at end of file
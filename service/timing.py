@@ -0,0 +1,90 @@
+"""
+Request and SQL timing
+
+One set of request hooks and one pair of SQLAlchemy cursor listeners time
+every request and every SQL statement. The tally of a request is kept in
+g.request_timing as [start, queries, query seconds, status].
+
+The metrics, the slow request and query log, the profiler and the access
+log all read it through listeners, so each statement is timed once:
+- on_request_start(function) calls function() as a request starts
+- on_query(function) calls function(statement, parameters, seconds,
+  executemany) after every statement, inside a request or not
+- on_request_end(function) calls function(timing) once the request and
+  a streamed body are done, in the order the listeners were added
+"""
+import time
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_start_listeners = []
+_query_listeners = []
+_end_listeners = []
+
+
+def init_app(app):
+    """ Times the requests of the app and the SQL of every engine """
+    if app.extensions.get("timing"):
+        return
+    app.extensions["timing"] = True
+    app.before_request(start_request)
+    app.after_request(record_status)
+    app.teardown_request(finish_request)
+    event.listen(Engine, "before_cursor_execute", start_query)
+    event.listen(Engine, "after_cursor_execute", finish_query)
+
+
+def on_request_start(function):
+    """ Calls function() as every request starts """
+    _start_listeners.append(function)
+
+
+def on_query(function):
+    """ Calls function(statement, parameters, seconds, executemany) after every SQL statement """
+    _query_listeners.append(function)
+
+
+def on_request_end(function):
+    """ Calls function(timing) once every request is done """
+    _end_listeners.append(function)
+
+
+def start_request():
+    """ Starts the clock and the SQL tally of a request """
+    g.request_timing = [time.perf_counter(), 0, 0.0, 500]  # start, queries, query seconds, status
+    for listener in _start_listeners:
+        listener()
+
+
+def record_status(response):
+    """ Remembers the status of the response, which teardown does not get """
+    if "request_timing" in g:
+        g.request_timing[3] = response.status_code
+    return response
+
+
+def finish_request(exception=None):  # pylint: disable=unused-argument
+    """ Hands the tally of a request that is done, including a streamed body, to the listeners """
+    timing = g.pop("request_timing", None)
+    if timing is None:
+        return
+    for listener in _end_listeners:
+        listener(timing)
+
+
+def start_query(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument
+    """ Starts the clock of a SQL statement """
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def finish_query(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument
+    """ Adds a SQL statement to the tally of the request that ran it and hands it to the listeners """
+    seconds = time.perf_counter() - conn.info["query_start"].pop()
+    if has_request_context():
+        timing = g.get("request_timing")
+        if timing is not None:
+            timing[1] += 1
+            timing[2] += seconds
+    for listener in _query_listeners:
+        listener(statement, parameters, seconds, executemany)
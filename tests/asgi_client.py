@@ -0,0 +1,66 @@
+"""
+Test client that sends its requests through an ASGI application
+"""
+import asyncio
+from http import HTTPStatus
+from flask.testing import EnvironBuilder
+from werkzeug.test import Client
+
+
+class ASGIBridge:
+    """ A WSGI app that runs every request through an ASGI application """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        body = environ["wsgi.input"].read()
+        headers = [(name[5:].replace("_", "-").lower().encode("latin-1"), value.encode("latin-1"))
+                   for name, value in environ.items()
+                   if name.startswith("HTTP_") and name not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH")]
+        for name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            if environ.get(name):
+                headers.append((name.replace("_", "-").lower().encode("latin-1"), environ[name].encode("latin-1")))
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": environ["REQUEST_METHOD"],
+            "scheme": environ["wsgi.url_scheme"],
+            "path": environ["PATH_INFO"].encode("latin-1").decode("utf-8"),
+            "query_string": environ["QUERY_STRING"].encode("latin-1"),
+            "root_path": environ.get("SCRIPT_NAME", ""),
+            "headers": headers,
+            "server": (environ["SERVER_NAME"], int(environ["SERVER_PORT"])),
+            "client": ("127.0.0.1", 50000),
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(self.application(scope, receive, send))
+        start = messages[0]
+        start_response(
+            "{} {}".format(start["status"], HTTPStatus(start["status"]).phrase),
+            [(name.decode("latin-1"), value.decode("latin-1")) for name, value in start["headers"]],
+        )
+        return [message["body"] for message in messages[1:] if message.get("body")]
+
+
+class ASGITestClient(Client):
+    """ A test client that builds its requests like Flask's and sends them through an ASGI application """
+
+    def __init__(self, application, flask_app):
+        super().__init__(ASGIBridge(application), flask_app.response_class)
+        self.flask_app = flask_app
+
+    def open(self, *args, as_tuple=False, buffered=False, follow_redirects=False, **kwargs):
+        builder = EnvironBuilder(self.flask_app, *args, **kwargs)
+        try:
+            return super().open(builder, as_tuple=as_tuple, buffered=buffered, follow_redirects=follow_redirects)
+        finally:
+            builder.close()
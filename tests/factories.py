@@ -5,6 +5,8 @@ import factory
 from factory.fuzzy import FuzzyChoice
 from service.models import Recommendation
 
+PRODUCTS_B = ["socks", "pants", "skirts", "dresses"]
+
 
 class RecommendationFactory(factory.Factory):
     """ Creates fake recommendations that you don't have to feed """
@@ -14,6 +16,7 @@ class RecommendationFactory(factory.Factory):
 
     id = factory.Sequence(lambda n: n)
     product_a = FuzzyChoice(choices=["gloves", "shoes", "hats", "belts"])
-    product_b = FuzzyChoice(choices=["socks", "pants", "skirts", "dresses"])
+    # numbered so that no two fakes are the same (product_a, product_b, recom_type)
+    product_b = factory.Sequence(lambda n: "{}-{}".format(PRODUCTS_B[n % len(PRODUCTS_B)], n))
     recom_type = FuzzyChoice(choices=["A", "U", "C"])
     likes = FuzzyChoice(choices=[0,5,10])
@@ -0,0 +1,92 @@
+"""
+Test cases for the ASGI entry point
+
+The API test cases of test_service.py run again here through
+service/asgi.py, so both serving modes keep the same contract.
+"""
+import json
+import asyncio
+from unittest import TestCase
+from a2wsgi import WSGIMiddleware
+from werkzeug.wrappers import Request
+from service import asgi
+from service.models import Recommendation
+from service.routes import app
+from tests import test_service
+from tests.asgi_client import ASGITestClient
+from tests.factories import RecommendationFactory
+
+
+######################################################################
+#  A P I   T E S T S   T H R O U G H   A S G I
+######################################################################
+class TestRecommendationServerASGI(test_service.TestRecommendationServer):
+    """ The Recommendation API tests served through service/asgi.py """
+
+    def client(self):
+        """ Returns a client that sends its requests through the ASGI application """
+        return ASGITestClient(asgi.application, app)
+
+    def test_create_recommendations_in_bulk_from_chunked_ndjson(self):
+        """ Create many Recommendations from NDJSON sent with chunked transfer encoding """
+        lines = [json.dumps(RecommendationFactory().serialize()) + "\n" for _ in range(3)]
+        scope = dict(_scope("/recommendations/bulk", [(b"content-type", b"application/x-ndjson"),
+                                                      (b"transfer-encoding", b"chunked")]), method="POST")
+        sent = _call(asgi.application, scope, [
+            {"type": "http.request", "body": line.encode("utf-8"), "more_body": True} for line in lines
+        ] + [{"type": "http.request", "body": b"", "more_body": False}])
+        self.assertEqual(sent[0]["status"], 201)
+        body = b"".join(message.get("body", b"") for message in sent[1:])
+        self.assertEqual([result["status"] for result in json.loads(body)], [201, 201, 201])
+        self.assertEqual(len(Recommendation.all()), 3)
+
+
+def _call(application, scope, messages):
+    """ Runs one ASGI call and returns the messages it sent """
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    return sent
+
+
+def _scope(path="/", headers=()):
+    """ Returns the scope of an HTTP GET request """
+    return {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "path": path,
+            "query_string": b"", "headers": list(headers), "server": ("testserver", 80),
+            "client": ("127.0.0.1", 1234)}
+
+
+######################################################################
+#  A S G I   E N T R Y   P O I N T   T E S T S
+######################################################################
+class TestASGIEntryPoint(TestCase):
+    """ Test Cases for the ASGI entry point """
+
+    def test_read_a_chunked_body(self):
+        """ Read a body that comes without a Content-Length """
+        def wsgi_app(environ, start_response):
+            body = Request(environ).get_data()
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [body]
+
+        application = WSGIMiddleware(asgi.terminated_input(wsgi_app), 1)
+        sent = _call(application, _scope(headers=[(b"transfer-encoding", b"chunked")]), [
+            {"type": "http.request", "body": b"he", "more_body": True},
+            {"type": "http.request", "body": b"llo", "more_body": False},
+        ])
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertEqual(b"".join(message.get("body", b"") for message in sent[1:]), b"hello")
+
+    def test_lifespan(self):
+        """ Start and stop without touching the database """
+        sent = _call(asgi.application, {"type": "lifespan"}, [
+            {"type": "lifespan.startup"}, {"type": "lifespan.shutdown"},
+        ])
+        self.assertEqual([message["type"] for message in sent],
+                         ["lifespan.startup.complete", "lifespan.shutdown.complete"])
@@ -0,0 +1,42 @@
+"""
+Test cases for the List Encodings
+
+"""
+import json
+import unittest
+from unittest.mock import patch
+import msgpack
+from service import encodings
+from service.encodings import JSON, COLUMNAR_JSON, MSGPACK, dumps, encode_rows, encode_lines
+
+FIELDS = ("id", "product_a", "product_b", "recom_type", "likes")
+ROWS = [(1, "shoes", "socks", "A", 3), (2, "hats", "gloves", "U", 0)]
+
+######################################################################
+#  E N C O D I N G S   T E S T   C A S E S
+######################################################################
+class TestEncodings(unittest.TestCase):
+    """ Test Cases for the List Encodings """
+
+    def test_dumps(self):
+        """ Write the same JSON with and without orjson """
+        value = [{"product_a": "shoes", "id": 1, "likes": None}]
+        expected = b'[{"id":1,"likes":null,"product_a":"shoes"}]'
+        self.assertEqual(dumps(value), expected)
+        with patch.object(encodings, "orjson", None):
+            self.assertEqual(dumps(value), expected)
+
+    def test_encode_rows(self):
+        """ Encode rows as objects, columns and MessagePack """
+        objects = [dict(zip(FIELDS, row)) for row in ROWS]
+        self.assertEqual(json.loads(encode_rows(ROWS, FIELDS, JSON)), objects)
+        self.assertEqual(msgpack.unpackb(encode_rows(ROWS, FIELDS, MSGPACK), raw=False), objects)
+        columns = json.loads(encode_rows(ROWS, FIELDS, COLUMNAR_JSON))
+        self.assertEqual(columns["id"], [1, 2])
+        self.assertEqual(columns["product_b"], ["socks", "gloves"])
+        self.assertEqual(json.loads(encode_rows([], FIELDS, COLUMNAR_JSON))["likes"], [])
+
+    def test_encode_lines(self):
+        """ Encode rows as one object per line """
+        lines = encode_lines(ROWS, FIELDS).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [dict(zip(FIELDS, row)) for row in ROWS])
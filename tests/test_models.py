@@ -5,8 +5,9 @@ Test cases for Recommendation Model
 import logging
 import unittest
 import os
+from unittest.mock import patch
 from .factories import RecommendationFactory
-from service.models import Recommendation, DataValidationError, db
+from service.models import Product, Recommendation, RecommendationLikeShard, RecommendationChange, DataValidationError, DataConflictError, db
 from service import app
 from werkzeug.exceptions import NotFound
 
@@ -189,4 +190,343 @@ class TestRecommendation(unittest.TestCase):
         Recommendation(product_a="shirt", product_b="belts", recom_type="C").create()
         recommendations = Recommendation.find_by_recommendation_type_and_product_b("C","belts")
         recommendation_list = [recommendation for recommendation in recommendations]
-        self.assertEqual(len(recommendation_list), 3)
\ No newline at end of file
+        self.assertEqual(len(recommendation_list), 3)
+
+    def test_find_page(self):
+        """ Page through Recommendations by id """
+        for product_b in ["belts", "skirts", "gloves", "socks", "hats"]:
+            Recommendation(product_a="shoes", product_b=product_b, recom_type="A", likes=0).create()
+        page, after = Recommendation.find_page(Recommendation.query, 2)
+        self.assertEqual(page, [(1, "shoes", "belts", "A", 0), (2, "shoes", "skirts", "A", 0)])
+        self.assertEqual(after, (2,))
+        page, after = Recommendation.find_page(Recommendation.query, 2, after)
+        self.assertEqual([row[0] for row in page], [3, 4])
+        page, after = Recommendation.find_page(Recommendation.query, 2, after)
+        self.assertEqual([row[0] for row in page], [5])
+        self.assertIsNone(after)
+
+    def test_find_page_by_likes(self):
+        """ Page through Recommendations by descending likes """
+        for product_b, likes in zip(["belts", "hats", "socks", "ties"], [5, 10, 5, 0]):
+            Recommendation(product_a="shoes", product_b=product_b, recom_type="A", likes=likes).create()
+        page, after = Recommendation.find_page(Recommendation.query, 2, sort="-likes")
+        self.assertEqual([(row[4], row[0]) for row in page], [(10, 2), (5, 3)])
+        page, after = Recommendation.find_page(Recommendation.query, 2, after, sort="-likes")
+        self.assertEqual([(row[4], row[0]) for row in page], [(5, 1), (0, 4)])
+        self.assertIsNone(after)
+
+    def test_create_many_skipping_existing(self):
+        """ Leave out the Recommendations that exist, also when they were created between two chunks """
+        recommendations = RecommendationFactory.build_batch(4)
+        existing = self._create_recommendation()
+        recommendations.insert(3, self._create_recommendation())
+        record = RecommendationChange.record
+        chunks = []
+
+        def create_meanwhile(*args):
+            record(*args)
+            chunks.append(len(chunks))
+            if len(chunks) == 1:
+                db.session.commit()
+                existing.create()  # another request, once the first chunk is in
+
+        with patch.object(RecommendationChange, "record", side_effect=create_meanwhile):
+            skipped = Recommendation.create_many(recommendations, chunk_size=2, skip_existing=True)
+        self.assertEqual(skipped, [recommendations[3]])
+        self.assertIsNone(recommendations[3].id)
+        self.assertEqual(len([r for r in recommendations if r.id is not None]), 4)
+        self.assertEqual(len(Recommendation.all()), 5)
+
+    def test_find_page_bad_sort(self):
+        """ Page with an unknown sort order """
+        self.assertRaises(DataValidationError, Recommendation.find_page, Recommendation.query, 2, None, "name")
+
+    def test_create_many_recommendations(self):
+        """ Create Recommendations in chunks """
+        recommendations = RecommendationFactory.build_batch(5)
+        Recommendation.create_many(recommendations, chunk_size=2)
+        ids = [recommendation.id for recommendation in recommendations]
+        self.assertEqual(len(set(ids)), 5)
+        self.assertEqual(sorted(r.id for r in Recommendation.all()), sorted(ids))
+        for recommendation in recommendations:
+            found = Recommendation.find(recommendation.id)
+            self.assertEqual(found.product_a, recommendation.product_a)
+            self.assertEqual(found.likes, recommendation.likes)
+
+    def test_deserialize_bad_likes(self):
+        """ Test deserialization of likes that are not a number """
+        data = {"product_a": "shoes", "product_b": "belts", "recom_type": "A", "likes": "many"}
+        recommendation = Recommendation()
+        self.assertRaises(DataValidationError, recommendation.deserialize, data)
+
+    def test_deserialize_bad_product(self):
+        """ Test deserialization of a product that is not a string """
+        data = {"product_a": None, "product_b": "belts", "recom_type": "A", "likes": 0}
+        recommendation = Recommendation()
+        self.assertRaises(DataValidationError, recommendation.deserialize, data)
+
+    def test_add_likes(self):
+        """ Add likes to a Recommendation """
+        recommendation = self._create_recommendation()
+        recommendation.create()
+        self.assertEqual(Recommendation.add_likes(recommendation.id)["likes"], 1)
+        self.assertEqual(Recommendation.add_likes(recommendation.id, 4)["likes"], 5)
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 5)
+        self.assertIsNone(Recommendation.add_likes(0))
+
+    def test_add_likes_many_in_id_order(self):
+        """ Update the Recommendations of a batch of likes in id order """
+        recommendations = RecommendationFactory.build_batch(3)
+        Recommendation.create_many(recommendations)
+        ids = [recommendation.id for recommendation in recommendations]
+        before = [recommendation.likes for recommendation in recommendations]
+        with patch.object(db.session, "execute", wraps=db.session.execute) as execute:
+            Recommendation.add_likes_many({ids[2]: 1, ids[0]: 2, ids[1]: 3})
+            statements = [call for call in execute.call_args_list if len(call[0]) > 1]
+        self.assertEqual([params["rid"] for params in statements[0][0][1]], ids)
+        self.assertEqual([Recommendation.find(rid).likes for rid in ids],
+                         [likes + count for likes, count in zip(before, [2, 3, 1])])
+
+    def test_add_sharded_likes(self):
+        """ Add likes to a Recommendation through the like shards and fold them """
+        recommendation = self._create_recommendation()
+        recommendation.likes = 3
+        recommendation.create()
+        for expected in range(4, 14):
+            self.assertEqual(Recommendation.add_likes(recommendation.id, shards=4)["likes"], expected)
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 3)
+        self.assertEqual(RecommendationLikeShard.total(recommendation.id), 10)
+        self.assertIsNone(Recommendation.add_likes(0, shards=4))
+
+        self.assertEqual(Recommendation.fold_likes(), 10)
+        self.assertEqual(Recommendation.find(recommendation.id).likes, 13)
+        self.assertEqual(RecommendationLikeShard.total(recommendation.id), 0)
+        self.assertEqual(Recommendation.fold_likes(), 0)
+
+    def test_fold_likes_in_chunks(self):
+        """ Fold the like shards a chunk at a time and delete them """
+        recommendations = RecommendationFactory.build_batch(3)
+        Recommendation.create_many(recommendations)
+        before = {recommendation.id: recommendation.likes for recommendation in recommendations}
+        for recommendation_id in before:
+            for shard in range(3):
+                RecommendationLikeShard.add(recommendation_id, shard, shard + 1)
+        RecommendationLikeShard.add(recommendations[0].id, 3, 0)
+        db.session.commit()
+        self.assertEqual(Recommendation.fold_likes(chunk_size=2), 18)
+        self.assertEqual(RecommendationLikeShard.query.count(), 0)
+        for recommendation_id, likes in before.items():
+            self.assertEqual(Recommendation.find(recommendation_id).likes, likes + 6)
+        self.assertEqual(Recommendation.fold_likes(chunk_size=2), 0)
+
+    def test_delete_a_sharded_recommendation(self):
+        """ Delete a Recommendation together with its like shards """
+        recommendation = self._create_recommendation()
+        recommendation.create()
+        Recommendation.add_likes(recommendation.id, shards=2)
+        recommendation.delete()
+        self.assertEqual(RecommendationLikeShard.query.count(), 0)
+
+    def test_find_top_for_product(self):
+        """ Find the most liked Recommendations for a Product A """
+        for product_b, recom_type, likes in [("belts", "A", 5), ("socks", "U", 9), ("hats", "A", 7),
+                                             ("pants", "A", 1)]:
+            Recommendation(product_a="shoes", product_b=product_b, recom_type=recom_type, likes=likes).create()
+        Recommendation(product_a="gloves", product_b="hats", recom_type="A", likes=99).create()
+        top = Recommendation.find_top_for_product("shoes", 3)
+        self.assertEqual([r.product_b for r in top], ["socks", "hats", "belts"])
+        top = Recommendation.find_top_for_product("shoes", 2, "A")
+        self.assertEqual([r.product_b for r in top], ["hats", "belts"])
+
+    def test_find_graph(self):
+        """ Find the products a few Recommendations away from a Product """
+        for product_a, product_b, recom_type, likes in [
+                ("shoes", "socks", "A", 5), ("shoes", "hats", "A", 3), ("socks", "belts", "A", 4),
+                ("hats", "belts", "A", 2), ("belts", "shoes", "A", 1), ("socks", "ties", "U", 1)]:
+            Recommendation(product_a=product_a, product_b=product_b, recom_type=recom_type, likes=likes).create()
+        edges, products = Recommendation.find_graph("shoes", 2, 10)
+        self.assertEqual(products, [("belts", 2, 6), ("socks", 1, 5), ("hats", 1, 3), ("ties", 2, 1)])
+        self.assertEqual(len(edges), 5)
+        self.assertEqual(edges[0][1:], ("shoes", "socks", "A", 5))
+        edges, products = Recommendation.find_graph("shoes", 3, 10)
+        self.assertEqual(len(products), 4)  # the way back to shoes is followed but shoes is not a result
+        self.assertEqual(len(edges), 6)
+        _, products = Recommendation.find_graph("shoes", 1, 10)
+        self.assertEqual(products, [("socks", 1, 5), ("hats", 1, 3)])
+        _, products = Recommendation.find_graph("shoes", 2, 1)
+        self.assertEqual(products, [("socks", 1, 5), ("belts", 2, 4)])
+        _, products = Recommendation.find_graph("shoes", 2, 10, ["A"])
+        self.assertEqual([product for product, _, _ in products], ["belts", "socks", "hats"])
+        _, products = Recommendation.find_graph("shoes", 2, 10, max_products=2)
+        self.assertEqual(products, [("socks", 1, 5), ("hats", 1, 3)])
+        self.assertEqual(Recommendation.find_graph("gloves", 2, 10), ([], []))
+
+    def test_find_by_filters(self):
+        """ Find Recommendations matching several filters """
+        Recommendation(product_a="shoes", product_b="belts", recom_type="A").create()
+        Recommendation(product_a="shoes", product_b="socks", recom_type="A").create()
+        Recommendation(product_a="shoes", product_b="belts", recom_type="U").create()
+        self.assertEqual(Recommendation.find_by_filters(product_a="shoes").count(), 3)
+        self.assertEqual(Recommendation.find_by_filters(product_b="belts", recom_type="A").count(), 1)
+        self.assertEqual(Recommendation.find_by_filters(product_a="shoes", ids=[1, 3]).count(), 2)
+        self.assertEqual(Recommendation.find_by_filters().count(), 3)
+        self.assertEqual(Recommendation.find_by_filters(product_b=["belts", "socks"], recom_type="A").count(), 2)
+        self.assertEqual(Recommendation.find_by_filters(recom_type=["U", "C"]).count(), 1)
+        Recommendation.add_likes(2, 4)
+        self.assertEqual(Recommendation.find_by_filters(product_a="shoes", min_likes=1).count(), 1)
+
+    def test_delete_many_recommendations(self):
+        """ Delete the Recommendations of a query in chunks """
+        recommendations = [Recommendation(product_a=product_a, product_b="belts-{}".format(number), recom_type="A",
+                                          likes=0)
+                           for number, product_a in enumerate(["shoes"] * 5 + ["hats"] * 2)]
+        Recommendation.create_many(recommendations)
+        Recommendation.add_likes(recommendations[0].id, shards=2)
+        deleted = Recommendation.delete_many(Recommendation.find_by_product_a("shoes"), chunk_size=2)
+        self.assertEqual(deleted, 5)
+        self.assertEqual([r.product_a for r in Recommendation.all()], ["hats", "hats"])
+        self.assertEqual(RecommendationLikeShard.query.count(), 0)
+
+    def test_create_a_duplicate_recommendation(self):
+        """ Refuse to create or save a second Recommendation of the same products and type """
+        self._create_recommendation().create()
+        self.assertRaises(DataConflictError, self._create_recommendation().create)
+        other = self._create_recommendation()
+        other.product_b = "socks"
+        other.create()
+        other.product_b = self._create_recommendation().product_b
+        self.assertRaises(DataConflictError, other.save)
+        batch = RecommendationFactory.build_batch(2) + [self._create_recommendation()]
+        self.assertRaises(DataConflictError, Recommendation.create_many, batch)
+        self.assertEqual(len(Recommendation.all()), 2)
+
+    def test_upsert_recommendations(self):
+        """ Create Recommendations or add their likes to the existing ones """
+        existing = Recommendation(product_a="shoes", product_b="socks", recom_type="A", likes=2)
+        existing.create()
+        results = Recommendation.upsert([
+            Recommendation(product_a="shoes", product_b="socks", recom_type="A", likes=3),
+            Recommendation(product_a="shoes", product_b="belts", recom_type="A", likes=1),
+            Recommendation(product_a="shoes", product_b="belts", recom_type="A", likes=4),
+        ], chunk_size=1)
+        self.assertEqual([created for _, created in results], [False, True, False])
+        self.assertEqual(results[0][0]["id"], existing.id)
+        self.assertEqual([data["likes"] for data, _ in results], [5, 5, 5])
+        self.assertEqual(results[1][0]["id"], results[2][0]["id"])
+        self.assertEqual(Recommendation.find(existing.id).likes, 5)
+        self.assertEqual(Recommendation.find_version(existing.id), 2)
+        self.assertEqual(len(Recommendation.all()), 2)
+        self.assertEqual(Recommendation.upsert([]), [])
+
+    def test_deduplicate(self):
+        """ Merge the Recommendations that share their products and type """
+        db.engine.execute("DROP INDEX ix_recommendation_product_pair")
+        recommendations = [Recommendation(product_a=product_a, product_b="socks", recom_type="A", likes=likes)
+                           for product_a, likes in [("shoes", 1), ("hats", 4), ("shoes", 2), ("shoes", 3)]]
+        for recommendation in recommendations:
+            recommendation.create()
+        Recommendation.add_likes(recommendations[2].id, shards=2)
+        self.assertEqual(Recommendation.deduplicate(chunk_size=1), 2)
+        self.assertEqual(Recommendation.find(recommendations[0].id).likes, 7)
+        self.assertEqual(Recommendation.find(recommendations[1].id).likes, 4)
+        self.assertEqual(len(Recommendation.all()), 2)
+        self.assertEqual(RecommendationLikeShard.query.count(), 0)
+        self.assertEqual(Recommendation.deduplicate(), 0)
+
+    def test_deduplicate_keeps_concurrent_likes(self):
+        """ Keep the likes that come in while the duplicates are merged """
+        db.engine.execute("DROP INDEX ix_recommendation_product_pair")
+        keeper = Recommendation(product_a="shoes", product_b="socks", recom_type="A", likes=10)
+        keeper.create()
+        loser = Recommendation(product_a="shoes", product_b="socks", recom_type="A", likes=5)
+        loser.create()
+        ids = (keeper.id, loser.id)
+        execute = db.session.execute
+        liked = []
+
+        def execute_and_like(statement, *args, **kwargs):
+            result = execute(statement, *args, **kwargs)
+            if not liked and "recom_type" in str(statement) and "ORDER BY" in str(statement):
+                # one like on each row lands after the duplicates were read
+                for rid in ids:
+                    execute(Recommendation.__table__.update().where(Recommendation.id == rid)
+                            .values(likes=Recommendation.likes + 1))
+                liked.append(True)
+            return result
+
+        with patch.object(db.session, "execute", side_effect=execute_and_like):
+            self.assertEqual(Recommendation.deduplicate(), 1)
+        self.assertEqual(liked, [True])
+        db.session.expire_all()
+        self.assertEqual(Recommendation.find(ids[0]).likes, 17)
+
+    def test_store_product_ids(self):
+        """ Store the products of a Recommendation as ids and read back their names """
+        recommendation = Recommendation(product_a="shoes", product_b="socks", recom_type="A", likes=0)
+        recommendation.create()
+        ids = Product.ids_for(["shoes", "socks"])
+        self.assertEqual((recommendation.product_a_id, recommendation.product_b_id), (ids["shoes"], ids["socks"]))
+        Product.interned.clear()
+        db.session.expire_all()
+        found = Recommendation.find(recommendation.id)
+        self.assertEqual((found.product_a, found.product_b), ("shoes", "socks"))
+        found.product_b = "shoes"
+        found.save()
+        self.assertEqual(Recommendation.find(recommendation.id).product_b_id, ids["shoes"])
+        self.assertEqual(Product.query.count(), 2)
+
+    def test_intern_product_names(self):
+        """ Add products once and look them up without adding them """
+        self.assertEqual(Product.ids_for(["shoes"]), {})
+        ids = Product.ids_for(["shoes", "hats"], create=True)
+        self.assertEqual(Product.ids_for(["shoes", "hats", "socks"], create=True)["shoes"], ids["shoes"])
+        Product.interned.clear()
+        self.assertEqual(Product.ids_for(["shoes", "belts"]), {"shoes": ids["shoes"]})
+        self.assertEqual(Product.names_for([ids["hats"]]), {ids["hats"]: "hats"})
+        self.assertEqual(Product.query.count(), 3)
+
+    def test_find_an_unknown_product(self):
+        """ Find no Recommendations for a product that does not exist """
+        self._create_recommendation().create()
+        self.assertEqual(Recommendation.find_by_product_a("socks").count(), 0)
+        self.assertEqual(Recommendation.find_by_filters(product_b=["socks", "shoes"]).count(), 0)
+        self.assertEqual(Product.query.count(), 2)
+
+    def test_truncate(self):
+        """ Delete every Recommendation at once """
+        Recommendation.create_many(RecommendationFactory.build_batch(3))
+        Recommendation.truncate()
+        self.assertEqual(Recommendation.all(), [])
+
+    def test_versions(self):
+        """ Bump the version of a Recommendation on every write """
+        recommendation = self._create_recommendation()
+        recommendation.create()
+        self.assertEqual(Recommendation.find_version(recommendation.id), 1)
+        recommendation.product_b = "socks"
+        recommendation.save()
+        self.assertEqual(Recommendation.find_version(recommendation.id), 2)
+        Recommendation.add_likes(recommendation.id)
+        Recommendation.add_likes_many({recommendation.id: 2})
+        self.assertEqual(Recommendation.find_version(recommendation.id), 4)
+        Recommendation.add_likes(recommendation.id, shards=2)
+        self.assertEqual(Recommendation.find_version(recommendation.id), 4)
+        Recommendation.fold_likes()
+        self.assertEqual(Recommendation.find_version(recommendation.id), 5)
+        recommendation.delete()
+        self.assertIsNone(Recommendation.find_version(recommendation.id))
+
+    def test_count_changes(self):
+        """ Count every write that changes the Recommendations """
+        self.assertEqual(RecommendationChange.query.count(), RecommendationChange.SHARDS)
+        self.assertEqual(RecommendationChange.total(), 0)
+        recommendation = self._create_recommendation()
+        recommendation.create()
+        Recommendation.create_many(RecommendationFactory.build_batch(3))
+        recommendation.save()
+        Recommendation.add_likes(recommendation.id)
+        self.assertEqual(RecommendationChange.total(), 3)  # the likes are counted by record_likes()
+        Recommendation.record_likes()
+        recommendation.delete()
+        Recommendation.truncate()
+        self.assertEqual(RecommendationChange.total(), 6)
@@ -0,0 +1,72 @@
+"""
+Test cases for the Connection Pool
+
+"""
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from sqlalchemy import create_engine
+from service.pool import TimedQueuePool, engine_options, pool_stats
+
+CONFIG = {
+    "DB_POOL_SIZE": 3,
+    "DB_MAX_OVERFLOW": 2,
+    "DB_POOL_TIMEOUT": 10,
+    "DB_POOL_RECYCLE": 600,
+    "DB_POOL_PRE_PING": True,
+}
+
+######################################################################
+#  C O N N E C T I O N   P O O L   T E S T   C A S E S
+######################################################################
+class TestPool(unittest.TestCase):
+    """ Test Cases for the Connection Pool """
+
+    def setUp(self):
+        """ This runs before each test """
+        self.directory = tempfile.TemporaryDirectory()
+        uri = "sqlite:///" + os.path.join(self.directory.name, "pool.db")
+        self.engine = create_engine(uri, poolclass=TimedQueuePool, pool_size=2, max_overflow=1)
+
+    def tearDown(self):
+        """ This runs after each test """
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_engine_options(self):
+        """ Build the pool options from the settings """
+        options = engine_options(dict(CONFIG, SQLALCHEMY_DATABASE_URI="postgres://localhost/db"))
+        self.assertEqual(options["poolclass"], TimedQueuePool)
+        self.assertEqual(options["pool_size"], 3)
+        self.assertEqual(options["max_overflow"], 2)
+        self.assertEqual(options["pool_timeout"], 10)
+        self.assertEqual(options["pool_recycle"], 600)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertEqual(engine_options(dict(CONFIG, SQLALCHEMY_DATABASE_URI="sqlite://")), {})
+
+    def test_pool_stats(self):
+        """ Report checked out connections and checkout waits """
+        first = self.engine.connect()
+        second = self.engine.connect()
+        third = self.engine.connect()
+        stats = pool_stats(self.engine)
+        self.assertEqual(stats["class"], "TimedQueuePool")
+        self.assertEqual(stats["checked_out"], 3)
+        self.assertEqual(stats["overflow"], 1)
+        self.assertEqual(stats["checkouts"], 3)
+        self.assertGreaterEqual(stats["wait_ms_max"], 0)
+        for conn in (first, second, third):
+            conn.close()
+        self.assertEqual(pool_stats(self.engine)["checked_out"], 0)
+
+    def test_connections_are_not_shared_after_fork(self):
+        """ Replace a pooled connection in a process that did not open it """
+        with self.engine.connect() as conn:
+            parent = conn.connection.connection
+        with self.engine.connect() as conn:
+            self.assertIs(conn.connection.connection, parent)
+        with patch("service.pool.os.getpid", return_value=os.getpid() + 1):
+            with self.engine.connect() as conn:
+                self.assertIsNot(conn.connection.connection, parent)
+                self.assertEqual(conn.execute("SELECT 1").scalar(), 1)
@@ -6,9 +6,14 @@ Test cases can be run with the following:
   coverage report -m
 """
 import os
+import gzip
+import json
 import logging
-from unittest import TestCase
+from unittest import TestCase, skipIf
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock, patch
+import brotli
+import msgpack
 from flask_api import status  # HTTP Status Codes
 from service.routes import app, init_db
 from .factories import RecommendationFactory
@@ -29,6 +34,7 @@ class TestRecommendationServer(TestCase):
         app.config["TESTING"] = True
         app.config["DEBUG"] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        app.config["LIKES_FOLD_INTERVAL_MS"] = 0  # count every like on the spot, without a fold thread
         app.logger.setLevel(logging.CRITICAL)
         init_db()
 
@@ -37,12 +43,16 @@ class TestRecommendationServer(TestCase):
         """ Runs before each test """
         db.drop_all()  # clean up the last tests
         db.create_all()  # create new tables
-        self.app = app.test_client()
+        self.app = self.client()
 
     def tearDown(self):
         db.session.remove()
         db.drop_all()
 
+    def client(self):
+        """ Returns the client the tests send their requests with """
+        return app.test_client()
+
     def _create_recommendation_array(self, count):
         recommendations = []
         for _ in range(count):
@@ -300,6 +310,430 @@ class TestRecommendationServer(TestCase):
         # check the data just to be sure
         for recommendation in data:
             self.assertEqual(recommendation["product_b"], test_product_b)
-            
-            
 
+    def test_list_recommendations_by_page(self):
+        """ Page through the Recommendations with limit and cursor """
+        recommendations = self._create_recommendation_array(5)
+        ids = []
+        url = "/recommendations?limit=2"
+        while url:
+            resp = self.app.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            data = resp.get_json()
+            self.assertLessEqual(len(data), 2)
+            ids.extend(recommendation["id"] for recommendation in data)
+            link = resp.headers.get("Link")
+            url = link[1:link.index(">")] if link else None
+        self.assertEqual(ids, [recommendation.id for recommendation in recommendations])
+
+    def test_list_recommendations_by_page_with_filter(self):
+        """ Page through filtered Recommendations sorted by likes """
+        for product_b, likes in zip(["belts", "hats", "socks"], [1, 3, 2]):
+            Recommendation(product_a="shoes", product_b=product_b, recom_type="A", likes=likes).create()
+        Recommendation(product_a="hats", product_b="belts", recom_type="A", likes=9).create()
+        resp = self.app.get("/recommendations", query_string="product_a=shoes&sort=-likes&limit=2")
+        self.assertEqual([r["likes"] for r in resp.get_json()], [3, 2])
+        link = resp.headers["Link"]
+        self.assertIn("product_a=shoes", link)
+        resp = self.app.get(link[1:link.index(">")])
+        self.assertEqual([r["likes"] for r in resp.get_json()], [1])
+        self.assertNotIn("Link", resp.headers)
+
+    def test_list_recommendations_bad_cursor(self):
+        """ Page with a bad cursor or limit """
+        resp = self.app.get("/recommendations", query_string="limit=2&cursor=garbage")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/recommendations", query_string="limit=two")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/recommendations", query_string="limit=2&sort=name")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stream_recommendations(self):
+        """ Stream the Recommendations as NDJSON """
+        recommendations = self._create_recommendation_array(5)
+        resp = self.app.get("/recommendations", headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 5)
+        data = [json.loads(line) for line in lines]
+        self.assertEqual(data, [recommendation.serialize() for recommendation in recommendations])
+
+    def test_stream_recommendations_with_filter(self):
+        """ Stream the Recommendations of one Product A as NDJSON """
+        Recommendation(product_a="shoes", product_b="belts", recom_type="A", likes=0).create()
+        Recommendation(product_a="hats", product_b="belts", recom_type="A", likes=0).create()
+        resp = self.app.get(
+            "/recommendations", query_string="product_a=hats", headers={"Accept": "application/x-ndjson"}
+        )
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["product_a"], "hats")
+
+    def test_create_recommendations_in_bulk(self):
+        """ Create many Recommendations in one request """
+        test_recommendations = RecommendationFactory.build_batch(3)
+        body = [recommendation.serialize() for recommendation in test_recommendations]
+        resp = self.app.post("/recommendations/bulk", json=body, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        results = resp.get_json()
+        self.assertEqual(len(results), 3)
+        for result, test_recommendation in zip(results, test_recommendations):
+            self.assertEqual(result["status"], status.HTTP_201_CREATED)
+            created = result["recommendation"]
+            self.assertEqual(created["product_a"], test_recommendation.product_a)
+            resp = self.app.get("/recommendations/{}".format(created["id"]))
+            self.assertEqual(resp.get_json(), created)
+
+    def test_create_recommendations_in_bulk_with_bad_items(self):
+        """ Create many Recommendations and report the bad ones """
+        taken = self._create_recommendation()
+        taken.create()
+        taken = taken.serialize()
+        good = RecommendationFactory().serialize()
+        body = [good, {"product_a": "shoes"}, good, taken]
+        resp = self.app.post("/recommendations/bulk", json=body, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        results = resp.get_json()
+        self.assertEqual([result["status"] for result in results], [201, 400, 409, 409])
+        self.assertIn("missing", results[1]["message"])
+        self.assertIn("already exists", results[3]["message"])
+        self.assertEqual(len(Recommendation.all()), 2)
+
+    def test_create_recommendations_in_bulk_from_ndjson(self):
+        """ Create many Recommendations from NDJSON """
+        lines = [json.dumps(RecommendationFactory().serialize()) for _ in range(3)]
+        resp = self.app.post(
+            "/recommendations/bulk", data="\n".join(lines + ["not json"]), content_type="application/x-ndjson"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result["status"] for result in resp.get_json()], [201, 201, 201, 400])
+        self.assertEqual(len(Recommendation.all()), 3)
+
+    def test_create_recommendations_in_bulk_not_a_list(self):
+        """ Create many Recommendations from a body that is not an array """
+        resp = self.app.post(
+            "/recommendations/bulk", json={"product_a": "shoes"}, content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_duplicate_recommendation(self):
+        """ Create or update a Recommendation onto one that exists """
+        body = self._create_recommendation().serialize()
+        resp = self.app.post("/recommendations", json=body, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.app.post("/recommendations", json=body, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(resp.get_json()["error"], "Conflict")
+        other = dict(body, product_b="socks")
+        resp = self.app.post("/recommendations", json=other, content_type="application/json")
+        resp = self.app.put("/recommendations/{}".format(resp.get_json()["id"]), json=body,
+                            content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(len(Recommendation.all()), 2)
+
+    def test_upsert_recommendation(self):
+        """ Create a Recommendation or add its likes to the existing one """
+        body = dict(self._create_recommendation().serialize(), likes=2)
+        resp = self.app.post("/recommendations/upsert", json=body, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        created = resp.get_json()
+        self.assertIn(str(created["id"]), resp.headers["Location"])
+        resp = self.app.post("/recommendations/upsert", json=body, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), dict(created, likes=4))
+        resp = self.app.post("/recommendations/upsert", json={"product_a": "shoes"}, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upsert_recommendations_in_bulk(self):
+        """ Create or merge many Recommendations and report the bad ones """
+        existing = self._create_recommendation()
+        existing.create()
+        new = RecommendationFactory().serialize()
+        body = [existing.serialize(), new, {"product_a": "shoes"}, new]
+        resp = self.app.post("/recommendations/upsert", json=body, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        results = resp.get_json()
+        self.assertEqual([result["status"] for result in results], [200, 201, 400, 200])
+        self.assertEqual(results[0]["recommendation"]["id"], existing.id)
+        self.assertEqual(results[3]["recommendation"]["likes"], new["likes"] * 2)
+        self.assertEqual(len(Recommendation.all()), 2)
+        lines = "\n".join(json.dumps(item) for item in body[:2])
+        resp = self.app.post("/recommendations/upsert", data=lines, content_type="application/x-ndjson")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([result["status"] for result in resp.get_json()], [200, 200])
+
+    def test_like_recommendation_not_found(self):
+        """ Like a Recommendation that is not there """
+        resp = self.app.put("/recommendations/0/likes", content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def _like_concurrently(self, recommendation_id, count, workers=16):
+        def like(_):
+            client = self.client()
+            resp = client.put("/recommendations/{}/likes".format(recommendation_id))
+            return resp.status_code
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            codes = list(executor.map(like, range(count)))
+        self.assertEqual(codes, [status.HTTP_200_OK] * count)
+
+    @skipIf(DATABASE_URI.startswith("sqlite"), "SQLite allows only one writer at a time")
+    def test_like_recommendation_concurrently(self):
+        """ Like a Recommendation from many threads without losing a like """
+        test_recommendation = self._create_recommendation()
+        test_recommendation.create()
+        self._like_concurrently(test_recommendation.id, 2000)
+        db.session.remove()  # forget the copy loaded by this thread
+        resp = self.app.get("/recommendations/{}".format(test_recommendation.id))
+        self.assertEqual(resp.get_json()["likes"], 2000)
+
+    @skipIf(DATABASE_URI.startswith("sqlite"), "SQLite allows only one writer at a time")
+    def test_like_recommendation_concurrently_with_shards(self):
+        """ Like a Recommendation through the like shards from many threads """
+        test_recommendation = self._create_recommendation()
+        test_recommendation.create()
+        with patch.dict(app.config, LIKE_SHARDS=8, LIKES_FOLD_INTERVAL_MS=0):
+            self._like_concurrently(test_recommendation.id, 2000)
+            db.session.remove()  # forget the copy loaded by this thread
+            resp = self.app.get("/recommendations/{}".format(test_recommendation.id))
+            self.assertEqual(resp.get_json()["likes"], 2000)
+        Recommendation.fold_likes()
+        self.assertEqual(Recommendation.find(test_recommendation.id).likes, 2000)
+
+    def test_list_top_recommendations(self):
+        """ Get the most liked Recommendations for a product """
+        for product_b, recom_type, likes in [("belts", "A", 5), ("socks", "U", 9), ("hats", "A", 7)]:
+            Recommendation(product_a="shoes", product_b=product_b, recom_type=recom_type, likes=likes).create()
+        resp = self.app.get("/products/shoes/recommendations", query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["product_b"] for r in resp.get_json()], ["socks", "hats"])
+        resp = self.app.get("/products/shoes/recommendations", query_string="type=A")
+        self.assertEqual([r["product_b"] for r in resp.get_json()], ["hats", "belts"])
+        resp = self.app.get("/products/hats/recommendations")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_list_top_recommendations_follow_likes(self):
+        """ Rank the Recommendations of a product again after a like """
+        for product_b, likes in zip(["belts", "hats"], [1, 2]):
+            Recommendation(product_a="shoes", product_b=product_b, recom_type="A", likes=likes).create()
+        resp = self.app.get("/products/shoes/recommendations", query_string="limit=1")
+        first = resp.get_json()[0]
+        self.assertEqual(first["likes"], 2)
+        other = first["id"] - 1
+        for _ in range(2):
+            self.app.put("/recommendations/{}/likes".format(other))
+        resp = self.app.get("/products/shoes/recommendations", query_string="limit=1")
+        self.assertEqual(resp.get_json()[0]["id"], other)
+
+    def test_list_top_recommendations_bad_limit(self):
+        """ Get the top Recommendations with a bad limit """
+        resp = self.app.get("/products/shoes/recommendations", query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_recommendation_graph(self):
+        """ Get the products a few Recommendations away from a product """
+        for product_a, product_b, recom_type, likes in [
+                ("shoes", "socks", "A", 5), ("shoes", "hats", "A", 3), ("socks", "belts", "A", 4),
+                ("hats", "belts", "A", 2), ("socks", "ties", "U", 1)]:
+            Recommendation(product_a=product_a, product_b=product_b, recom_type=recom_type, likes=likes).create()
+        resp = self.app.get("/products/shoes/graph", query_string="depth=2&fanout=5")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual((data["product"], data["depth"], data["fanout"]), ("shoes", 2, 5))
+        self.assertEqual(data["products"][0], {"product": "belts", "depth": 2, "score": 6})
+        self.assertEqual(len(data["recommendations"]), 5)
+        self.assertEqual(set(data["recommendations"][0]), {"id", "product_a", "product_b", "recom_type", "likes"})
+        resp = self.app.get("/products/shoes/graph", query_string="depth=9&type=A")
+        data = resp.get_json()
+        self.assertEqual(data["depth"], app.config["GRAPH_MAX_DEPTH"])
+        self.assertEqual([p["product"] for p in data["products"]], ["belts", "socks", "hats"])
+        resp = self.app.get("/products/shoes/graph", headers={"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.app.get("/products/gloves/graph")
+        self.assertEqual(resp.get_json()["products"], [])
+
+    def test_get_recommendation_graph_bad_depth(self):
+        """ Get the recommendation graph with a bad depth or fanout """
+        for query_string in ["depth=0", "depth=two", "fanout=-1"]:
+            resp = self.app.get("/products/shoes/graph", query_string=query_string)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_recommendations_by_filter(self):
+        """ Delete the Recommendations matching the filters """
+        for product_a, recom_type in [("shoes", "A"), ("shoes", "U"), ("hats", "A")]:
+            Recommendation(product_a=product_a, product_b="belts", recom_type=recom_type, likes=0).create()
+        resp = self.app.delete("/recommendations", query_string="product_a=shoes&recom_type=A")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"deleted": 1})
+        resp = self.app.delete("/recommendations", query_string="id=2,3,99")
+        self.assertEqual(resp.get_json(), {"deleted": 2})
+        self.assertEqual(Recommendation.all(), [])
+
+    def test_delete_all_recommendations(self):
+        """ Delete every Recommendation only when asked for all """
+        self._create_recommendation_array(3)
+        resp = self.app.delete("/recommendations")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.delete("/recommendations", query_string="id=one")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.delete("/recommendations", query_string="all=true")
+        self.assertEqual(resp.get_json(), {"deleted": 3})
+        self.assertEqual(self.app.get("/recommendations").get_json(), [])
+
+    def test_truncate_recommendations(self):
+        """ Truncate the Recommendations """
+        self._create_recommendation_array(3)
+        resp = self.app.delete("/recommendations/truncate")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.app.get("/recommendations").get_json(), [])
+
+    def test_get_recommendation_not_modified(self):
+        """ Get a Recommendation again with its ETag """
+        test_recommendation = self._create_recommendation_array(1)[0]
+        url = "/recommendations/{}".format(test_recommendation.id)
+        resp = self.app.get(url)
+        etag = resp.headers["ETag"]
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        self.assertEqual(resp.data, b"")
+        self.app.put("{}/likes".format(url))
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        self.assertEqual(resp.get_json()["likes"], test_recommendation.likes + 1)
+
+    def test_list_recommendations_not_modified(self):
+        """ List the Recommendations again with their ETag """
+        self._create_recommendation_array(3)
+        for url in ["/recommendations", "/recommendations?limit=2", "/products/shoes/recommendations"]:
+            etag = self.app.get(url).headers["ETag"]
+            resp = self.app.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        ndjson = self.app.get("/recommendations", headers={"Accept": "application/x-ndjson"})
+        self.assertNotEqual(ndjson.headers["ETag"], etag)
+        recommendation = Recommendation.all()[0]
+        self.app.delete("/recommendations/{}".format(recommendation.id))
+        resp = self.app.get("/recommendations", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+
+    def test_list_recommendations_in_columns(self):
+        """ List the Recommendations as one array per field """
+        recommendations = self._create_recommendation_array(3)
+        resp = self.app.get("/recommendations", headers={"Accept": "application/vnd.recommendations.columnar+json"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.content_type, "application/vnd.recommendations.columnar+json")
+        data = json.loads(resp.data)
+        self.assertEqual(data["id"], [r.id for r in recommendations])
+        self.assertEqual(data["product_a"], [r.product_a for r in recommendations])
+        self.assertEqual(data["likes"], [r.likes for r in recommendations])
+        resp = self.app.get("/recommendations?product_a=none",
+                            headers={"Accept": "application/vnd.recommendations.columnar+json"})
+        self.assertEqual(json.loads(resp.data)["id"], [])
+
+    def test_list_recommendations_in_msgpack(self):
+        """ List the Recommendations as MessagePack """
+        self._create_recommendation_array(3)
+        expected = self.app.get("/recommendations").get_json()
+        resp = self.app.get("/recommendations", headers={"Accept": "application/msgpack"})
+        self.assertEqual(resp.content_type, "application/msgpack")
+        self.assertEqual(msgpack.unpackb(resp.data, raw=False), expected)
+        resp = self.app.get("/products/none/recommendations", headers={"Accept": "application/msgpack"})
+        self.assertEqual(msgpack.unpackb(resp.data, raw=False), [])
+
+    def test_compress_recommendations(self):
+        """ Compress large lists in the coding the client accepts """
+        self._create_recommendation_array(40)
+        plain = self.app.get("/recommendations")
+        self.assertNotIn("Content-Encoding", plain.headers)
+        resp = self.app.get("/recommendations", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertEqual(resp.headers["ETag"], plain.headers["ETag"][:-1] + '-gzip"')
+        resp = self.app.get("/recommendations", headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(resp.data), plain.data)
+        headers = {"Accept-Encoding": "gzip", "If-None-Match": resp.headers["ETag"]}
+        resp = self.app.get("/recommendations", headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        # a single Recommendation is under the threshold
+        resp = self.app.get("/recommendations/{}".format(Recommendation.all()[0].id),
+                            headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_compress_streamed_recommendations(self):
+        """ Compress a streamed list as it streams """
+        self._create_recommendation_array(3)
+        headers = {"Accept": "application/x-ndjson"}
+        plain = self.app.get("/recommendations", headers=headers)
+        headers["Accept-Encoding"] = "gzip"
+        resp = self.app.get("/recommendations", headers=headers)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+
+    def test_list_recommendations_schema(self):
+        """ List the Recommendations exactly as they serialize """
+        self._create_recommendation_array(5)
+        expected = [recommendation.serialize() for recommendation in Recommendation.all()]
+        self.assertEqual(self.app.get("/recommendations").get_json(), expected)
+        self.assertEqual(self.app.get("/recommendations?limit=3").get_json(), expected[:3])
+        resp = self.app.get("/recommendations", headers={"Accept": "application/x-ndjson"})
+        self.assertEqual([json.loads(line) for line in resp.data.splitlines()], expected)
+        resp = self.app.get("/recommendations/{}".format(expected[0]["id"]))
+        self.assertEqual(resp.content_type, "application/json")
+        self.assertEqual(resp.get_json(), expected[0])
+
+    def test_list_recommendations_with_filters(self):
+        """ List the Recommendations matching several filters at once """
+        for product_a, product_b, recom_type, likes in [("shoes", "socks", "A", 5), ("shoes", "belts", "U", 9),
+                                                        ("shoes", "hats", "A", 1), ("hats", "socks", "C", 7),
+                                                        ("gloves", "socks", "A", 3)]:
+            Recommendation(product_a=product_a, product_b=product_b, recom_type=recom_type, likes=likes).create()
+        resp = self.app.get("/recommendations", query_string="product_a=shoes&recom_type=A")
+        self.assertEqual(sorted(r["product_b"] for r in resp.get_json()), ["hats", "socks"])
+        resp = self.app.get("/recommendations", query_string="product_b=socks&recom_type=A,C&sort=-likes")
+        self.assertEqual([r["likes"] for r in resp.get_json()], [7, 5, 3])
+        resp = self.app.get("/recommendations", query_string="product_a=shoes&product_a=hats&min_likes=5&sort=likes")
+        self.assertEqual([r["likes"] for r in resp.get_json()], [5, 7, 9])
+        resp = self.app.get("/recommendations", query_string="id=1,4,5&sort=-id")
+        self.assertEqual([r["id"] for r in resp.get_json()], [5, 4, 1])
+        resp = self.app.get("/recommendations", query_string="min_likes=many")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/recommendations", query_string="sort=name")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_recommendations_by_product_with_a_comma(self):
+        """ Match a product name that holds a comma literally """
+        for product_a in ["Shirt, blue", "Shirt", " blue"]:
+            Recommendation(product_a=product_a, product_b="socks", recom_type="A", likes=0).create()
+        resp = self.app.get("/recommendations", query_string={"product_a": "Shirt, blue"})
+        self.assertEqual([r["product_a"] for r in resp.get_json()], ["Shirt, blue"])
+        resp = self.app.delete("/recommendations", query_string={"product_a": "Shirt, blue"})
+        self.assertEqual(resp.get_json(), {"deleted": 1})
+        self.assertEqual(sorted(r.product_a for r in Recommendation.all()), [" blue", "Shirt"])
+
+    def test_list_recommendations_with_count(self):
+        """ Count the matching Recommendations in the same query """
+        for likes in range(5):
+            Recommendation(product_a="shoes", product_b="socks-{}".format(likes), recom_type="A", likes=likes).create()
+        resp = self.app.get("/recommendations", query_string="min_likes=1&count=true")
+        self.assertEqual(resp.headers["X-Total-Count"], "4")
+        resp = self.app.get("/recommendations", query_string="min_likes=1&count=true&limit=2&sort=-likes")
+        self.assertEqual([r["likes"] for r in resp.get_json()], [4, 3])
+        self.assertEqual(resp.headers["X-Total-Count"], "4")
+        link = resp.headers["Link"]
+        resp = self.app.get(link[1:link.index(">")])
+        self.assertEqual([r["likes"] for r in resp.get_json()], [2, 1])
+        self.assertEqual(resp.headers["X-Total-Count"], "4")
+        Recommendation.query.filter(Recommendation.likes < 3).delete()
+        db.session.commit()
+        resp = self.app.get(link[1:link.index(">")])  # the cursor is now past the last match
+        self.assertEqual(resp.get_json(), [])
+        self.assertEqual(resp.headers["X-Total-Count"], "2")
+        resp = self.app.get("/recommendations", query_string="product_a=hats&count=true")
+        self.assertEqual(resp.headers["X-Total-Count"], "0")
+        resp = self.app.get("/recommendations")
+        self.assertNotIn("X-Total-Count", resp.headers)
@@ -0,0 +1,65 @@
+"""
+Test cases for the Service Startup
+
+"""
+import os
+import sys
+import sqlite3
+import subprocess
+import tempfile
+import unittest
+
+PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(code, database_uri, *args):
+    """ Runs code in a fresh interpreter against the given database """
+    env = dict(os.environ, DATABASE_URI=database_uri)
+    return subprocess.run(
+        [sys.executable, "-c", code] + list(args),
+        cwd=PACKAGE,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        timeout=60,
+    )
+
+######################################################################
+#  S T A R T U P   T E S T   C A S E S
+######################################################################
+class TestStartup(unittest.TestCase):
+    """ Test Cases for Service Startup """
+
+    def setUp(self):
+        """ This runs before each test """
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "startup.db")
+
+    def tearDown(self):
+        """ This runs after each test """
+        self.directory.cleanup()
+
+    def test_import_does_not_touch_the_database(self):
+        """ Import the service when the database does not answer """
+        result = run("import service", "postgres://nobody@127.0.0.1:1/none")
+        self.assertEqual(result.returncode, 0, result.stdout)
+
+    def test_import_creates_no_tables(self):
+        """ Import the service without creating the schema """
+        result = run("import service", "sqlite:///" + self.path)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_create_schema(self):
+        """ Create the schema in an explicit step """
+        code = "from service.models import Recommendation; Recommendation.create_schema()"
+        result = run(code, "sqlite:///" + self.path)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        with sqlite3.connect(self.path) as conn:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertIn("recommendation", tables)
+        self.assertIn("schema_version", tables)
+        # a second run has nothing left to do
+        result = run(code, "sqlite:///" + self.path)
+        self.assertEqual(result.returncode, 0, result.stdout)